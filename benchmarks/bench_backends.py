@@ -0,0 +1,82 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare training time and accuracy of the backends of rna_cd-train.
+
+Every backend is trained as rna_cd-train does, including calibration, on
+random features with a weak signal, and its accuracy is measured on a
+separate test set of the same size. To keep the exact SVC tractable at
+large numbers of samples, every backend scores the same number of random
+candidates of its grid::
+
+    python benchmarks/bench_backends.py --samples 1000 3000 10000
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+from rna_cd.models import BACKENDS, make_param_grid, make_pipeline
+from rna_cd.search import PipelineSearch
+
+
+def make_features(n_samples: int, n_features: int, seed: int):
+    rng = np.random.RandomState(seed)
+    arr_X = rng.rand(n_samples, n_features)
+    arr_Y = np.array(["pos", "neg"] * (n_samples // 2))
+    # a weak signal in a tenth of the features, so that accuracy differs
+    arr_X[arr_Y == "pos", :n_features // 10] += 0.05
+    return arr_X, arr_Y
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, nargs="+",
+                        default=[300, 1000, 3000])
+    parser.add_argument("--features", type=int, default=498)
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--cv", type=int, default=3)
+    parser.add_argument("--n-candidates", type=int, default=20,
+                        help="random candidates scored per backend")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS,
+                        default=list(BACKENDS))
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    print("{0:>8} {1:<10} {2:>10} {3:>9}".format(
+        "samples", "backend", "time (s)", "accuracy"))
+    for n_samples in args.samples:
+        arr_X, arr_Y = make_features(n_samples, args.features, 0)
+        test_X, test_Y = make_features(n_samples, args.features, 1)
+        for backend in args.backends:
+            searcher = PipelineSearch(
+                make_pipeline(backend),
+                make_param_grid(arr_X, args.cv, backend), cv=args.cv,
+                n_jobs=args.cores, precompute_kernel=True, calibrate=True,
+                search="random", n_candidates=args.n_candidates,
+                random_state=0)
+            start = time.perf_counter()
+            searcher.fit(arr_X, arr_Y)
+            duration = time.perf_counter() - start
+            accuracy = np.mean(searcher.predict(test_X) == test_Y)
+            print("{0:>8} {1:<10} {2:>10.2f} {3:>9.4f}".format(
+                n_samples, backend, duration, accuracy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare peak memory, time to the first written row and total time of
+classification of all BAM files at once and in batches.
+
+Feature extraction is replaced by random features that are generated per
+BAM file, with a fixed cost per file, so that extraction can overlap with
+prediction. Every run is a fresh python process, and peak memory is read
+from /proc, so this only runs on Linux::
+
+    python benchmarks/bench_classify_batches.py --files 10000 100000
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+CLASSIFY_SCRIPT = """
+import json, os, sys, tempfile, time, warnings
+from pathlib import Path
+from unittest import mock
+import numpy as np
+import rna_cd.models
+from sklearn.calibration import CalibratedClassifierCV
+from rna_cd.output import HEADER, format_rows
+
+def peak_rss():
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+def process_bam(path, *args, **kwargs):
+    # roughly the cost of a cached feature lookup
+    time.sleep({file_cost})
+    return np.random.RandomState(int(path.stem)).rand({features})
+
+warnings.simplefilter("ignore")
+rng = np.random.RandomState(0)
+# calibrated, like the models of rna_cd-train
+model = CalibratedClassifierCV(rna_cd.models.make_pipeline("linear"), cv=3)
+model.fit(rng.rand(200, {features}), ["pos", "neg"] * 100)
+bams = [Path("{{0}}.bam".format(i)) for i in range({files})]
+output = Path(tempfile.mkstemp()[1])
+baseline = peak_rss()
+first_row = None
+start = time.perf_counter()
+with mock.patch("rna_cd.bam_process.process_bam", process_bam), \\
+        output.open("w") as handle:
+    handle.write(HEADER)
+    if {batch_size} is None:
+        batch = rna_cd.models.predict_labels_and_prob(
+            model, bams, cores={cores})
+        handle.write(format_rows([bam.name for bam in bams], batch))
+        first_row = time.perf_counter() - start
+    else:
+        for index, batch in rna_cd.models.iter_prediction_batches(
+                model, bams, {batch_size}, cores={cores}):
+            handle.write(format_rows(
+                [bam.name for bam in bams[index:index + len(batch)]],
+                batch))
+            if first_row is None:
+                first_row = time.perf_counter() - start
+total = time.perf_counter() - start
+os.unlink(str(output))
+print(json.dumps({{"first_row": first_row, "time": total,
+                  "peak_rss_increase_kb": peak_rss() - baseline}}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, nargs="+",
+                        default=[10000, 100000])
+    parser.add_argument("--features", type=int, default=498)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--file-cost", type=float, default=0.0,
+                        help="seconds of extraction per BAM file")
+    args = parser.parse_args()
+
+    print("{0:>8} {1:<10} {2:>15} {3:>10} {4:>20}".format(
+        "files", "mode", "first row (s)", "time (s)", "peak RSS incr. (kB)"))
+    for n_files in args.files:
+        for batch_size in (None, args.batch_size):
+            script = CLASSIFY_SCRIPT.format(
+                features=args.features, files=n_files, cores=args.cores,
+                batch_size=batch_size, file_cost=args.file_cost)
+            out = subprocess.check_output([sys.executable, "-c", script],
+                                          stderr=subprocess.DEVNULL)
+            result = json.loads(out.decode().strip().splitlines()[-1])
+            print("{0:>8} {1:<10} {2:>15.2f} {3:>10.2f} {4:>20}".format(
+                n_files, "all" if batch_size is None else
+                "batch " + str(batch_size), result["first_row"],
+                result["time"], result["peak_rss_increase_kb"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare peak memory and time of training from features in memory and from
+a memory mapped dataset.
+
+A dataset of random features with a weak signal is written once per dtype.
+Training from the dataset then reuses all of its rows, as a retraining run
+with the same BAM files does, so that only training is measured. Every run
+is a fresh python process, and peak memory is read from /proc, so this only
+runs on Linux. All runs search the same number of random candidates::
+
+    python benchmarks/bench_dataset.py --samples 30000
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from rna_cd.dataset import TrainingDataset
+
+TRAIN_SCRIPT = """
+import json, sys, time, warnings
+from pathlib import Path
+from unittest import mock
+import numpy as np
+import rna_cd.models
+from rna_cd.dataset import TrainingDataset
+# imported before the baseline, as all modes import them
+import rna_cd.search, sklearn.decomposition, sklearn.linear_model
+
+def peak_rss():
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+warnings.simplefilter("ignore")
+path = Path("{path}")
+baseline = peak_rss()
+start = time.perf_counter()
+if "{mode}" == "in memory":
+    # the features are read from the dataset, as from a cache, so that
+    # they count towards peak memory as the memory map does.
+    loaded = TrainingDataset.load(path)
+    features = np.array(loaded.arr_X)
+    labels = loaded.arr_Y
+    del loaded
+if "{mode}" == "in memory":
+    with mock.patch("rna_cd.models.make_array_set",
+                    return_value=(features, labels)):
+        searcher = rna_cd.models.train_svm_model(
+            [Path("pos.bam")], [Path("neg.bam")], chunksize=100,
+            backend="{backend}", search="random", n_candidates={candidates},
+            verbosity=0)
+else:
+    with mock.patch("rna_cd.models.update_dataset",
+                    side_effect=lambda *args, **kwargs:
+                    TrainingDataset.load(path)):
+        searcher = rna_cd.models.train_svm_model(
+            [Path("pos.bam")], [Path("neg.bam")], chunksize=100,
+            dataset=path, backend="{backend}", search="random",
+            n_candidates={candidates}, out_of_core={out_of_core},
+            verbosity=0)
+print(json.dumps({{"time": time.perf_counter() - start,
+                  "peak_rss_increase_kb": peak_rss() - baseline,
+                  "score": searcher.best_score_}}))
+"""
+
+
+def make_dataset(n_samples: int, n_features: int) -> TrainingDataset:
+    rng = np.random.RandomState(0)
+    arr_X = rng.rand(n_samples, n_features)
+    arr_Y = np.array(["pos", "neg"] * (n_samples // 2))
+    arr_X[arr_Y == "pos", :n_features // 10] += 0.05
+    return TrainingDataset(arr_X, arr_Y,
+                           ["/{0}.bam".format(i) for i in range(n_samples)],
+                           ["0:0:0"] * n_samples, 100, "chrM")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, nargs="+",
+                        default=[10000, 30000])
+    parser.add_argument("--features", type=int, default=498)
+    parser.add_argument("--backend", default="linear")
+    parser.add_argument("--n-candidates", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{0:>8} {1:<24} {2:>10} {3:>20} {4:>11}".format(
+        "samples", "mode", "time (s)", "peak RSS incr. (kB)", "best score"))
+    for n_samples in args.samples:
+        dataset = make_dataset(n_samples, args.features)
+        with tempfile.TemporaryDirectory() as tmp:
+            for dtype in ("float64", "float32"):
+                dataset.save(Path(tmp) / dtype, dtype)
+            runs = [("in memory", "float64", False),
+                    ("dataset float64", "float64", False),
+                    ("dataset float32", "float32", False),
+                    ("dataset out-of-core", "float32", True)]
+            for mode, dtype, out_of_core in runs:
+                script = TRAIN_SCRIPT.format(
+                    path=Path(tmp) / dtype, mode=mode, backend=args.backend,
+                    candidates=args.n_candidates, out_of_core=out_of_core)
+                out = subprocess.check_output(
+                    [sys.executable, "-c", script],
+                    stderr=subprocess.DEVNULL)
+                result = json.loads(out.decode().strip().splitlines()[-1])
+                print("{0:>8} {1:<24} {2:>10.2f} {3:>20} {4:>11.4f}".format(
+                    n_samples, mode, result["time"],
+                    result["peak_rss_increase_kb"], result["score"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare load time and peak memory of JSON and binary models.
+
+Every load runs in a fresh python process, so that peak memory of the
+load is not hidden by earlier allocations. Peak memory is read from
+/proc, so this only runs on Linux. Run with::
+
+    python benchmarks/bench_model_format.py --samples 1000
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from rna_cd.utils import save_sklearn_object_to_disk
+
+LOAD_SCRIPT = """
+import json, sys, time
+from pathlib import Path
+import numpy as np
+import sklearn.model_selection, sklearn.pipeline, sklearn.svm
+from rna_cd.utils import load_sklearn_object_from_disk
+
+def peak_rss():
+    # ru_maxrss may still hold the high-water mark of the forking parent,
+    # VmHWM is reset by exec.
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+baseline = peak_rss()
+start = time.perf_counter()
+model = load_sklearn_object_from_disk(Path(sys.argv[1]))
+load_time = time.perf_counter() - start
+model.predict_proba(np.random.rand(1, int(sys.argv[2])))
+print(json.dumps({"load_time": load_time,
+                  "peak_rss_increase_kb": peak_rss() - baseline}))
+"""
+
+
+def make_model(n_samples: int, n_features: int) -> GridSearchCV:
+    """A model with the same structure as train_svm_model returns"""
+    arr_X = np.random.rand(n_samples, n_features)
+    arr_Y = np.array(["pos", "neg"] * (n_samples // 2))
+    pipeline = Pipeline([("scale", StandardScaler()),
+                         ("reduce_dim", PCA()),
+                         ("svm", SVC())])
+    n_components = min(n_samples // 2, n_features)
+    param_grid = {"reduce_dim__n_components": [n_components],
+                  "svm__gamma": [0.1, 0.01],
+                  "svm__probability": [True]}
+    return GridSearchCV(pipeline, param_grid=param_grid, cv=3).fit(arr_X,
+                                                                   arr_Y)
+
+
+def measure(path: Path, n_features: int, repeats: int) -> dict:
+    results = []
+    for _ in range(repeats):
+        out = subprocess.check_output([sys.executable, "-c", LOAD_SCRIPT,
+                                       str(path), str(n_features)])
+        results.append(json.loads(out.decode()))
+    return {"load_time": min(r["load_time"] for r in results),
+            "peak_rss_increase_kb": min(r["peak_rss_increase_kb"]
+                                        for r in results),
+            "size_kb": path.stat().st_size // 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--features", type=int, default=498)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    model = make_model(args.samples, args.features)
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = Path(tmp) / "model.json"
+        binary_path = Path(tmp) / "model.rnacd"
+        save_sklearn_object_to_disk(model, json_path)
+        save_sklearn_object_to_disk(model, binary_path, binary=True)
+        print("{0:<8} {1:>10} {2:>14} {3:>20}".format(
+            "format", "size (kB)", "load time (s)", "peak RSS incr. (kB)"))
+        for name, path in (("json", json_path), ("binary", binary_path)):
+            result = measure(path, args.features, args.repeats)
+            print("{0:<8} {1:>10} {2:>14.4f} {3:>20}".format(
+                name, result["size_kb"], result["load_time"],
+                result["peak_rss_increase_kb"]))
+
+
+if __name__ == "__main__":
+    main()
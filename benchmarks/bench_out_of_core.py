@@ -0,0 +1,99 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare peak memory and time of in-memory and out-of-core training.
+
+Feature extraction is replaced by random features with a weak signal that
+are generated per BAM file, so that only training is measured. Every run
+is a fresh python process, and peak memory is read from /proc, so this only
+runs on Linux. Both modes search the same number of random candidates::
+
+    python benchmarks/bench_out_of_core.py --samples 10000 30000
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+TRAIN_SCRIPT = """
+import json, sys, time, warnings
+from pathlib import Path
+from unittest import mock
+import numpy as np
+import rna_cd.models
+# imported before the baseline, as in-memory training imports them too
+import rna_cd.search, sklearn.decomposition, sklearn.linear_model
+
+def peak_rss():
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+def iter_features(bam_files, *args):
+    for index, path in enumerate(bam_files):
+        arr = np.random.RandomState(index).rand({features})
+        if path.name.startswith("pos"):
+            arr[:{features} // 10] += 0.05
+        yield index, arr
+
+warnings.simplefilter("ignore")
+positives = [Path("pos{{0}}.bam".format(i)) for i in range({samples} // 2)]
+negatives = [Path("neg{{0}}.bam".format(i)) for i in range({samples} // 2)]
+baseline = peak_rss()
+start = time.perf_counter()
+with mock.patch("rna_cd.bam_process.iter_features", iter_features), \\
+        mock.patch("rna_cd.incremental.iter_features", iter_features):
+    searcher = rna_cd.models.train_svm_model(
+        positives, negatives, backend="{backend}", search="random",
+        n_candidates={candidates}, out_of_core={out_of_core},
+        batch_size={batch_size}, verbosity=0)
+print(json.dumps({{"time": time.perf_counter() - start,
+                  "peak_rss_increase_kb": peak_rss() - baseline,
+                  "score": searcher.best_score_}}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, nargs="+",
+                        default=[10000, 30000])
+    parser.add_argument("--features", type=int, default=498)
+    parser.add_argument("--backend", default="linear")
+    parser.add_argument("--n-candidates", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("{0:>8} {1:<12} {2:>10} {3:>20} {4:>11}".format(
+        "samples", "mode", "time (s)", "peak RSS incr. (kB)", "best score"))
+    for n_samples in args.samples:
+        for out_of_core in (False, True):
+            script = TRAIN_SCRIPT.format(
+                features=args.features, samples=n_samples,
+                backend=args.backend, candidates=args.n_candidates,
+                out_of_core=out_of_core, batch_size=args.batch_size)
+            out = subprocess.check_output([sys.executable, "-c", script],
+                                          stderr=subprocess.DEVNULL)
+            result = json.loads(out.decode().strip().splitlines()[-1])
+            print("{0:>8} {1:<12} {2:>10.2f} {3:>20} {4:>11.4f}".format(
+                n_samples, "out-of-core" if out_of_core else "in memory",
+                result["time"], result["peak_rss_increase_kb"],
+                result["score"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare post-processing of predictions one by one and as a batch.
+
+Starts from the output of predict_proba, and ends with the text of the
+output file, so that feature extraction and the model are not measured::
+
+    python benchmarks/bench_predictions.py --samples 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from rna_cd.models import Prediction, PredictionBatch
+from rna_cd.output import format_row, format_rows
+
+
+class Model(object):
+    classes_ = np.array(["neg", "pos"])
+
+
+def per_sample(names, proba, threshold):
+    predictions = [Prediction.from_model_proba(Model, sample, threshold)
+                   for sample in proba]
+    return "".join(format_row(name, prediction)
+                   for name, prediction in zip(names, predictions))
+
+
+def batch(names, proba, threshold):
+    return format_rows(names, PredictionBatch.from_model_proba(
+        Model, proba, threshold))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    pos = np.random.RandomState(0).rand(args.samples)
+    proba = np.column_stack([1 - pos, pos])
+    names = ["sample{0}.bam".format(i) for i in range(args.samples)]
+    expected = per_sample(names, proba, 0.75)
+    print("{0:<12} {1:>10}".format("method", "time (s)"))
+    for name, func in (("per sample", per_sample), ("batch", batch)):
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = func(names, proba, 0.75)
+            timings.append(time.perf_counter() - start)
+        assert result == expected
+        print("{0:<12} {1:>10.3f}".format(name, min(timings)))
+
+
+if __name__ == "__main__":
+    main()
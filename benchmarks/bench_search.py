@@ -0,0 +1,95 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare the hyperparameter search of rna_cd-train with GridSearchCV.
+
+All searches use the grid that rna_cd-train uses, on random features with
+a weak signal. The PipelineSearch runs include calibration of the best
+pipeline, as in rna_cd-train. With a few hundred samples GridSearchCV is
+very slow on the full grid. Use --components-step to search every n-th
+number of components only::
+
+    python benchmarks/bench_search.py --samples 300 --components-step 20
+
+Search strategies of rna_cd-train can be compared on the full grid with::
+
+    python benchmarks/bench_search.py --samples 300 --skip-gridsearchcv \\
+        --strategies exhaustive random halving
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+from sklearn.model_selection import GridSearchCV
+
+from rna_cd.models import make_param_grid, make_pipeline
+from rna_cd.search import SEARCH_STRATEGIES, PipelineSearch
+
+
+def make_features(n_samples: int, n_features: int):
+    rng = np.random.RandomState(0)
+    arr_X = rng.rand(n_samples, n_features)
+    arr_Y = np.array(["pos", "neg"] * (n_samples // 2))
+    arr_X[arr_Y == "pos", :n_features // 10] += 0.2
+    return arr_X, arr_Y
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=60)
+    parser.add_argument("--features", type=int, default=498)
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--cv", type=int, default=3)
+    parser.add_argument("--components-step", type=int, default=1)
+    parser.add_argument("--strategies", nargs="+",
+                        choices=SEARCH_STRATEGIES, default=["exhaustive"],
+                        help="search strategies of rna_cd-train to run")
+    parser.add_argument("--skip-gridsearchcv", action="store_true",
+                        help="only run the search of rna_cd-train")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    arr_X, arr_Y = make_features(args.samples, args.features)
+    param_grid = make_param_grid(arr_X, args.cv)
+    param_grid["reduce_dim__n_components"] = (
+        param_grid["reduce_dim__n_components"][::args.components_step])
+    searchers = {}
+    if not args.skip_gridsearchcv:
+        searchers["GridSearchCV"] = GridSearchCV(
+            make_pipeline(), param_grid, cv=args.cv, scoring="accuracy",
+            n_jobs=args.cores)
+        searchers["PipelineSearch"] = PipelineSearch(
+            make_pipeline(), param_grid, cv=args.cv, n_jobs=args.cores,
+            calibrate=True)
+    for strategy in args.strategies:
+        searchers["+ precomputed, " + strategy] = PipelineSearch(
+            make_pipeline(), param_grid, cv=args.cv, n_jobs=args.cores,
+            precompute_kernel=True, calibrate=True, search=strategy,
+            random_state=0)
+    print("{0:<28} {1:>10} {2:>11}  {3}".format(
+        "search", "time (s)", "best score", "best parameters"))
+    for name, searcher in searchers.items():
+        start = time.perf_counter()
+        searcher.fit(arr_X, arr_Y)
+        print("{0:<28} {1:>10.2f} {2:>11.4f}  {3}".format(
+            name, time.perf_counter() - start, searcher.best_score_,
+            searcher.best_params_))
+
+
+if __name__ == "__main__":
+    main()
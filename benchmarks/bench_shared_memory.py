@@ -0,0 +1,120 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare peak memory and time of collecting the features of many BAM files
+from a worker pool, either as pickled results or in a shared array.
+
+A profile file of the test BAM file is processed as many times as there
+are files, so that decoding reads does not dominate the time; --from-bam
+processes the BAM file itself. Every run is a fresh python process, and
+peak memory is read from /proc, so this only runs on Linux. Every page of
+the features is read after extraction, so that the shared array counts
+towards the peak of the main process. The peak of the largest worker is
+reported separately::
+
+    python benchmarks/bench_shared_memory.py --files 10000 --cores 2
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from rna_cd.bam_process import write_profile
+
+EXTRACT_SCRIPT = """
+import json, resource, time
+from pathlib import Path
+import numpy as np
+from rna_cd import bam_process, utils
+
+def peak_rss():
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+def pickled(bam_files, chunksize, cores):
+    # make_array_set before features were written to shared memory
+    arr_X = None
+    for index, arr in bam_process.iter_features(bam_files, chunksize,
+                                                cores=cores):
+        if arr_X is None:
+            arr_X = np.empty((len(bam_files), arr.shape[0]))
+        arr_X[index] = arr
+    return arr_X
+
+def shared(bam_files, chunksize, cores):
+    return bam_process.make_array_set(bam_files, [], chunksize,
+                                      cores=cores)[0]
+
+utils.echo = bam_process.echo = lambda *args, **kwargs: None
+bam_files = [Path({bam!r})] * {files}
+baseline = peak_rss()
+start = time.perf_counter()
+arr_X = {mode}(bam_files, {chunksize}, {cores})
+elapsed = time.perf_counter() - start
+total = float(arr_X.sum())
+print(json.dumps({{
+    "time": elapsed, "shape": arr_X.shape, "sum": total,
+    "peak_rss_increase_kb": peak_rss() - baseline,
+    "worker_peak_rss_kb": resource.getrusage(
+        resource.RUSAGE_CHILDREN).ru_maxrss}}))
+"""
+
+
+def run(path, files, cores, chunksize):
+    print("{0:>8} {1:<8} {2:>10} {3:>20} {4:>22}".format(
+        "files", "mode", "time (s)", "peak RSS incr. (kB)",
+        "worker peak RSS (kB)"))
+    for n_files in files:
+        results = {}
+        for mode in ("pickled", "shared"):
+            script = EXTRACT_SCRIPT.format(
+                bam=str(path), files=n_files, mode=mode,
+                chunksize=chunksize, cores=cores)
+            out = subprocess.check_output([sys.executable, "-c", script],
+                                          stderr=subprocess.DEVNULL)
+            result = json.loads(out.decode().strip().splitlines()[-1])
+            results[mode] = result
+            print("{0:>8} {1:<8} {2:>10.2f} {3:>20} {4:>22}".format(
+                n_files, mode, result["time"],
+                result["peak_rss_increase_kb"],
+                result["worker_peak_rss_kb"]))
+        assert results["pickled"]["shape"] == results["shared"]["shape"]
+        assert results["pickled"]["sum"] == results["shared"]["sum"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, nargs="+", default=[10000])
+    parser.add_argument("--cores", type=int, default=2)
+    parser.add_argument("--chunksize", type=int, default=100)
+    parser.add_argument("--bam", type=Path, default=(
+        Path(__file__).parent.parent / "tests" / "data" / "micro.bam"))
+    parser.add_argument("--from-bam", action="store_true")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        path = (args.bam if args.from_bam else
+                write_profile(args.bam, Path(tmp)))
+        run(path, args.files, args.cores, args.chunksize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure the startup time of the command line tools.
+
+Every command runs in a fresh python process. The heavy modules that were
+imported by each command are listed as well. Run with::
+
+    python benchmarks/bench_startup.py --repeats 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["numpy", "pysam", "joblib", "sklearn", "matplotlib"]
+
+COMMANDS = {
+    "python": "pass",
+    "import rna_cd.cli": "import rna_cd.cli",
+    "rna_cd-classify --help": "from rna_cd.cli import classify_cli; "
+                              "classify_cli(['--help'])",
+    "rna_cd-train --help": "from rna_cd.cli import train_cli; "
+                           "train_cli(['--help'])",
+    "rna_cd-client --help": "from rna_cd.client import client_cli; "
+                            "client_cli(['--help'])",
+}
+
+REPORT_MODULES = """
+import atexit, sys
+atexit.register(lambda: sys.stderr.write(" ".join(
+    m for m in {0!r} if m in sys.modules)))
+""".format(HEAVY_MODULES)
+
+
+def run(code: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def imported_heavy_modules(code: str) -> str:
+    result = subprocess.run([sys.executable, "-c", REPORT_MODULES + code],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    lines = result.stderr.decode().strip().splitlines()
+    return lines[-1] if lines else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    print("{0:<24} {1:>10} {2:>11}  {3}".format(
+        "command", "min (ms)", "median (ms)", "heavy modules"))
+    for name, code in COMMANDS.items():
+        timings = [run(code) for _ in range(args.repeats)]
+        print("{0:<24} {1:>10.1f} {2:>11.1f}  {3}".format(
+            name, min(timings) * 1000, statistics.median(timings) * 1000,
+            imported_heavy_modules(code)))
+
+
+if __name__ == "__main__":
+    main()
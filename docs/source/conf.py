@@ -17,18 +17,19 @@
 # sys.path.insert(0, os.path.abspath('.'))
 
 
-import pkg_resources
+import importlib.metadata
+import re
 
 # -- Project information -----------------------------------------------------
-package_metadata = pkg_resources.get_distribution("rna_cd")
-project = package_metadata.project_name
+package_metadata = importlib.metadata.metadata("rna_cd")
+project = package_metadata["Name"]
 copyright = '2019, Leiden University Medical Center'
 author = 'Leiden University Medical Center'
 
-# The short X.Y version
-version = package_metadata.parsed_version.base_version
 # The full version, including alpha/beta/rc tags
-release = package_metadata.version
+release = package_metadata["Version"]
+# The short X.Y version
+version = re.match(r"\d+(\.\d+)*", release).group(0)
 
 
 # -- General configuration ---------------------------------------------------
@@ -20,14 +20,17 @@ bam_process.py
 
 Process bam file to numpy array for classifications.
 """
+import weakref
+from collections import deque
 from functools import partial
-from multiprocessing import Pool
+from multiprocessing import Pool, shared_memory
 from pathlib import Path
-from typing import Iterator, Tuple, Callable, List, Any
+from typing import Iterator, Iterable, Tuple, Callable, List, Any, Optional
 
 import numpy as np
-from pysam import AlignmentFile
+from pysam import AlignmentFile, AlignedSegment
 
+from .cache import FeatureCache
 from .utils import echo
 
 
@@ -75,58 +78,627 @@ def coverage(reader: AlignmentFile, contig: str, region: Tuple[int, int],
     return method(np.sum(covs, axis=0))
 
 
-def process_bam(path: Path, chunksize: int = 100,
-                contig: str = "chrM") -> np.ndarray:
+# cigar operations, see the SAM specification.
+# M, = and X align a query base to a reference base.
+_ALIGNED_OPS = frozenset((0, 7, 8))
+# I and S consume query bases only; D and N consume reference bases only.
+_QUERY_ONLY_OPS = frozenset((1, 4))
+_REFERENCE_ONLY_OPS = frozenset((2, 3))
+_SOFTCLIP_OP = 4
+
+# reads with any of these flags (unmapped, secondary, qc fail, duplicate)
+# are ignored for coverage, same as the "all" read_callback of
+# AlignmentFile.count_coverage.
+_COVERAGE_FLAG_FILTER = 0x4 | 0x100 | 0x200 | 0x400
+# minimal base quality of AlignmentFile.count_coverage
+_COVERAGE_QUALITY_THRESHOLD = 15
+
+_IS_ACGT = np.zeros(256, dtype=bool)
+_IS_ACGT[np.frombuffer(b"ACGT", dtype=np.uint8)] = True
+
+# profiles saved to disk have this suffix
+PROFILE_SUFFIX = ".profile.npz"
+_PROFILE_VERSION = 1
+
+# upper limit of the default number of files sent to a worker at once,
+# so that results of parallel processing keep arriving regularly.
+_MAX_DISPATCH_CHUNKSIZE = 16
+
+# dtype of the shared feature array of make_array_set, as of process_bam.
+_FEATURE_DTYPE = np.dtype(np.float64)
+
+# rows of a profile array as returned by _profile_reads
+_STARTS, _ENDS, _DEPTH, _SOFTCLIP_STARTS, _SOFTCLIP_ENDS = range(5)
+
+
+def _profile_reads(reads: Iterable[AlignedSegment],
+                   size: int) -> np.ndarray:
     """
-    Process bam file to an ndarray
+    Collect base-resolution accumulators for reads on a contig in one pass.
 
-    :returns: numpy ndarray of shape (n_features,)
+    Returns an integer array of shape (5, size + 1) where the rows hold,
+    per reference position:
+
+    * the number of reads starting at that position
+    * the number of reads ending (exclusive) at that position
+    * the number of bases counted by AlignmentFile.count_coverage
+    * the softclipped bases of reads starting at that position
+    * the softclipped bases of reads ending at that position
+
+    Read ends beyond the contig are clamped to the contig size.
     """
-    echo("Calculating features for {0}".format(path.name))
-    reader = AlignmentFile(str(path))
+    profile = np.zeros((5, size + 1), dtype=np.int64)
+    starts, ends = profile[_STARTS], profile[_ENDS]
+    sc_starts, sc_ends = profile[_SOFTCLIP_STARTS], profile[_SOFTCLIP_ENDS]
+    depth = profile[_DEPTH]
+
+    for read in reads:
+        begin = read.reference_start
+        if begin < 0 or begin >= size:
+            continue
+        # same definition of the read end as htslib uses for region queries
+        end = read.reference_end
+        if end is None or end <= begin:
+            end = begin + 1
+        end = min(end, size)
+        starts[begin] += 1
+        ends[end] += 1
+
+        cigar = read.cigartuples
+        if cigar is None:
+            continue
+        softclip = sum(amount for op, amount in cigar if op == _SOFTCLIP_OP)
+        sc_starts[begin] += softclip
+        sc_ends[end] += softclip
+
+        if read.flag & _COVERAGE_FLAG_FILTER:
+            continue
+        seq = read.query_sequence
+        quals = read.query_qualities
+        if seq is None or not quals:
+            continue
+        counted = ((np.frombuffer(quals, dtype=np.uint8) >=
+                    _COVERAGE_QUALITY_THRESHOLD) &
+                   _IS_ACGT[np.frombuffer(seq.encode("ascii"),
+                                          dtype=np.uint8)])
+        qpos, rpos = 0, begin
+        for op, amount in cigar:
+            if op in _ALIGNED_OPS:
+                r_start, r_end = max(rpos, 0), min(rpos + amount, size)
+                if r_end > r_start:
+                    q_start = qpos + r_start - rpos
+                    depth[r_start:r_end] += counted[
+                        q_start:q_start + r_end - r_start
+                    ]
+                qpos += amount
+                rpos += amount
+            elif op in _QUERY_ONLY_OPS:
+                qpos += amount
+            elif op in _REFERENCE_ONLY_OPS:
+                rpos += amount
+    return profile
+
+
+def _bin_profile(profile: np.ndarray, chunksize: int) -> np.ndarray:
+    """
+    Bin a profile (see _profile_reads) into chunks as given by chop_contig.
+
+    :returns: unnormalized ndarray of shape (n_bins * 3,) with for every bin
+              the amount of overlapping reads, the mean coverage and
+              the amount of softclipped bases of overlapping reads.
+    """
+    size = profile.shape[1] - 1
+    bounds = np.array(list(chop_contig(size, chunksize)))
+    bin_starts, bin_ends = bounds[:, 0], bounds[:, 1]
+
+    # A read [begin, end) overlaps bin [a, b) iff begin < b and end > a.
+    # Since begin < end, the reads with end <= a are a subset of the reads
+    # with begin < b, so overlaps are a difference of cumulative sums.
+    def overlapping(at_start: np.ndarray, at_end: np.ndarray) -> np.ndarray:
+        cum_start = np.concatenate(([0], np.cumsum(at_start)))
+        cum_end = np.cumsum(at_end)
+        return cum_start[bin_ends] - cum_end[bin_starts]
+
+    n_reads = overlapping(profile[_STARTS], profile[_ENDS])
+    softclip = overlapping(profile[_SOFTCLIP_STARTS],
+                           profile[_SOFTCLIP_ENDS])
+    cov = (np.add.reduceat(profile[_DEPTH, :size], bin_starts) /
+           (bin_ends - bin_starts))
+    return np.column_stack((n_reads, cov, softclip)).ravel()
+
+
+def _contig_size(reader: AlignmentFile, contig: str) -> int:
     try:
         contig_idx = reader.references.index(contig)
     except ValueError:
         raise ValueError("Contig {0} does not exist in BAM file".format(
             contig
         ))
-    contig_size = reader.lengths[contig_idx]
-
-    full_array = []
-    tot_reads = 0
-    for region in chop_contig(contig_size, chunksize):
-        block = []
-        start, end = region
-        n_reads = reader.count(contig=contig, start=start, stop=end)
-        tot_reads += n_reads
-        cov = coverage(reader, contig, region)
-        softclip = softclip_bases(reader, contig, region)
-        block += [n_reads, cov, softclip]
-        full_array += block
+    return reader.lengths[contig_idx]
+
+
+def _profile_region(path: Path, contig: str,
+                    region: Tuple[int, int]) -> np.ndarray:
+    """
+    Profile of the reads that start in a region of the contig.
+
+    Reads that start before the region are left to the region they start
+    in, so that profiles of adjacent regions can simply be summed.
+    """
+    start, end = region
+    reader = AlignmentFile(str(path))
+    size = _contig_size(reader, contig)
+    reads = reader.fetch(contig=contig, start=start, stop=end)
+    return _profile_reads((read for read in reads
+                           if read.reference_start >= start), size)
+
+
+def extract_profile(path: Path, contig: str = "chrM",
+                    cores: int = 1) -> np.ndarray:
+    """
+    Extract the base-resolution profile of a contig in a bam file.
+
+    The profile holds read starts, read ends, coverage and softclipped
+    bases for every position on the contig. Features for any chunksize
+    can be derived from it with profile_to_features.
+
+    :param cores: number of cores to use. With more than one core the
+           contig is split in regions that are processed in parallel, each
+           with its own file handle.
+    :returns: integer ndarray of shape (5, contig_size + 1)
+    """
+    if cores < 1:
+        raise ValueError("Number of cores must be at least 1.")
+    reader = AlignmentFile(str(path))
+    contig_size = _contig_size(reader, contig)
+    if cores == 1:
+        return _profile_reads(reader.fetch(contig=contig), contig_size)
+    reader.close()
+    region_size = -(-contig_size // cores)  # ceiling division
+    regions = list(chop_contig(contig_size, region_size))
+    with Pool(min(cores, len(regions))) as pool:
+        partial_profiles = pool.map(partial(_profile_region, path, contig),
+                                    regions)
+    return np.sum(partial_profiles, axis=0)
+
+
+def profile_to_features(profile: np.ndarray, chunksize: int) -> np.ndarray:
+    """
+    Derive the normalized feature vector for a chunksize from a profile.
+
+    :returns: numpy ndarray of shape (n_features,)
+    """
+    full_array = _bin_profile(profile, chunksize)
+    # reads spanning multiple chunks are counted once per chunk
+    tot_reads = full_array[0::3].sum()
     # add normalization step
-    normalized = np.array(full_array) / tot_reads
+    return full_array / tot_reads
+
+
+def is_profile_file(path: Path) -> bool:
+    return path.name.endswith(PROFILE_SUFFIX)
+
+
+def save_profile(profile: np.ndarray, path: Path, contig: str) -> None:
+    """Save a profile of a contig to a compressed numpy file."""
+    with path.open("wb") as handle:
+        np.savez_compressed(handle, profile=profile, contig=np.array(contig),
+                            version=np.array(_PROFILE_VERSION))
+
+
+def load_profile(path: Path, contig: str = "chrM") -> np.ndarray:
+    """
+    Load a profile stored with save_profile.
+
+    :raises ValueError: if the profile was made for another contig.
+    """
+    with np.load(str(path), allow_pickle=False) as npz:
+        if int(npz["version"]) != _PROFILE_VERSION:
+            raise ValueError("Profile {0} has an unsupported version".format(
+                path.name))
+        if str(npz["contig"]) != contig:
+            raise ValueError(
+                "Profile {0} was made for contig {1}, not {2}".format(
+                    path.name, npz["contig"], contig))
+        return npz["profile"]
+
+
+def get_profile(path: Path, contig: str = "chrM",
+                cache: Optional[FeatureCache] = None,
+                cores: int = 1) -> np.ndarray:
+    """
+    Get the profile of a bam file or profile file.
+
+    :param cache: optional feature cache that is consulted first, and
+           that stores newly extracted profiles.
+    :param cores: number of cores to use, see extract_profile
+    :returns: integer ndarray of shape (5, contig_size + 1)
+    """
+    if is_profile_file(path):
+        return load_profile(path, contig)
+    if cache is not None:
+        # the key reads the index of the bam file, so it is computed once
+        key = cache.key(path, contig=contig, kind="profile")
+        cached = cache.load(key)
+        if cached is not None:
+            echo("Using cached profile for {0}".format(path.name))
+            return cached
+    echo("Extracting profile for {0}".format(path.name))
+    profile = extract_profile(path, contig, cores)
+    if cache is not None:
+        cache.store(key, profile)
+    echo("Done extracting profile for {0}".format(path.name))
+    return profile
+
+
+def process_bam(path: Path, chunksize: int = 100,
+                contig: str = "chrM",
+                cache: Optional[FeatureCache] = None,
+                cores: int = 1) -> np.ndarray:
+    """
+    Process bam file to an ndarray
+
+    All reads on the contig are decoded only once; for every chunk the
+    amount of reads, the mean coverage and the amount of softclipped bases
+    are derived from the same pass. The values are identical to those
+    of AlignmentFile.count, coverage and softclip_bases on the chunk.
+
+    Instead of a bam file, path may also be a profile file as written by
+    save_profile; the features are then derived without any decoding.
+
+    :param cache: optional feature cache that is consulted first, and
+           that stores newly calculated features.
+    :param cores: number of cores to use, see extract_profile
+    :returns: numpy ndarray of shape (n_features,)
+    """
+    if is_profile_file(path):
+        return profile_to_features(load_profile(path, contig), chunksize)
+    if cache is not None:
+        # the key reads the index of the bam file, so it is computed once
+        key = cache.key(path, chunksize=chunksize, contig=contig)
+        cached = cache.load(key)
+        if cached is not None:
+            echo("Using cached features for {0}".format(path.name))
+            return cached
+    echo("Calculating features for {0}".format(path.name))
+    normalized = profile_to_features(extract_profile(path, contig, cores),
+                                     chunksize)
+    if cache is not None:
+        cache.store(key, normalized)
     echo("Done calculating features for {0}".format(path.name))
     return normalized
 
 
+def write_profile(path: Path, out_dir: Path,
+                  contig: str = "chrM") -> Path:
+    """
+    Extract the profile of a bam file and save it in out_dir.
+
+    :returns: path of the profile file
+    """
+    echo("Extracting profile for {0}".format(path.name))
+    out_path = out_dir / (path.name + PROFILE_SUFFIX)
+    save_profile(extract_profile(path, contig), out_path, contig)
+    echo("Done extracting profile for {0}".format(path.name))
+    return out_path
+
+
+def write_profiles(bam_files: List[Path], out_dir: Path,
+                   contig: str = "chrM", cores: int = 1,
+                   max_tasks_per_child: Optional[int] = None) -> List[Path]:
+    """
+    Write profile files for a list of bam files to out_dir
+
+    :param max_tasks_per_child: see imap_files
+    :returns: list of paths to profile files, in the order of bam_files.
+    """
+    if cores < 1:
+        raise ValueError("Number of cores must be at least 1.")
+    names = [bam.name for bam in bam_files]
+    if len(set(names)) != len(names):
+        raise ValueError("Profiles can not be written for multiple bam "
+                         "files with the same name.")
+    out_paths = [Path()] * len(bam_files)
+    results = imap_files(partial(write_profile, out_dir=out_dir,
+                                 contig=contig),
+                         bam_files, cores, max_tasks_per_child)
+    for index, out_path in results:
+        out_paths[index] = out_path
+    return out_paths
+
+
+def _call_indexed(func: Callable[[Path], Any],
+                  item: Tuple[int, Path]) -> Tuple[int, Any]:
+    index, path = item
+    return index, func(path)
+
+
+def imap_files(func: Callable[[Path], Any], files: List[Path],
+               cores: int = 1, max_tasks_per_child: Optional[int] = None,
+               dispatch_chunksize: Optional[int] = None
+               ) -> Iterator[Tuple[int, Any]]:
+    """
+    Apply func to every file, yielding the results as soon as they are
+    ready. As results arrive in order of completion, each result is
+    yielded together with the index of its file.
+
+    With more than one core, files are processed in a worker pool that is
+    closed and joined once all files are done, or terminated when the
+    caller stops iterating early. With one core, files are processed in
+    the current process.
+
+    :param max_tasks_per_child: number of files after which a worker is
+           replaced by a fresh process, to limit memory growth of
+           long-lived workers. Default = never replaced.
+    :param dispatch_chunksize: number of files sent to a worker at once.
+           Default = a quarter of the files per core, at most 16.
+    """
+    if cores < 1:
+        raise ValueError("Number of cores must be at least 1.")
+    if max_tasks_per_child is not None and max_tasks_per_child < 1:
+        raise ValueError("Maximum number of tasks per child must be at "
+                         "least 1.")
+    tasks = list(enumerate(files))
+    if cores == 1 or len(tasks) <= 1:
+        for index, path in tasks:
+            yield index, func(path)
+        return
+
+    if dispatch_chunksize is None:
+        dispatch_chunksize = min(max(len(tasks) // (cores * 4), 1),
+                                 _MAX_DISPATCH_CHUNKSIZE)
+    pool = Pool(min(cores, len(tasks)), maxtasksperchild=max_tasks_per_child)
+    try:
+        yield from pool.imap_unordered(partial(_call_indexed, func), tasks,
+                                       chunksize=dispatch_chunksize)
+        pool.close()
+    except BaseException:
+        # includes GeneratorExit, when the caller stops iterating early.
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def imap_batches(func: Callable[[Path], Any], files: List[Path],
+                 batch_size: int, cores: int = 1,
+                 max_tasks_per_child: Optional[int] = None
+                 ) -> Iterator[Tuple[int, List[Any]]]:
+    """
+    Apply func to every file, yielding the results in batches of
+    batch_size files, in the order of files.
+
+    With more than one core, files are processed in a worker pool, and the
+    next batch is processed while the caller handles the current one, so
+    that at most two batches of results exist at any time. The pool is
+    terminated when the caller stops iterating early. With one core, files
+    are processed in the current process when the caller asks for the next
+    batch.
+
+    :param max_tasks_per_child: see imap_files
+    :returns: iterator of (index of the first file of the batch, results)
+              tuples.
+    """
+    if cores < 1:
+        raise ValueError("Number of cores must be at least 1.")
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1.")
+    if max_tasks_per_child is not None and max_tasks_per_child < 1:
+        raise ValueError("Maximum number of tasks per child must be at "
+                         "least 1.")
+    starts = range(0, len(files), batch_size)
+    if cores == 1:
+        for start in starts:
+            yield start, [func(path)
+                          for path in files[start:start + batch_size]]
+        return
+
+    dispatch_chunksize = min(max(batch_size // (cores * 4), 1),
+                             _MAX_DISPATCH_CHUNKSIZE)
+    pool = Pool(cores, maxtasksperchild=max_tasks_per_child)
+    try:
+        pending = deque()
+        for start in starts:
+            pending.append((start, pool.map_async(
+                func, files[start:start + batch_size],
+                chunksize=dispatch_chunksize)))
+            # the next batch is dispatched before this one is waited for,
+            # so that the workers stay busy while the caller handles it.
+            if len(pending) == 2:
+                batch_start, result = pending.popleft()
+                yield batch_start, result.get()
+        while pending:
+            batch_start, result = pending.popleft()
+            yield batch_start, result.get()
+        pool.close()
+    except BaseException:
+        # includes GeneratorExit, when the caller stops iterating early.
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def iter_features(bam_files: List[Path], chunksize: int = 100,
+                  contig: str = "chrM", cores: int = 1,
+                  cache: Optional[FeatureCache] = None,
+                  max_tasks_per_child: Optional[int] = None
+                  ) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Yield (index, features) for every bam file as soon as it is processed.
+
+    :param cores: number of cores to use for processing. Multiple files are
+           processed in parallel; a single file is split in regions that
+           are processed in parallel.
+    :param cache: optional feature cache, see process_bam
+    :param max_tasks_per_child: see imap_files
+    """
+    if cores < 1:
+        raise ValueError("Number of cores must be at least 1.")
+    if len(bam_files) == 1:
+        yield 0, process_bam(bam_files[0], chunksize, contig, cache, cores)
+        return
+    proc_func = partial(process_bam, chunksize=chunksize, contig=contig,
+                        cache=cache)
+    yield from imap_files(proc_func, bam_files, cores, max_tasks_per_child)
+
+
+def iter_feature_batches(bam_files: List[Path], batch_size: int,
+                         chunksize: int = 100, contig: str = "chrM",
+                         cores: int = 1,
+                         cache: Optional[FeatureCache] = None,
+                         max_tasks_per_child: Optional[int] = None
+                         ) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Yield the features of batches of batch_size bam files, in the order of
+    bam_files. The next batch is processed while the caller handles the
+    current one, see imap_batches.
+
+    :param cores: number of cores to use for processing. Multiple files are
+           processed in parallel.
+    :param cache: optional feature cache, see process_bam
+    :param max_tasks_per_child: see imap_files
+    :returns: iterator of (index of the first bam file of the batch, X)
+              tuples. X has shape (n_files_in_batch, n_features).
+    """
+    proc_func = partial(process_bam, chunksize=chunksize, contig=contig,
+                        cache=cache)
+    for start, arrs in imap_batches(proc_func, bam_files, batch_size, cores,
+                                    max_tasks_per_child):
+        yield start, np.array(arrs)
+
+
+def feature_count(path: Path, chunksize: int = 100,
+                  contig: str = "chrM") -> int:
+    """
+    Number of features of a bam file or profile file, which follows from
+    the size of the contig and the chunksize.
+    """
+    if is_profile_file(path):
+        size = load_profile(path, contig).shape[1] - 1
+    else:
+        with AlignmentFile(str(path)) as reader:
+            size = _contig_size(reader, contig)
+    return 3 * len(list(chop_contig(size, chunksize)))
+
+
+def _write_shared_row(item: Tuple[int, Path], name: str,
+                      shape: Tuple[int, int], chunksize: int, contig: str,
+                      cache: Optional[FeatureCache]) -> None:
+    """
+    Process a bam file, and write its features to its row of the shared
+    array of make_array_set.
+    """
+    index, path = item
+    arr = process_bam(path, chunksize, contig, cache)
+    if arr.shape != shape[1:]:
+        raise ValueError(
+            "{0} has {1} features instead of {2}; the contig must have the "
+            "same size in all bam files.".format(path.name, arr.shape[0],
+                                                 shape[1]))
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        row = np.ndarray(shape[1:], dtype=_FEATURE_DTYPE, buffer=block.buf,
+                         offset=index * shape[1] * _FEATURE_DTYPE.itemsize)
+        row[:] = arr
+        # the row must be gone before the block can be closed.
+        del row
+    finally:
+        block.close()
+
+
+def _make_shared_array(bam_files: List[Path], chunksize: int, contig: str,
+                       cores: int, cache: Optional[FeatureCache],
+                       max_tasks_per_child: Optional[int]) -> np.ndarray:
+    """
+    Features of bam files that are processed in a worker pool, see
+    make_array_set.
+
+    The array is allocated in shared memory before any file is processed,
+    and every worker writes the features of a file to its row, so that
+    features are neither sent back to this process nor copied.
+    """
+    shape = (len(bam_files), feature_count(bam_files[0], chunksize, contig))
+    block = shared_memory.SharedMemory(
+        create=True, size=shape[0] * shape[1] * _FEATURE_DTYPE.itemsize)
+    try:
+        write_row = partial(_write_shared_row, name=block.name, shape=shape,
+                            chunksize=chunksize, contig=contig, cache=cache)
+        for _ in imap_files(write_row, list(enumerate(bam_files)), cores,
+                            max_tasks_per_child):
+            pass
+    except BaseException:
+        block.close()
+        raise
+    finally:
+        # the memory is freed when the last mapping of the block is
+        # closed, which is the one of the returned array.
+        block.unlink()
+    arr_X = np.ndarray(shape, dtype=_FEATURE_DTYPE, buffer=block.buf)
+    # closing the block while the array exists would leave the array
+    # pointing at unmapped memory.
+    weakref.finalize(arr_X, block.close)
+    return arr_X
+
+
 def make_array_set(bam_files: List[Path], labels: List[Any],
                    chunksize: int = 100,
                    contig: str = "chrM",
-                   cores: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+                   cores: int = 1,
+                   cache: Optional[FeatureCache] = None,
+                   max_tasks_per_child: Optional[int] = None
+                   ) -> Tuple[np.ndarray, np.ndarray]:
     """
     Make set of numpy arrays corresponding to data  and labels.
     I.e. train/testX and train/testY in scikit-learn parlance.
 
     :param bam_files: List of paths to bam files
     :param labels: list of labels.
-    :param cores: number of cores to use for processing
+    :param cores: number of cores to use for processing, see iter_features.
+           With multiple cores and multiple files, X is allocated in
+           shared memory, to which the workers write the features
+           directly.
+    :param cache: optional feature cache, see process_bam
+    :param max_tasks_per_child: see imap_files
     :return: tuple of X and Y numpy arrays. X has shape (n_files, n_features).
              Y has shape (n_files,).
     """
     if cores < 1:
         raise ValueError("Number of cores must be at least 1.")
-    pool = Pool(cores)
-    proc_func = partial(process_bam, chunksize=chunksize, contig=contig)
-    # this returns a list of ndarrays.
-    arr_X = pool.map(proc_func, bam_files)
-    return np.array(arr_X), np.array(labels)
+    if cores > 1 and len(bam_files) > 1:
+        arr_X = _make_shared_array(bam_files, chunksize, contig, cores,
+                                   cache, max_tasks_per_child)
+        return arr_X, np.array(labels)
+    arr_X = None
+    for index, arr in iter_features(bam_files, chunksize, contig, cores,
+                                    cache, max_tasks_per_child):
+        if arr_X is None:
+            arr_X = np.empty((len(bam_files), arr.shape[0]), dtype=arr.dtype)
+        arr_X[index] = arr
+    if arr_X is None:
+        arr_X = np.array([])
+    return arr_X, np.array(labels)
+
+
+def make_profile_set(bam_files: List[Path], contig: str = "chrM",
+                     cores: int = 1,
+                     cache: Optional[FeatureCache] = None,
+                     max_tasks_per_child: Optional[int] = None
+                     ) -> List[np.ndarray]:
+    """
+    Get profiles for a list of bam files, see get_profile.
+
+    :param cores: number of cores to use for processing
+    :param max_tasks_per_child: see imap_files
+    :return: list of profiles in the order of bam_files
+    """
+    if cores < 1:
+        raise ValueError("Number of cores must be at least 1.")
+    if len(bam_files) == 1:
+        return [get_profile(bam_files[0], contig, cache, cores)]
+    profiles = [np.empty(0)] * len(bam_files)
+    results = imap_files(partial(get_profile, contig=contig, cache=cache),
+                         bam_files, cores, max_tasks_per_child)
+    for index, profile in results:
+        profiles[index] = profile
+    return profiles
@@ -0,0 +1,205 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+cache.py
+~~~~~~~~
+
+Persistent on-disk store of extracted features.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+# bump this whenever feature extraction changes, so stale entries
+# are never used.
+_CACHE_VERSION = 1
+
+# when a BAM file has no index, this many bytes of the start and the end
+# of the file are used as content digest.
+_DIGEST_BYTES = 1 << 20
+
+_INDEX_SUFFIXES = (".bai", ".csi", ".crai")
+
+# number of entries stored after which the size of a cache is counted
+# again, as other processes may store and evict entries as well.
+_RECOUNT_PUTS = 100
+
+
+def _index_path(path: Path) -> Optional[Path]:
+    """Find the index belonging to a bam or cram file, if any."""
+    candidates = [Path(str(path) + suffix) for suffix in _INDEX_SUFFIXES]
+    candidates += [path.with_suffix(suffix) for suffix in _INDEX_SUFFIXES]
+    for candidate in candidates:
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def file_digest(path: Path) -> str:
+    """
+    Digest identifying the content of a bam or cram file.
+
+    The index is hashed if present, as it changes whenever the alignments
+    change. Otherwise the first and last megabyte of the file are hashed.
+    """
+    hasher = hashlib.sha1()
+    index = _index_path(path)
+    with (index or path).open("rb") as handle:
+        if index is not None:
+            hasher.update(handle.read())
+        else:
+            hasher.update(handle.read(_DIGEST_BYTES))
+            handle.seek(max(path.stat().st_size - _DIGEST_BYTES, 0))
+            hasher.update(handle.read())
+    return hasher.hexdigest()
+
+
+class FeatureCache(object):
+    """
+    Directory of cached feature arrays, with least recently used eviction.
+
+    Entries are keyed on the resolved path, size, modification time and
+    content digest of the BAM file, in addition to the extraction
+    parameters. The same BAM file reached through different symlinks
+    therefore maps to a single entry. Computing a key reads the index of
+    the BAM file, so callers that look up and store the same entry compute
+    the key once, and use load and store.
+
+    With a maximum size, the total size of the entries is kept up to date
+    as entries are stored, and counted again every _RECOUNT_PUTS entries.
+    The directory is only scanned for eviction when the total exceeds the
+    maximum size.
+
+    :param directory: directory to store entries in. Created if needed.
+    :param max_size: optional maximum total size of all entries in bytes.
+    """
+    suffix = ".npy"
+
+    def __init__(self, directory: Path, max_size: Optional[int] = None):
+        if max_size is not None and max_size < 1:
+            raise ValueError("Maximum cache size must be at least 1 byte.")
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # total size of the entries, counted on the first store.
+        self._size = None  # type: Optional[int]
+        self._puts = 0
+
+    def key(self, path: Path, **params: Any) -> str:
+        """Key of the entry for a BAM file and extraction parameters."""
+        real_path = Path(os.path.realpath(str(path)))
+        stat = real_path.stat()
+        parts = ["version={0}".format(_CACHE_VERSION),
+                 "path={0}".format(real_path),
+                 "size={0}".format(stat.st_size),
+                 "mtime={0}".format(stat.st_mtime_ns),
+                 "digest={0}".format(file_digest(real_path))]
+        parts += ["{0}={1!r}".format(k, params[k]) for k in sorted(params)]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.directory / (key + self.suffix)
+
+    def get(self, path: Path, **params: Any) -> Optional[np.ndarray]:
+        """Return cached array for BAM file, or None if there is none."""
+        return self.load(self.key(path, **params))
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        """Return cached array of a key, or None if there is none."""
+        entry = self.entry_path(key)
+        try:
+            arr = np.load(str(entry), allow_pickle=False)
+        except (OSError, ValueError):
+            # missing, evicted by another process or truncated
+            return None
+        try:
+            os.utime(str(entry))  # mark as recently used
+        except OSError:
+            pass
+        return arr
+
+    def put(self, path: Path, arr: np.ndarray, **params: Any) -> None:
+        """Store array for BAM file, evicting old entries if needed."""
+        self.store(self.key(path, **params), arr)
+
+    def store(self, key: str, arr: np.ndarray) -> None:
+        """Store array of a key, evicting old entries if needed."""
+        entry = self.entry_path(key)
+        try:
+            replaced_size = entry.stat().st_size
+        except FileNotFoundError:
+            replaced_size = 0
+        # write to a temporary file and rename it, so that concurrent
+        # readers never see partially written entries.
+        fd, tmp_name = tempfile.mkstemp(dir=str(self.directory),
+                                        suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                np.save(handle, arr, allow_pickle=False)
+                entry_size = handle.tell()
+            os.replace(tmp_name, str(entry))
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        if self.max_size is None:
+            return
+        self._puts += 1
+        if self._size is None or self._puts % _RECOUNT_PUTS == 0:
+            self._size = self.size()
+        else:
+            self._size += entry_size - replaced_size
+        if self._size > self.max_size:
+            self._size = self.evict(self.max_size)
+
+    def size(self) -> int:
+        """Total size of all entries in bytes."""
+        total = 0
+        for entry in self.directory.glob("*" + self.suffix):
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def evict(self, max_size: int) -> int:
+        """
+        Remove least recently used entries until size <= max_size
+
+        :returns: total size of the remaining entries in bytes.
+        """
+        entries = []
+        for entry in self.directory.glob("*" + self.suffix):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= max_size:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
@@ -0,0 +1,250 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+checkpoint.py
+~~~~~~~~~~~~~
+
+Checkpoints of feature extraction, so that an interrupted training run
+only has to process the BAM files that were not done yet.
+
+A checkpoint is an append-only file. The features of every BAM file are
+appended as a record as soon as they are extracted, and flushed to disk.
+Every record has a checksum, so that a record that was cut off by a crash
+is recognized, and removed when the checkpoint is resumed.
+"""
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .bam_process import iter_features
+from .cache import FeatureCache
+from .dataset import file_identity
+from .utils import echo
+
+CHECKPOINT_MAGIC = b"rna_cd checkpoint\n"
+
+# bump this whenever the layout of checkpoint files changes.
+_CHECKPOINT_VERSION = 1
+
+# lengths of the metadata and data of a record, and checksum of a record.
+_RECORD_HEAD = struct.Struct("<II")
+_RECORD_CHECKSUM = struct.Struct("<I")
+
+
+class CheckpointRecord(object):
+    """
+    Features of a BAM file in a checkpoint.
+
+    :param index: index of the BAM file in the list of BAM files of the
+           run.
+    :param path: resolved path of the BAM file, see dataset.file_identity.
+    :param version: size, modification time and digest of the BAM file,
+           see dataset.file_identity.
+    :param label: label of the BAM file.
+    :param arr: features of the BAM file.
+    """
+    def __init__(self, index: int, path: str, version: str, label: str,
+                 arr: np.ndarray):
+        self.index = index
+        self.path = path
+        self.version = version
+        self.label = label
+        self.arr = arr
+
+    def to_bytes(self) -> bytes:
+        meta = json.dumps({"index": self.index, "path": self.path,
+                           "version": self.version, "label": self.label,
+                           "dtype": self.arr.dtype.str}).encode("utf-8")
+        data = np.ascontiguousarray(self.arr).tobytes()
+        checksum = zlib.crc32(meta + data)
+        return (_RECORD_HEAD.pack(len(meta), len(data)) + meta + data +
+                _RECORD_CHECKSUM.pack(checksum))
+
+    @classmethod
+    def from_handle(cls, handle: BinaryIO) -> Optional["CheckpointRecord"]:
+        """
+        Read the next record of a checkpoint.
+
+        :returns: the record, or None at the end of the file or when the
+                  record is incomplete or damaged.
+        """
+        head = handle.read(_RECORD_HEAD.size)
+        if len(head) < _RECORD_HEAD.size:
+            return None
+        meta_length, data_length = _RECORD_HEAD.unpack(head)
+        body = handle.read(meta_length + data_length)
+        checksum = handle.read(_RECORD_CHECKSUM.size)
+        if (len(body) < meta_length + data_length or
+                len(checksum) < _RECORD_CHECKSUM.size or
+                _RECORD_CHECKSUM.unpack(checksum)[0] != zlib.crc32(body)):
+            return None
+        meta = json.loads(body[:meta_length].decode("utf-8"))
+        arr = np.frombuffer(body[meta_length:], dtype=meta["dtype"])
+        return cls(meta["index"], meta["path"], meta["version"],
+                   meta["label"], arr)
+
+
+def read_checkpoint(path: Path) -> Tuple[Dict[str, Any],
+                                         List[CheckpointRecord], int]:
+    """
+    Read all complete records of a checkpoint.
+
+    :returns: tuple of the header, the records in the order in which they
+              were written, and the size of the file up to the end of the
+              last complete record.
+    :raises ValueError: if the file is not a checkpoint of this version.
+    """
+    with path.open("rb") as handle:
+        if handle.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError("{0} is not a checkpoint file.".format(path))
+        header = json.loads(handle.readline().decode("utf-8"))
+        if header.get("version") != _CHECKPOINT_VERSION:
+            raise ValueError("Checkpoint {0} has an unsupported "
+                             "version.".format(path))
+        records = []
+        end = handle.tell()
+        record = CheckpointRecord.from_handle(handle)
+        while record is not None:
+            records.append(record)
+            end = handle.tell()
+            record = CheckpointRecord.from_handle(handle)
+    return header, records, end
+
+
+def _open_checkpoint(path: Path, chunksize: int, contig: str,
+                     resume: bool) -> Tuple[BinaryIO, List[CheckpointRecord]]:
+    """
+    Open a checkpoint for appending records. A new checkpoint is started
+    unless resume is set and the checkpoint exists, in which case an
+    incomplete last record is removed.
+
+    :returns: tuple of the handle, and the records that are already in
+              the checkpoint.
+    """
+    if resume and path.exists():
+        header, records, end = read_checkpoint(path)
+        if header["chunksize"] != chunksize or header["contig"] != contig:
+            raise ValueError(
+                "Checkpoint {0} was made with chunksize {1} and contig {2}; "
+                "start again without resuming.".format(
+                    path, header["chunksize"], header["contig"]))
+        handle = path.open("r+b")
+        handle.truncate(end)
+        handle.seek(end)
+        return handle, records
+    handle = path.open("wb")
+    handle.write(CHECKPOINT_MAGIC)
+    handle.write(json.dumps({"version": _CHECKPOINT_VERSION,
+                             "chunksize": chunksize,
+                             "contig": contig}).encode("utf-8") + b"\n")
+    return handle, []
+
+
+def check_records(records: Dict[int, CheckpointRecord],
+                  identities: List[Tuple[str, str]],
+                  labels: List[str]) -> None:
+    """
+    Check that the records of a checkpoint belong to the BAM files and
+    labels of this run, in the same order.
+
+    :param records: records by index of their BAM file.
+    :param identities: identities of the BAM files of this run, see
+           dataset.file_identity.
+    :raises ValueError: if a record belongs to another BAM file or label.
+    """
+    for index, record in records.items():
+        if index >= len(identities) or (
+                record.path != identities[index][0]):
+            raise ValueError(
+                "The BAM files are not the ones of the checkpoint, or are "
+                "in another order; start again without resuming.")
+        if record.label != labels[index]:
+            raise ValueError(
+                "The label of {0} differs from its label in the checkpoint; "
+                "start again without resuming.".format(record.path))
+
+
+def make_checkpointed_array_set(bam_files: List[Path], labels: List[str],
+                                path: Path, resume: bool = False,
+                                chunksize: int = 100, contig: str = "chrM",
+                                cores: int = 1,
+                                cache: Optional[FeatureCache] = None,
+                                max_tasks_per_child: Optional[int] = None
+                                ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counterpart of bam_process.make_array_set that appends the features of
+    every bam file to a checkpoint as soon as they are extracted.
+
+    When resuming, bam files of which the checkpoint already has features
+    are skipped, unless they changed since. The checkpoint must have been
+    made for the same bam files, in the same order, with the same labels,
+    chunksize and contig. Once all files are done, the arrays are read back
+    from the checkpoint, and checked to have exactly the bam files and
+    labels of this run.
+
+    :param path: path of the checkpoint file.
+    :param resume: continue an existing checkpoint. Otherwise a new
+           checkpoint is started.
+    :param cores: number of cores to use for processing, see
+           make_array_set
+    :param cache: optional feature cache, see make_array_set
+    :param max_tasks_per_child: see make_array_set
+    :returns: tuple of X and Y numpy arrays, see make_array_set.
+    """
+    if len(bam_files) != len(labels):
+        raise ValueError("Every bam file must have a label.")
+    identities = [file_identity(bam) for bam in bam_files]
+    handle, records = _open_checkpoint(path, chunksize, contig, resume)
+    with handle:
+        # a later record of a file replaces an earlier one
+        done = {record.index: record for record in records}
+        check_records(done, identities, labels)
+        todo = [index for index, identity in enumerate(identities)
+                if index not in done or done[index].version != identity[1]]
+        if resume:
+            echo("Resuming checkpoint with features of {0} files, "
+                 "calculating features of {1} files.".format(
+                     len(bam_files) - len(todo), len(todo)))
+        results = iter_features([bam_files[index] for index in todo],
+                                chunksize, contig, cores, cache,
+                                max_tasks_per_child)
+        for todo_index, arr in results:
+            index = todo[todo_index]
+            record = CheckpointRecord(index, identities[index][0],
+                                      identities[index][1], labels[index],
+                                      arr)
+            handle.write(record.to_bytes())
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    # the arrays are taken from the checkpoint itself, so that the check
+    # covers exactly what is used for training.
+    _, records, _ = read_checkpoint(path)
+    done = {record.index: record for record in records}
+    check_records(done, identities, labels)
+    if (sorted(done) != list(range(len(bam_files))) or
+            any(done[index].version != identity[1]
+                for index, identity in enumerate(identities))):
+        raise ValueError("Checkpoint {0} does not have the features of all "
+                         "BAM files.".format(path))
+    arr_X = np.array([done[index].arr for index in range(len(bam_files))])
+    return arr_X, np.array(labels)
@@ -16,12 +16,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import click
 from pathlib import Path
-from typing import Optional, List
+from typing import TYPE_CHECKING, Dict, Optional, List, Tuple
 
-from .models import train_svm_model, predict_labels_and_prob
+from .output import (HEADER, format_rows, classified_names, open_for_append,
+                     write_row, write_rows, reorder_output)
 from .utils import (load_list_file, dir_to_bam_list,
                     save_sklearn_object_to_disk,
-                    load_sklearn_object_from_disk, echo)
+                    load_sklearn_object_from_disk, migrate_model, echo)
+
+# The modules that need numpy, pysam or sklearn are imported in the commands
+# that use them, so that --help and invalid arguments return without
+# importing them.
+if TYPE_CHECKING:
+    from .cache import FeatureCache
 
 
 # all callback functions but adhere to the following signature:
@@ -65,6 +72,24 @@ def path_callback(ctx, param, value):
     return Path(value)
 
 
+def shard_callback(ctx, param, value):
+    """Click callback function for shards given as i/n."""
+    if value is None:
+        return None
+    from .shards import parse_shard
+    try:
+        return parse_shard(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+def shards_callback(ctx, param, value):
+    """Click callback function for multiple shard files."""
+    if not value:
+        return None
+    return [Path(path) for path in value]
+
+
 def unknown_threshold_callback(ctx, param, value):
     """
     Click callback function for threshold that has to be between 0.5 and 1.0
@@ -75,9 +100,59 @@ def unknown_threshold_callback(ctx, param, value):
     return value
 
 
+def make_feature_cache(directory: Optional[Path],
+                       size_mb: Optional[int]) -> Optional["FeatureCache"]:
+    """Feature cache for the --feature-cache(-size) options, if any."""
+    if directory is None:
+        if size_mb is not None:
+            raise ValueError("--feature-cache-size requires "
+                             "--feature-cache")
+        return None
+    from .cache import FeatureCache
+    max_size = size_mb * 1024 * 1024 if size_mb is not None else None
+    return FeatureCache(directory, max_size=max_size)
+
+
+def model_option_callback(ctx, param, value):
+    """
+    Click callback for models given as NAME=PATH, or as PATH, in which case
+    the model is named after the file.
+    """
+    models = {}
+    for item in value:
+        name, sep, path = item.partition("=")
+        if not sep:
+            name, path = Path(item).stem, item
+        if not Path(path).is_file():
+            raise click.BadParameter("model file {0} does not "
+                                     "exist".format(path))
+        if name in models:
+            raise click.BadParameter("model name {0} is used more than "
+                                     "once".format(name))
+        models[name] = Path(path)
+    return models
+
+
+def model_chunksize(model, chunksize: Optional[int]) -> int:
+    """
+    Chunksize to use with a model. Models store the chunksize they were
+    trained with since rna_cd 0.3.0.
+    """
+    trained = getattr(model, "chunksize_", None)
+    if chunksize is None:
+        return trained if trained is not None else 100
+    if trained is not None and trained != chunksize:
+        raise ValueError("Model was trained with chunksize {0}, "
+                         "not {1}".format(trained, chunksize))
+    return chunksize
+
+
 @click.command()
-@click.option("--chunksize", type=click.INT, default=100,
-              help="Chunksize in bases. Default = 100")
+@click.option("--chunksize", type=click.IntRange(min=1), default=[100],
+              multiple=True,
+              help="Chunksize in bases. Can be given multiple times, in "
+                   "which case the chunksize giving the best model is "
+                   "selected. Default = 100")
 @click.option("-c", "--contig", type=click.STRING, default="chrM",
               help="Name of mitochrondrial contig in your BAM files. "
                    "Default = chrM")
@@ -105,10 +180,101 @@ def unknown_threshold_callback(ctx, param, value):
               callback=list_callback,
               help="Path to file containing a list of paths to negative BAM "
                    "files. Mutuallly exclusive with --negatives-dir")
+@click.option("-ps", "--positives-shards", multiple=True,
+              type=click.Path(exists=True, dir_okay=False,
+                              file_okay=True, readable=True),
+              callback=shards_callback,
+              help="Shard file made with rna_cd-extract of the positive BAM "
+                   "files, instead of the BAM files themselves. Give all "
+                   "shards, by giving this option once for every shard. "
+                   "The chunksize and contig of the shards are used. "
+                   "Requires --negatives-shards.")
+@click.option("-ns", "--negatives-shards", multiple=True,
+              type=click.Path(exists=True, dir_okay=False,
+                              file_okay=True, readable=True),
+              callback=shards_callback,
+              help="Shard file made with rna_cd-extract of the negative BAM "
+                   "files. See --positives-shards.")
 @click.option("--cross-validations", type=click.INT, default=3,
               help="Number of folds for cross validation run. Default = 3")
 @click.option("--verbosity", type=click.INT, default=1,
               help="Verbosity value for cross validation step. Default = 1")
+@click.option("--backend",
+              type=click.Choice(["svc", "linear", "nystroem", "fourier"]),
+              default="svc",
+              help="Classifier of the model. svc is an exact SVM with an "
+                   "RBF kernel, of which training time grows quadratically "
+                   "to cubically with the number of BAM files. linear is a "
+                   "linear SVM, and nystroem and fourier approximate the "
+                   "RBF kernel before a linear SVM; their training time "
+                   "grows linearly. Default = svc")
+@click.option("--out-of-core", is_flag=True,
+              help="Store features on disk instead of in memory, and fit "
+                   "the scaler and an incremental PCA with "
+                   "--pca-components components in batches of --batch-size "
+                   "BAM files, on the training samples of every cross "
+                   "validation fold. Only the parameters of the classifier "
+                   "are searched. For training sets of which the features "
+                   "do not fit in memory. Requires a single --chunksize. "
+                   "With --dataset, the features are read from the "
+                   "dataset.")
+@click.option("--pca-components", type=click.IntRange(min=1), default=50,
+              help="Number of PCA components of --out-of-core training. "
+                   "Default = 50")
+@click.option("--batch-size", type=click.IntRange(min=1), default=1000,
+              help="Number of BAM files of which the features are in "
+                   "memory at a time during --out-of-core training. Must "
+                   "be at least --pca-components. Default = 1000")
+@click.option("--precompute-kernel/--no-precompute-kernel", default=True,
+              help="Fit the SVMs of the cross validation step on "
+                   "precomputed RBF kernels, which share one distance "
+                   "matrix for all gammas. The stored model is the same "
+                   "either way. Default = on")
+@click.option("--search", type=click.Choice(["exhaustive", "random",
+                                             "halving"]),
+              default="exhaustive",
+              help="Hyperparameter search strategy. exhaustive tries all "
+                   "candidates of the grid, random tries --n-candidates "
+                   "random candidates, and halving tries all candidates on "
+                   "a small subset of the samples and continues with the "
+                   "best on ever larger subsets. Default = exhaustive")
+@click.option("--n-candidates", type=click.IntRange(min=1), default=100,
+              help="Number of candidates of a random search. Default = 100")
+@click.option("--time-budget", type=click.FLOAT,
+              help="Stop the search after this many seconds, and use the "
+                   "best candidate found so far. Default = no limit")
+@click.option("--warm-start",
+              type=click.Path(exists=True, readable=True,
+                              file_okay=True, dir_okay=False),
+              callback=path_callback,
+              help="Path to a previous model. Only hyperparameters close "
+                   "to the best parameters of that model are searched.")
+@click.option("--dataset",
+              type=click.Path(file_okay=False, writable=True),
+              callback=path_callback,
+              help="Optional directory in which the features of all "
+                   "training BAM files are stored. If it exists, features "
+                   "are only calculated for BAM files that are new or "
+                   "changed since it was written, and BAM files that are no "
+                   "longer given are left out. Training reads the features "
+                   "from a memory map of the dataset. Requires a single "
+                   "--chunksize.")
+@click.option("--dataset-dtype", type=click.Choice(["float32", "float64"]),
+              help="Type of the features in the --dataset. float32 halves "
+                   "its size. Default = float64 for a new dataset, and the "
+                   "type of an existing one.")
+@click.option("--checkpoint",
+              type=click.Path(dir_okay=False, writable=True),
+              callback=path_callback,
+              help="Optional file to which the features of every BAM file "
+                   "are appended as soon as they are calculated, so that "
+                   "an interrupted run can be continued with --resume. "
+                   "Requires a single --chunksize.")
+@click.option("--resume", is_flag=True,
+              help="Skip BAM files of which the features are already in "
+                   "the --checkpoint file. The BAM files and labels must be "
+                   "the same, and in the same order, as in the interrupted "
+                   "run.")
 @click.option("-j", "--cores", type=click.INT, default=1,
               help="Number of cores to use for processing of BAM files "
                    "and cross validations. Default = 1")
@@ -117,35 +283,117 @@ def unknown_threshold_callback(ctx, param, value):
 @click.option("-o", "--model-out", type=click.Path(writable=True),
               required=True,
               help="Path where model will be stored.")
-def train_cli(chunksize: int, contig: str, model_out: Path,
+@click.option("--model-format", type=click.Choice(["json", "binary"]),
+              default="json",
+              help="Format of the stored model. Binary models load faster "
+                   "and with less memory, but can not be read by rna_cd "
+                   "versions before 0.3.0. Default = json")
+@click.option("--max-tasks-per-child", type=click.IntRange(min=1),
+              help="Number of BAM files after which a worker process is "
+                   "replaced by a fresh one, to limit memory growth during "
+                   "long runs. Default = never replaced")
+@click.option("--feature-cache",
+              type=click.Path(file_okay=False, writable=True),
+              callback=path_callback,
+              help="Optional directory in which features of BAM files are "
+                   "cached between runs.")
+@click.option("--feature-cache-size", type=click.IntRange(min=1),
+              help="Maximum size of the feature cache in megabytes. Least "
+                   "recently used entries are removed when it is exceeded. "
+                   "Default = unlimited")
+def train_cli(chunksize: List[int], contig: str, model_out: Path,
               positives_dir: Optional[List[Path]] = None,
               negatives_dir: Optional[List[Path]] = None,
               positives_list: Optional[List[Path]] = None,
               negatives_list: Optional[List[Path]] = None,
               cross_validations: int = 3,
               verbosity: int = 1, cores: int = 1,
-              plot_out: Optional[str] = None):
+              plot_out: Optional[str] = None,
+              model_format: str = "json",
+              max_tasks_per_child: Optional[int] = None,
+              feature_cache: Optional[Path] = None,
+              feature_cache_size: Optional[int] = None,
+              precompute_kernel: bool = True,
+              search: str = "exhaustive", n_candidates: int = 100,
+              time_budget: Optional[float] = None,
+              warm_start: Optional[Path] = None,
+              dataset: Optional[Path] = None,
+              dataset_dtype: Optional[str] = None,
+              backend: str = "svc", out_of_core: bool = False,
+              pca_components: int = 50, batch_size: int = 1000,
+              checkpoint: Optional[Path] = None, resume: bool = False,
+              positives_shards: Optional[List[Path]] = None,
+              negatives_shards: Optional[List[Path]] = None):
 
-    if positives_dir is None and positives_list is None:
-        raise ValueError("Must set either --positives-dir or --positives-list")
+    features = None
+    if positives_shards is not None or negatives_shards is not None:
+        if positives_shards is None or negatives_shards is None:
+            raise ValueError("--positives-shards and --negatives-shards "
+                             "must be given together")
+        if any(x is not None for x in (positives_dir, positives_list,
+                                       negatives_dir, negatives_list)):
+            raise ValueError("Shards can not be combined with BAM files")
+        from .shards import gather_shards
+        pos_X, pos_names, chunk, contig = gather_shards(positives_shards)
+        neg_X, neg_names, neg_chunk, neg_contig = gather_shards(
+            negatives_shards)
+        if (neg_chunk, neg_contig) != (chunk, contig):
+            raise ValueError(
+                "Positive shards have chunksize {0} and contig {1}, but "
+                "negative shards have chunksize {2} and contig {3}".format(
+                    chunk, contig, neg_chunk, neg_contig))
+        import numpy as np
+        features = np.concatenate([pos_X, neg_X])
+        chunksize = (chunk,)
+        positives = [Path(name) for name in pos_names]
+        negatives = [Path(name) for name in neg_names]
+    else:
+        if positives_dir is None and positives_list is None:
+            raise ValueError("Must set either --positives-dir or "
+                             "--positives-list")
 
-    if negatives_dir is None and negatives_list is None:
-        raise ValueError("Must set either --negatives-dir or --negatives-list")
+        if negatives_dir is None and negatives_list is None:
+            raise ValueError("Must set either --negatives-dir or "
+                             "--negatives-list")
 
-    positives = positives_dir if positives_dir is not None else positives_list
-    negatives = negatives_dir if negatives_dir is not None else negatives_list
+        positives = (positives_dir if positives_dir is not None
+                     else positives_list)
+        negatives = (negatives_dir if negatives_dir is not None
+                     else negatives_list)
 
-    model = train_svm_model(positives, negatives, chunksize=chunksize,
+    cache = make_feature_cache(feature_cache, feature_cache_size)
+    best_params = None
+    if warm_start is not None:
+        previous = load_sklearn_object_from_disk(warm_start)
+        if not hasattr(previous, "best_params_"):
+            raise ValueError("{0} is not a trained model.".format(warm_start))
+        best_params = previous.best_params_
+
+    from .models import train_svm_model
+    model = train_svm_model(positives, negatives, chunksize=list(chunksize),
                             contig=contig, cross_validations=cross_validations,
                             verbosity=verbosity, cores=cores,
-                            plot_out=plot_out)
+                            plot_out=plot_out, cache=cache,
+                            max_tasks_per_child=max_tasks_per_child,
+                            precompute_kernel=precompute_kernel,
+                            search=search, n_candidates=n_candidates,
+                            time_budget=time_budget, warm_start=best_params,
+                            dataset=dataset, dataset_dtype=dataset_dtype,
+                            backend=backend,
+                            out_of_core=out_of_core,
+                            n_components=pca_components,
+                            batch_size=batch_size, checkpoint=checkpoint,
+                            resume=resume, features=features)
 
-    save_sklearn_object_to_disk(model, Path(model_out))
+    save_sklearn_object_to_disk(model, Path(model_out),
+                                binary=model_format == "binary")
 
 
 @click.command()
-@click.option("--chunksize", type=click.INT, default=100,
-              help="Chunksize in bases. Default = 100")
+@click.option("--chunksize", type=click.INT,
+              help="Chunksize in bases. Must be the chunksize the model "
+                   "was trained with. Default = the chunksize stored in "
+                   "the model, or 100 for models that do not store it.")
 @click.option("-c", "--contig", type=click.STRING, default="chrM",
               help="Name of mitochrondrial contig in your BAM files. "
                    "Default = chrM")
@@ -164,6 +412,14 @@ def train_cli(chunksize: int, contig: str, model_out: Path,
               callback=list_callback,
               help="Path to file containing list of paths to BAM files to be "
                    "tested. Mutually exclusive with --directory")
+@click.option("--shards", multiple=True,
+              type=click.Path(exists=True, dir_okay=False,
+                              file_okay=True, readable=True),
+              callback=shards_callback,
+              help="Shard file made with rna_cd-extract, instead of BAM "
+                   "files. Give all shards, by giving this option once for "
+                   "every shard. The chunksize and contig of the shards "
+                   "must be the ones of the model.")
 @click.option("-m", "--model",
               type=click.Path(exists=True, readable=True,
                               file_okay=True, dir_okay=False),
@@ -177,34 +433,333 @@ def train_cli(chunksize: int, contig: str, model_out: Path,
               help="Threshold of most likely probability below which samples"
                    "wll be assinged as 'unknown'. Default = 0.75",
               callback=unknown_threshold_callback)
-def classify_cli(chunksize: int, contig: str, cores: int,
+@click.option("--stream", is_flag=True,
+              help="Write each classification to the output file as soon "
+                   "as its BAM file has been processed, instead of when "
+                   "all BAM files are done. Rows are written in order of "
+                   "completion.")
+@click.option("--keep-order", is_flag=True,
+              help="With --stream, --resume or --batch-size, reorder the "
+                   "output file to the input order once all BAM files are "
+                   "done. Without these options the output file is always "
+                   "in input order.")
+@click.option("--resume", is_flag=True,
+              help="Skip BAM files that are already in the output file, "
+                   "and append the others. Files are identified by name. "
+                   "Implies --stream.")
+@click.option("--batch-size", type=click.IntRange(min=1),
+              help="Classify BAM files in batches of this many files, and "
+                   "write the classifications of every batch to the output "
+                   "file as soon as it is done, in input order. The next "
+                   "batch is processed while the current one is written, "
+                   "and memory use does not grow with the number of BAM "
+                   "files. Default = all BAM files at once")
+@click.option("--max-tasks-per-child", type=click.IntRange(min=1),
+              help="Number of BAM files after which a worker process is "
+                   "replaced by a fresh one, to limit memory growth during "
+                   "long runs. Default = never replaced")
+@click.option("--feature-cache",
+              type=click.Path(file_okay=False, writable=True),
+              callback=path_callback,
+              help="Optional directory in which features of BAM files are "
+                   "cached between runs.")
+@click.option("--feature-cache-size", type=click.IntRange(min=1),
+              help="Maximum size of the feature cache in megabytes. Least "
+                   "recently used entries are removed when it is exceeded. "
+                   "Default = unlimited")
+def classify_cli(chunksize: Optional[int], contig: str, cores: int,
                  directory: Optional[List[Path]],
                  list_items: Optional[List[Path]], model: Path,
-                 output: Path, unknown_threshold: float):
+                 output: Path, unknown_threshold: float,
+                 stream: bool = False, keep_order: bool = False,
+                 resume: bool = False, batch_size: Optional[int] = None,
+                 max_tasks_per_child: Optional[int] = None,
+                 feature_cache: Optional[Path] = None,
+                 feature_cache_size: Optional[int] = None,
+                 shards: Optional[List[Path]] = None):
 
+    if keep_order and not (stream or resume or batch_size is not None):
+        raise ValueError("--keep-order requires --stream, --resume or "
+                         "--batch-size")
+    if shards is not None:
+        classify_shards(shards, model, output, chunksize, unknown_threshold,
+                        stream or resume or batch_size is not None or
+                        directory is not None or list_items is not None)
+        return
     if directory is None and list_items is None:
         raise ValueError("Must set either --directory or --list-items")
 
     bam_files = directory if directory is not None else list_items
+    cache = make_feature_cache(feature_cache, feature_cache_size)
 
+    from .models import (predict_labels_and_prob, iter_predictions,
+                         iter_prediction_batches)
     echo("Loading model from disk.")
     sklearn_model = load_sklearn_object_from_disk(model)
+    chunksize = model_chunksize(sklearn_model, chunksize)
+    if stream or resume or batch_size is not None:
+        if resume:
+            done = classified_names(output)
+            todo = [bam for bam in bam_files if bam.name not in done]
+            echo("Skipping {0} BAM files that are already classified.".format(
+                len(bam_files) - len(todo)))
+        else:
+            todo = bam_files
+            if output.exists():
+                output.unlink()
+        echo("Running predictions.")
+        with open_for_append(output) as ohandle:
+            if batch_size is not None:
+                batches = iter_prediction_batches(
+                    sklearn_model, todo, batch_size, chunksize=chunksize,
+                    contig=contig, cores=cores,
+                    unknown_threshold=unknown_threshold, cache=cache,
+                    max_tasks_per_child=max_tasks_per_child
+                )
+                for start, batch in batches:
+                    names = [bam.name for bam in
+                             todo[start:start + len(batch)]]
+                    write_rows(ohandle, names, batch)
+            else:
+                predictions = iter_predictions(
+                    sklearn_model, todo, chunksize=chunksize, contig=contig,
+                    cores=cores, unknown_threshold=unknown_threshold,
+                    cache=cache, max_tasks_per_child=max_tasks_per_child
+                )
+                for index, pred in predictions:
+                    write_row(ohandle, todo[index].name, pred)
+        if keep_order:
+            echo("Reordering predictions to input order.")
+            reorder_output(output, [bam.name for bam in bam_files])
+    else:
+        echo("Running predictions.")
+        predictions = predict_labels_and_prob(
+            sklearn_model, bam_files, chunksize=chunksize, contig=contig,
+            cores=cores, unknown_threshold=unknown_threshold, cache=cache,
+            max_tasks_per_child=max_tasks_per_child
+        )
+        echo("Writing predictions to disk.")
+        with output.open("w") as ohandle:
+            ohandle.write(HEADER)
+            ohandle.write(format_rows([bam.name for bam in bam_files],
+                                      predictions))
+    echo("Done.")
+
+
+def classify_shards(shards: List[Path], model: Path, output: Path,
+                    chunksize: Optional[int], unknown_threshold: float,
+                    other_options: bool) -> None:
+    """Classify the BAM files of shard files, see classify_cli."""
+    if other_options:
+        raise ValueError("--shards can not be combined with BAM files, "
+                         "--stream, --resume or --batch-size")
+    from .models import PredictionBatch
+    from .shards import gather_shards
+    arr_X, names, shard_chunksize, contig = gather_shards(shards)
+    echo("Loading model from disk.")
+    sklearn_model = load_sklearn_object_from_disk(model)
+    if chunksize is not None and chunksize != shard_chunksize:
+        raise ValueError("Shards have chunksize {0}, not {1}".format(
+            shard_chunksize, chunksize))
+    model_chunksize(sklearn_model, shard_chunksize)
+    trained_contig = getattr(sklearn_model, "contig_", None)
+    if trained_contig is not None and trained_contig != contig:
+        raise ValueError("Model was trained with contig {0}, but shards "
+                         "have contig {1}".format(trained_contig, contig))
     echo("Running predictions.")
-    predictions = predict_labels_and_prob(sklearn_model, bam_files,
-                                          chunksize=chunksize,
-                                          contig=contig, cores=cores,
-                                          unknown_threshold=unknown_threshold)
+    predictions = PredictionBatch.from_model_proba(
+        sklearn_model, sklearn_model.predict_proba(arr_X), unknown_threshold)
     echo("Writing predictions to disk.")
     with output.open("w") as ohandle:
-        header = ('filename\tpredicted_class\tpredicted_class_probability\t'
-                  'positive class probability\tnegative class probability\n')
-        ohandle.write(header)
-        for bam, pred in zip(bam_files, predictions):
-            fmt = "{fname}\t{pred_cl}\t{pred_prob}\t{pos_prob}\t{neg_prob}\n"
-            to_write = fmt.format(fname=bam.name,
-                                  pred_cl=pred.prediction.value,
-                                  pred_prob=pred.most_likely_prob,
-                                  pos_prob=pred.pos_prob,
-                                  neg_prob=pred.neg_prob)
-            ohandle.write(to_write)
+        ohandle.write(HEADER)
+        ohandle.write(format_rows([Path(name).name for name in names],
+                                  predictions))
+    echo("Done.")
+
+
+@click.command()
+@click.option("--chunksize", type=click.IntRange(min=1), default=100,
+              help="Chunksize in bases. Must be the same for all shards. "
+                   "Default = 100")
+@click.option("-c", "--contig", type=click.STRING, default="chrM",
+              help="Name of mitochrondrial contig in your BAM files. "
+                   "Default = chrM")
+@click.option("-j", "--cores", type=click.INT, default=1,
+              help="Number of cores to use for processing of BAM files. "
+                   "Default = 1")
+@click.option("-d", "--directory",
+              type=click.Path(exists=True, readable=True,
+                              dir_okay=True, file_okay=False),
+              callback=directory_callback,
+              help="Path to directory with BAM files of which to extract "
+                   "a shard. Mutually exclusive with --list-items")
+@click.option("-l", "--list-items",
+              type=click.Path(exists=True, readable=True,
+                              file_okay=True, dir_okay=False),
+              callback=list_callback,
+              help="Path to file containing list of paths to BAM files of "
+                   "which to extract a shard. Mutually exclusive with "
+                   "--directory")
+@click.option("--shard", type=click.STRING, default="1/1",
+              callback=shard_callback,
+              help="Shard to extract, as i/n: the i-th of n equal parts of "
+                   "the BAM files, numbered from 1. For example "
+                   "$SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT in a "
+                   "job array starting at 1. Default = 1/1")
+@click.option("-o", "--output", type=click.Path(writable=True,
+                                                dir_okay=False),
+              required=True, callback=path_callback,
+              help="Path of the shard file.")
+@click.option("--max-tasks-per-child", type=click.IntRange(min=1),
+              help="Number of BAM files after which a worker process is "
+                   "replaced by a fresh one, to limit memory growth during "
+                   "long runs. Default = never replaced")
+@click.option("--feature-cache",
+              type=click.Path(file_okay=False, writable=True),
+              callback=path_callback,
+              help="Optional directory in which features of BAM files are "
+                   "cached between runs.")
+@click.option("--feature-cache-size", type=click.IntRange(min=1),
+              help="Maximum size of the feature cache in megabytes. Least "
+                   "recently used entries are removed when it is exceeded. "
+                   "Default = unlimited")
+def extract_cli(chunksize: int, contig: str, cores: int,
+                directory: Optional[List[Path]],
+                list_items: Optional[List[Path]], shard: Tuple[int, int],
+                output: Path, max_tasks_per_child: Optional[int] = None,
+                feature_cache: Optional[Path] = None,
+                feature_cache_size: Optional[int] = None):
+    """
+    Extract the features of a shard of a list of BAM files, so that
+    extraction can be distributed over the nodes of a cluster. Shard files
+    of all shards can be used instead of BAM files for rna_cd-train and
+    rna_cd-classify.
+    """
+    if directory is None and list_items is None:
+        raise ValueError("Must set either --directory or --list-items")
+
+    # every shard must see the files of a directory in the same order,
+    # on every node.
+    bam_files = sorted(directory) if directory is not None else list_items
+    cache = make_feature_cache(feature_cache, feature_cache_size)
+    from .shards import extract_shard
+    echo("Extracting features of shard {0} of {1}.".format(*shard))
+    extracted = extract_shard(bam_files, shard[0], shard[1], chunksize,
+                              contig, cores, cache=cache,
+                              max_tasks_per_child=max_tasks_per_child)
+    echo("Writing {0} BAM files to {1}.".format(len(extracted), output))
+    extracted.save(output)
+    echo("Done.")
+
+
+@click.command()
+@click.option("-c", "--contig", type=click.STRING, default="chrM",
+              help="Name of mitochrondrial contig in your BAM files. "
+                   "Default = chrM")
+@click.option("-j", "--cores", type=click.INT, default=1,
+              help="Number of cores to use for processing of BAM files. "
+                   "Default = 1")
+@click.option("-d", "--directory",
+              type=click.Path(exists=True, readable=True,
+                              dir_okay=True, file_okay=False),
+              callback=directory_callback,
+              help="Path to directory with BAM files to be profiled. "
+                   "Mutually exclusive with --list-items")
+@click.option("-l", "--list-items",
+              type=click.Path(exists=True, readable=True,
+                              file_okay=True, dir_okay=False),
+              callback=list_callback,
+              help="Path to file containing list of paths to BAM files to be "
+                   "profiled. Mutually exclusive with --directory")
+@click.option("-o", "--output-dir",
+              type=click.Path(writable=True, file_okay=False),
+              required=True, callback=path_callback,
+              help="Directory where profile files will be stored.")
+def profile_cli(contig: str, cores: int,
+                directory: Optional[List[Path]],
+                list_items: Optional[List[Path]], output_dir: Path):
+    """
+    Store base-resolution profiles of BAM files, from which features for
+    any chunksize can be derived. Profile files can be used instead of BAM
+    files for rna_cd-train and rna_cd-classify.
+    """
+    if directory is None and list_items is None:
+        raise ValueError("Must set either --directory or --list-items")
+
+    bam_files = directory if directory is not None else list_items
+    output_dir.mkdir(parents=True, exist_ok=True)
+    from .bam_process import write_profiles
+    write_profiles(bam_files, output_dir, contig=contig, cores=cores)
+    echo("Done.")
+
+
+@click.command()
+@click.option("-m", "--model", "models", multiple=True, required=True,
+              callback=model_option_callback,
+              help="Model to load, as NAME=PATH, or as PATH in which case "
+                   "the model is named after the file. Can be given "
+                   "multiple times.")
+@click.option("-c", "--contig", type=click.STRING, default="chrM",
+              help="Name of mitochrondrial contig in your BAM files. "
+                   "Default = chrM")
+@click.option("-j", "--cores", type=click.INT, default=1,
+              help="Number of worker processes for processing of BAM files. "
+                   "Default = 1")
+@click.option("--host", type=click.STRING, default="127.0.0.1",
+              help="Address to listen on. Default = 127.0.0.1")
+@click.option("-p", "--port", type=click.IntRange(min=0, max=65535),
+              default=8765, help="Port to listen on. Default = 8765")
+@click.option("-s", "--socket", "socket_path",
+              type=click.Path(dir_okay=False, writable=True),
+              callback=path_callback,
+              help="Listen on this Unix socket instead of a port.")
+@click.option("--max-queue", type=click.IntRange(min=1), default=64,
+              help="Maximum number of requests that are being processed or "
+                   "waiting for a worker. Further requests are refused. "
+                   "Default = 64")
+@click.option("--max-tasks-per-child", type=click.IntRange(min=1),
+              help="Number of BAM files after which a worker process is "
+                   "replaced by a fresh one, to limit memory growth during "
+                   "long runs. Default = never replaced")
+@click.option("--feature-cache",
+              type=click.Path(file_okay=False, writable=True),
+              callback=path_callback,
+              help="Optional directory in which features of BAM files are "
+                   "cached between runs.")
+@click.option("--feature-cache-size", type=click.IntRange(min=1),
+              help="Maximum size of the feature cache in megabytes. Least "
+                   "recently used entries are removed when it is exceeded. "
+                   "Default = unlimited")
+def serve_cli(models: Dict[str, Path], contig: str, cores: int, host: str,
+              port: int, socket_path: Optional[Path], max_queue: int,
+              max_tasks_per_child: Optional[int] = None,
+              feature_cache: Optional[Path] = None,
+              feature_cache_size: Optional[int] = None):
+    """
+    Serve classifications over HTTP, with models loaded once. Use
+    rna_cd-client to classify BAM files with the server.
+    """
+    from .server import ClassificationService, serve
+    cache = make_feature_cache(feature_cache, feature_cache_size)
+    loaded = {}
+    for name, path in models.items():
+        echo("Loading model {0} from disk.".format(name))
+        sklearn_model = load_sklearn_object_from_disk(path)
+        loaded[name] = (sklearn_model, model_chunksize(sklearn_model, None))
+    service = ClassificationService(loaded, contig=contig, cores=cores,
+                                    max_queue=max_queue, cache=cache,
+                                    max_tasks_per_child=max_tasks_per_child)
+    serve(service, host, port, socket_path)
+
+
+@click.command()
+@click.argument("src", type=click.Path(exists=True, dir_okay=False),
+                callback=path_callback)
+@click.argument("dest", type=click.Path(writable=True, dir_okay=False),
+                callback=path_callback)
+def migrate_model_cli(src: Path, dest: Path):
+    """
+    Convert a model in JSON format (SRC) to the binary format (DEST).
+    """
+    migrate_model(src, dest)
     echo("Done.")
@@ -0,0 +1,144 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+client.py
+~~~~~~~~~
+
+Thin client for the classification server (see server.py). It only uses
+the standard library and click, so that it starts quickly.
+"""
+import http.client
+import json
+import socket
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import click
+
+# same header as output.HEADER; not imported to keep startup fast.
+HEADER = ('filename\tpredicted_class\tpredicted_class_probability\t'
+          'positive class probability\tnegative class probability\n')
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket"""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def connect(url: Optional[str] = None, socket_path: Optional[Path] = None,
+            timeout: Optional[float] = None) -> http.client.HTTPConnection:
+    """Connection to a server at an http url or a Unix socket"""
+    if socket_path is not None:
+        return UnixHTTPConnection(str(socket_path), timeout=timeout)
+    if url is None:
+        raise ValueError("Either a url or a socket path must be given.")
+    parts = urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port,
+                                      timeout=timeout)
+
+
+def _request(conn: http.client.HTTPConnection, method: str, path: str,
+             body: Optional[Dict[str, Any]] = None) -> Tuple[int, str]:
+    headers = {}
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    try:
+        conn.request(method, path, body=data, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read().decode("utf-8")
+    finally:
+        conn.close()
+
+
+def classify_remote(conn: http.client.HTTPConnection, bam: Path,
+                    model: Optional[str] = None,
+                    unknown_threshold: Optional[float] = None) -> str:
+    """
+    Classify a BAM file on a server.
+
+    :returns: output row for the BAM file, as rna_cd-classify writes it.
+    """
+    request = {"path": str(bam.resolve())}
+    if model is not None:
+        request["model"] = model
+    if unknown_threshold is not None:
+        request["unknown_threshold"] = unknown_threshold
+    status, text = _request(conn, "POST", "/classify", request)
+    if status != 200:
+        raise ValueError("Server could not classify {0}: {1}".format(
+            bam, json.loads(text).get("error")))
+    return text
+
+
+def server_health(conn: http.client.HTTPConnection) -> Dict[str, Any]:
+    status, text = _request(conn, "GET", "/health")
+    if status != 200:
+        raise ValueError("Server is not healthy: {0}".format(text))
+    return json.loads(text)
+
+
+@click.command()
+@click.option("-u", "--url", type=click.STRING,
+              help="URL of the server, e.g. http://127.0.0.1:8765. "
+                   "Mutually exclusive with --socket")
+@click.option("-s", "--socket", "socket_path",
+              type=click.Path(exists=True, dir_okay=False),
+              help="Path to Unix socket of the server. "
+                   "Mutually exclusive with --url")
+@click.option("-m", "--model", type=click.STRING,
+              help="Name of the model to use. Required when the server has "
+                   "loaded multiple models.")
+@click.option("-t", "--unknown-threshold", type=click.FLOAT,
+              help="Threshold of most likely probability below which samples"
+                   "wll be assinged as 'unknown'. Default = 0.75")
+@click.option("--header", is_flag=True,
+              help="Print the header line of the output first.")
+@click.option("--health", is_flag=True,
+              help="Print the health of the server instead of classifying.")
+@click.argument("bams", nargs=-1,
+                type=click.Path(exists=True, dir_okay=False))
+def client_cli(url: Optional[str], socket_path: Optional[str],
+               model: Optional[str], unknown_threshold: Optional[float],
+               header: bool, health: bool, bams: Tuple[str, ...]):
+    """
+    Classify BAM files with a running rna_cd-serve server. Prints one
+    classification row per BAM file to stdout.
+    """
+    if (url is None) == (socket_path is None):
+        raise ValueError("Must set either --url or --socket")
+    sock = Path(socket_path) if socket_path is not None else None
+
+    if health:
+        click.echo(json.dumps(server_health(connect(url, sock)), indent=2))
+        return
+    if header:
+        click.echo(HEADER, nl=False)
+    for bam in bams:
+        row = classify_remote(connect(url, sock), Path(bam), model,
+                              unknown_threshold)
+        click.echo(row, nl=False)
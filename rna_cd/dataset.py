@@ -0,0 +1,363 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+dataset.py
+~~~~~~~~~~
+
+Training datasets that keep the features of every BAM file, so that
+retraining only processes new or changed files.
+
+A dataset is stored as a directory with one file per column. The features
+are a raw row-major float32 or float64 matrix in ``features.bin``, which is
+memory mapped when the dataset is loaded, so that training can read it
+without copying it into memory. The labels, file identities and extraction
+parameters are stored in ``meta.json``. Rows are appended by writing them
+to the end of ``features.bin``, after which ``meta.json`` is replaced; rows
+of an interrupted append are not in ``meta.json``, and are overwritten by
+the next append.
+"""
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .bam_process import make_array_set
+from .cache import FeatureCache, file_digest
+from .utils import echo
+
+# bump this whenever the layout of dataset directories changes.
+_DATASET_VERSION = 2
+
+DATASET_DTYPES = ("float32", "float64")
+
+_FEATURES_FILE = "features.bin"
+_META_FILE = "meta.json"
+
+# number of rows that are written at once, so that datasets that are
+# memory maps are not read into memory as a whole.
+_WRITE_BATCH_SIZE = 1000
+
+
+def file_identity(path: Path) -> Tuple[str, str]:
+    """
+    Identity of a BAM file in a dataset.
+
+    :returns: tuple of the resolved path, and the size, modification time
+              and content digest of the file. The second element changes
+              whenever the file changes.
+    """
+    real_path = os.path.realpath(str(path))
+    stat = os.stat(real_path)
+    return real_path, "{0}:{1}:{2}".format(
+        stat.st_size, stat.st_mtime_ns, file_digest(Path(real_path)))
+
+
+def is_memory_map(arr: np.ndarray) -> bool:
+    """True if arr is a memory map of a whole file, not a view of one."""
+    return isinstance(arr, np.memmap) and isinstance(arr.base, mmap.mmap)
+
+
+def _write_meta(directory: Path, meta: dict) -> None:
+    """Replace the meta file of a dataset directory atomically."""
+    fd, tmp_name = tempfile.mkstemp(dir=str(directory), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as handle:
+            json.dump(meta, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_name, str(directory / _META_FILE))
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def _write_rows(handle, arr_X: np.ndarray, dtype: np.dtype,
+                rows: Optional[np.ndarray] = None) -> None:
+    """
+    Write the rows of arr_X to a binary file, in batches, see
+    incremental.iter_batches.
+    """
+    from .incremental import iter_batches
+
+    for batch in iter_batches(arr_X, _WRITE_BATCH_SIZE, rows=rows):
+        handle.write(np.ascontiguousarray(batch, dtype=dtype).tobytes())
+
+
+class TrainingDataset(object):
+    """
+    Features and labels of the BAM files of a training set.
+
+    Datasets can be sliced like arrays; slices with a slice object are
+    views of the features, other indices copy them.
+
+    :param arr_X: features, of shape (n_files, n_features).
+    :param arr_Y: labels, of shape (n_files,).
+    :param paths: resolved paths of the BAM files, see file_identity.
+    :param versions: size, modification time and digest of the BAM files,
+           see file_identity.
+    :param chunksize: chunksize of the features.
+    :param contig: contig of the features.
+    """
+    def __init__(self, arr_X: np.ndarray, arr_Y: np.ndarray,
+                 paths: List[str], versions: List[str], chunksize: int,
+                 contig: str):
+        if not len(arr_X) == len(arr_Y) == len(paths) == len(versions):
+            raise ValueError("A dataset must have features, a label, a path "
+                             "and a version for every file.")
+        self.arr_X = arr_X
+        self.arr_Y = arr_Y
+        self.paths = list(paths)
+        self.versions = list(versions)
+        self.chunksize = chunksize
+        self.contig = contig
+        # directory the dataset was loaded from, see load.
+        self.path = None  # type: Optional[Path]
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, key: Union[slice, List[int], np.ndarray]
+                    ) -> "TrainingDataset":
+        if isinstance(key, slice):
+            paths, versions = self.paths[key], self.versions[key]
+        else:
+            key = np.asarray(key, dtype=int)
+            paths = [self.paths[index] for index in key]
+            versions = [self.versions[index] for index in key]
+        return TrainingDataset(self.arr_X[key], self.arr_Y[key], paths,
+                               versions, self.chunksize, self.contig)
+
+    def _meta(self, dtype: np.dtype, n_features: int,
+              rows: Optional[np.ndarray] = None) -> dict:
+        if rows is None:
+            rows = np.arange(len(self))
+        labels = np.asarray(self.arr_Y)[rows].tolist()
+        return {"version": _DATASET_VERSION, "chunksize": self.chunksize,
+                "contig": self.contig, "dtype": np.dtype(dtype).name,
+                "n_features": n_features,
+                "labels": [str(label) for label in labels],
+                "paths": [self.paths[index] for index in rows],
+                "versions": [self.versions[index] for index in rows]}
+
+    def save(self, path: Path, dtype: Optional[str] = None,
+             rows: Optional[List[int]] = None) -> None:
+        """
+        Save the dataset to a dataset directory. An existing dataset
+        directory is replaced, which may be the directory of this dataset.
+
+        :param dtype: float32 or float64. Default = the dtype of the
+               features.
+        :param rows: optional indices of the rows to save, in this order.
+               The rows are read in batches, so a memory mapped dataset is
+               never read into memory as a whole. Default = all rows.
+        """
+        if rows is not None:
+            rows = np.asarray(rows, dtype=int)
+        dtype = np.dtype(dtype or self.arr_X.dtype)
+        if dtype.name not in DATASET_DTYPES:
+            raise ValueError("Features of a dataset must be float32 or "
+                             "float64, not {0}".format(dtype.name))
+        n_features = self.arr_X.shape[1] if self.arr_X.ndim == 2 else 0
+        # write to a temporary directory and rename it, so that an
+        # interrupted run never leaves a partial dataset behind.
+        parent = path.parent if str(path.parent) else Path(".")
+        tmp_dir = Path(tempfile.mkdtemp(dir=str(parent), suffix=".tmp"))
+        try:
+            with (tmp_dir / _FEATURES_FILE).open("wb") as handle:
+                _write_rows(handle, self.arr_X, dtype, rows)
+                handle.flush()
+                os.fsync(handle.fileno())
+            _write_meta(tmp_dir, self._meta(dtype, n_features, rows))
+            if path.exists():
+                # the features of a loaded dataset stay readable after
+                # its directory is removed.
+                old_dir = Path(tempfile.mkdtemp(dir=str(parent),
+                                                suffix=".old"))
+                os.replace(str(path), str(old_dir / "dataset"))
+                os.replace(str(tmp_dir), str(path))
+                shutil.rmtree(str(old_dir))
+            else:
+                os.replace(str(tmp_dir), str(path))
+        except BaseException:
+            shutil.rmtree(str(tmp_dir), ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> "TrainingDataset":
+        """
+        Load a dataset stored with save. The features are a read-only
+        memory map of the features file.
+
+        :raises ValueError: if the path is not a dataset of this version.
+        """
+        try:
+            with (path / _META_FILE).open("r") as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            raise ValueError("{0} is not a dataset directory.".format(path))
+        if meta.get("version") != _DATASET_VERSION:
+            raise ValueError("Dataset {0} has an unsupported "
+                             "version.".format(path))
+        shape = (len(meta["paths"]), meta["n_features"])
+        if shape[0] * shape[1] == 0:
+            # empty files can not be memory mapped
+            arr_X = np.empty(shape, dtype=meta["dtype"])
+        else:
+            arr_X = np.memmap(str(path / _FEATURES_FILE),
+                              dtype=meta["dtype"], mode="r", shape=shape)
+        dataset = cls(arr_X, np.array(meta["labels"]), meta["paths"],
+                      meta["versions"], meta["chunksize"], meta["contig"])
+        dataset.path = path
+        return dataset
+
+    def append(self, arr_X: np.ndarray, arr_Y: np.ndarray,
+               paths: List[str], versions: List[str]) -> None:
+        """
+        Append rows to a loaded dataset, on disk and in this object.
+
+        :param arr_X: features of the new rows; cast to the dtype of the
+               dataset.
+        """
+        if self.path is None:
+            raise ValueError("Rows can only be appended to a dataset that "
+                             "was loaded from disk.")
+        if not len(arr_X) == len(arr_Y) == len(paths) == len(versions):
+            raise ValueError("A dataset must have features, a label, a path "
+                             "and a version for every file.")
+        if len(arr_X) == 0:
+            return
+        n_features = arr_X.shape[1]
+        if len(self) and n_features != self.arr_X.shape[1]:
+            raise ValueError("Features of new files do not match the "
+                             "features of the dataset.")
+        dtype = self.arr_X.dtype
+        features_file = self.path / _FEATURES_FILE
+        with features_file.open("r+b") as handle:
+            # rows of an interrupted append are overwritten
+            handle.truncate(len(self) * n_features * dtype.itemsize)
+            handle.seek(0, os.SEEK_END)
+            _write_rows(handle, arr_X, dtype)
+            handle.flush()
+            os.fsync(handle.fileno())
+        self.arr_Y = np.concatenate([self.arr_Y, np.asarray(arr_Y)])
+        self.paths += list(paths)
+        self.versions += list(versions)
+        _write_meta(self.path, self._meta(dtype, n_features))
+        self.arr_X = np.memmap(str(features_file), dtype=dtype, mode="r",
+                               shape=(len(self), n_features))
+
+
+def update_dataset(dataset: Optional[TrainingDataset],
+                   bam_files: List[Path], labels: List[Any],
+                   chunksize: int = 100, contig: str = "chrM",
+                   cores: int = 1, cache: Optional[FeatureCache] = None,
+                   max_tasks_per_child: Optional[int] = None
+                   ) -> TrainingDataset:
+    """
+    Make a dataset of bam files, reusing the features of a previous
+    dataset for files that did not change.
+
+    Features are only calculated for files that are not in the previous
+    dataset, or that changed since. Files of the previous dataset that are
+    not in bam_files are left out, and labels are always taken from
+    labels. The previous dataset is not used at all when it was made with
+    another chunksize or contig.
+
+    When the previous dataset was loaded from disk, the features of new
+    files are appended to it on disk. If the dataset then does not have
+    exactly bam_files in the same order, its directory is rewritten with
+    the rows of bam_files, in batches. Labels are updated on disk, and the
+    dataset is returned with its features memory mapped.
+
+    :param dataset: Optional previous dataset.
+    :param bam_files: List of paths to bam files.
+    :param labels: List of labels of the bam files.
+    :param cores: number of cores to use for processing, see
+           make_array_set
+    :param cache: optional feature cache, see make_array_set
+    :param max_tasks_per_child: see make_array_set
+    :returns: dataset of bam_files, in the order of bam_files.
+    """
+    if len(bam_files) != len(labels):
+        raise ValueError("Every bam file must have a label.")
+    identities = [file_identity(path) for path in bam_files]
+    if len(set(real for real, _ in identities)) != len(identities):
+        raise ValueError("A bam file can only be in a dataset once.")
+
+    previous = {}
+    if dataset is not None:
+        if dataset.chunksize == chunksize and dataset.contig == contig:
+            previous = {identity: row for row, identity in
+                        enumerate(zip(dataset.paths, dataset.versions))}
+        else:
+            echo("Dataset was made with chunksize {0} and contig {1}, "
+                 "features of all files are calculated again.".format(
+                     dataset.chunksize, dataset.contig))
+            dataset = None
+    reused = [index for index, identity in enumerate(identities)
+              if identity in previous]
+    new = [index for index, identity in enumerate(identities)
+           if identity not in previous]
+    if dataset is not None:
+        removed = set(dataset.paths) - set(real for real, _ in identities)
+        echo("Reusing features of {0} files, calculating features of {1} "
+             "files, leaving out {2} files.".format(
+                 len(reused), len(new), len(removed)))
+
+    new_X, _ = make_array_set([bam_files[index] for index in new], [],
+                              chunksize, contig, cores, cache=cache,
+                              max_tasks_per_child=max_tasks_per_child)
+    if dataset is not None and dataset.path is not None:
+        rows = [previous.get(identity, -1) for identity in identities]
+        for offset, index in enumerate(new):
+            rows[index] = len(dataset) + offset
+        dataset.append(new_X, np.array([labels[index] for index in new]),
+                       [identities[index][0] for index in new],
+                       [identities[index][1] for index in new])
+        if rows != list(range(len(dataset))):
+            dataset.save(dataset.path, rows=rows)
+            dataset = TrainingDataset.load(dataset.path)
+        if dataset.arr_Y.tolist() != [str(label) for label in labels]:
+            dataset.arr_Y = np.array(labels)
+            _write_meta(dataset.path, dataset._meta(dataset.arr_X.dtype,
+                                                    dataset.arr_X.shape[1]))
+        return dataset
+
+    if dataset is not None and reused:
+        n_features = dataset.arr_X.shape[1]
+        dtype = dataset.arr_X.dtype
+    else:
+        n_features = new_X.shape[1]
+        dtype = new_X.dtype
+    if new and new_X.shape[1] != n_features:
+        raise ValueError("Features of new files do not match the features "
+                         "of the dataset.")
+    arr_X = np.empty((len(bam_files), n_features), dtype=dtype)
+    if reused:
+        arr_X[reused] = dataset.arr_X[[previous[identities[index]]
+                                       for index in reused]]
+    if new:
+        arr_X[new] = new_X
+    return TrainingDataset(arr_X, np.array(labels),
+                           [real for real, _ in identities],
+                           [version for _, version in identities],
+                           chunksize, contig)
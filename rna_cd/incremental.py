@@ -0,0 +1,239 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+incremental.py
+~~~~~~~~~~~~~~
+
+Out-of-core training, for training sets of which the features do not fit
+in memory.
+
+Features are written to a feature store on disk as they are extracted.
+The scaler and an incremental PCA are fitted on batches of the store, so
+that only one batch of features is in memory at a time. The classifier is
+then trained on the PCA projection of all samples, which is much smaller
+than the features.
+"""
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .bam_process import iter_features
+from .cache import FeatureCache
+from .dataset import is_memory_map
+from .utils import echo
+
+# sklearn takes seconds to import, see models.py.
+if TYPE_CHECKING:
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from .search import PipelineSearch
+
+
+def iter_batches(arr_X: np.ndarray, batch_size: int,
+                 min_batch_size: int = 0,
+                 rows: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+    """
+    Yield consecutive batches of rows of arr_X as in-memory arrays.
+
+    :param arr_X: array, or memory map of a feature store or dataset.
+    :param min_batch_size: the last batch is merged with the one before
+           it when it would be smaller than this.
+    :param rows: optional indices of the rows of arr_X to yield, in this
+           order. Default = all rows.
+    """
+    from sklearn.utils import gen_batches
+
+    # pages of a memory map that were read stay resident for as long as
+    # the map exists, so every batch is read from a map of its own.
+    reopen = is_memory_map(arr_X)
+    n_rows = len(arr_X) if rows is None else len(rows)
+    for batch in gen_batches(n_rows, batch_size,
+                             min_batch_size=min_batch_size):
+        index = batch if rows is None else rows[batch]
+        if reopen:
+            batch_map = np.memmap(arr_X.filename, dtype=arr_X.dtype,
+                                  mode="r", offset=arr_X.offset,
+                                  shape=arr_X.shape)
+            yield np.array(batch_map[index])
+        else:
+            yield np.asarray(arr_X[index])
+
+
+def write_feature_store(bam_files: List[Path], path: Path,
+                        chunksize: int = 100, contig: str = "chrM",
+                        cores: int = 1,
+                        cache: Optional[FeatureCache] = None,
+                        max_tasks_per_child: Optional[int] = None,
+                        batch_size: int = 1000,
+                        scaler: Optional["StandardScaler"] = None
+                        ) -> np.ndarray:
+    """
+    Write the features of bam files to a numpy file, one row per bam file
+    in the order of bam_files, as soon as they are extracted.
+
+    :param path: path of the numpy file.
+    :param batch_size: number of bam files of which the features are
+           passed to the scaler at once.
+    :param scaler: optional scaler that is partially fitted on every
+           batch of features, so that it is fitted when all files are
+           done.
+    :returns: read-only memory map of the numpy file.
+    """
+    from numpy.lib.format import open_memmap
+
+    if not bam_files:
+        raise ValueError("At least one bam file must be given.")
+    handle = None
+    batch = []  # type: List[np.ndarray]
+    try:
+        for index, arr in iter_features(bam_files, chunksize, contig, cores,
+                                        cache, max_tasks_per_child):
+            if handle is None:
+                # the memory map only writes the header. Rows are written
+                # to the file directly, as written pages of a memory map
+                # stay resident.
+                store = open_memmap(str(path), mode="w+", dtype=arr.dtype,
+                                    shape=(len(bam_files), arr.shape[0]))
+                offset = store.offset
+                del store
+                handle = path.open("r+b")
+            handle.seek(offset + index * arr.nbytes)
+            handle.write(arr.tobytes())
+            batch.append(arr)
+            if len(batch) == batch_size:
+                if scaler is not None:
+                    scaler.partial_fit(np.array(batch))
+                batch = []
+    finally:
+        if handle is not None:
+            handle.close()
+    if batch and scaler is not None:
+        scaler.partial_fit(np.array(batch))
+    return np.load(str(path), mmap_mode="r")
+
+
+def fit_transformers(arr_X: np.ndarray, n_components: int,
+                     batch_size: int = 1000,
+                     scaler: Optional["StandardScaler"] = None,
+                     rows: Optional[np.ndarray] = None) -> "Pipeline":
+    """
+    Fit the scaler and an incremental PCA on batches of arr_X.
+
+    :param arr_X: features, typically a memory map of a feature store or
+           dataset.
+    :param n_components: number of PCA components. Every batch has at
+           least this many samples.
+    :param scaler: optional scaler that is already fitted on the rows,
+           see write_feature_store. Otherwise a scaler is fitted first, in
+           an extra pass over the rows.
+    :param rows: optional indices of the rows to fit on, see
+           iter_batches. Default = all rows.
+    :returns: fitted pipeline of the scale and reduce_dim steps.
+    """
+    from sklearn.decomposition import IncrementalPCA
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    if batch_size < n_components:
+        raise ValueError("Batch size must be at least the number of PCA "
+                         "components.")
+    if scaler is None:
+        scaler = StandardScaler()
+        for batch in iter_batches(arr_X, batch_size, rows=rows):
+            scaler.partial_fit(batch)
+    pca = IncrementalPCA(n_components=n_components)
+    for batch in iter_batches(arr_X, batch_size, n_components, rows):
+        pca.partial_fit(scaler.transform(batch))
+    return Pipeline([("scale", scaler), ("reduce_dim", pca)])
+
+
+def transform_batches(transformers: "Pipeline", arr_X: np.ndarray,
+                      batch_size: int = 1000,
+                      rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """Transform the rows of arr_X in batches, see fit_transformers."""
+    return np.concatenate([
+        transformers.transform(batch)
+        for batch in iter_batches(arr_X, batch_size, rows=rows)])
+
+
+def incremental_search(arr_X: np.ndarray, arr_Y: np.ndarray,
+                       param_grid: Dict[str, List[Any]],
+                       final_estimator: Any, n_components: int = 50,
+                       batch_size: int = 1000,
+                       scaler: Optional["StandardScaler"] = None,
+                       **search_options: Any) -> "PipelineSearch":
+    """
+    Out-of-core counterpart of models.grid_search.
+
+    The scaler and an incremental PCA with n_components are fitted on
+    batches of arr_X. Only the parameters of the final step are searched.
+    Like the transformers of models.grid_search, they are fitted on the
+    training samples of every fold, so that the test samples of a fold
+    are not seen before they are scored, and once more on all samples for
+    the returned pipeline. Every fit takes two or three passes over its
+    samples, and a pass to transform them. The returned search contains
+    the scale, reduce_dim and svm pipeline, like a search made by
+    models.grid_search.
+
+    :param arr_X: features, typically a memory map of a feature store or
+           dataset.
+    :param param_grid: grid of the pipeline; only the parameters of the
+           svm step are used.
+    :param final_estimator: unfitted svm step.
+    :param n_components: number of PCA components. Limited to the number
+           of samples and features.
+    :param batch_size: number of samples in memory at a time.
+    :param scaler: optional scaler that is fitted on all samples, see
+           fit_transformers. It is only used for the returned pipeline.
+    :param search_options: arguments of PipelineSearch.
+    :returns: fitted PipelineSearch object.
+    """
+    from sklearn.base import clone
+    from sklearn.pipeline import Pipeline
+    from .search import PipelineSearch, RowTransformers, SharedFeatures
+
+    n_components = min(n_components, *arr_X.shape)
+    if batch_size < n_components:
+        raise ValueError("Batch size must be at least the number of PCA "
+                         "components.")
+    echo("Fitting scaler and incremental PCA with {0} components per fold "
+         "in batches of {1} samples".format(n_components, batch_size))
+
+    # the search splits indices of rows, and the scale step fits the
+    # transformers on the rows of every training fold.
+    row_transformers = RowTransformers(SharedFeatures(arr_X, scaler),
+                                       n_components, batch_size)
+    pipeline = Pipeline([("scale", row_transformers),
+                         ("reduce_dim", "passthrough"),
+                         ("svm", final_estimator)])
+    svm_grid = {key: values for key, values in param_grid.items()
+                if key.startswith("svm__")}
+    searcher = PipelineSearch(pipeline, svm_grid, **search_options)
+    searcher.fit(np.arange(len(arr_X)).reshape(-1, 1), arr_Y)
+
+    # the fitted transformers replace the row transformers, so that the
+    # best pipeline, which the calibrated classifier shares, takes
+    # features. The search keeps no reference to the features.
+    best = searcher.best_estimator_
+    best.steps[:2] = best.named_steps["scale"].transformers_.steps
+    searcher.pipeline = Pipeline([("scale", "passthrough"),
+                                  ("reduce_dim", "passthrough"),
+                                  ("svm", final_estimator)])
+    if searcher.calibrated_ is not None:
+        searcher.calibrated_.estimator = clone(searcher.pipeline)
+    return searcher
@@ -15,20 +15,32 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import enum
+import tempfile
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import (TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple,
+                    Sequence, Union)
 
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
-from sklearn.pipeline import Pipeline
-from sklearn.svm import SVC
-from sklearn.decomposition import PCA
-from sklearn.model_selection import GridSearchCV
-
-from .bam_process import make_array_set
+
+from .bam_process import (make_array_set, make_profile_set,
+                          profile_to_features, iter_features,
+                          iter_feature_batches)
+from .cache import FeatureCache
+from .checkpoint import make_checkpointed_array_set
+from .dataset import DATASET_DTYPES, TrainingDataset, update_dataset
+from .incremental import (incremental_search, transform_batches,
+                          write_feature_store)
 from .utils import echo
 
+# sklearn and matplotlib take seconds to import. They are imported in the
+# functions that use them, so that classification only imports the parts of
+# sklearn that the loaded model needs, and matplotlib is only imported for
+# plotting.
+if TYPE_CHECKING:
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from .search import PipelineSearch
+
 
 class PredClass(enum.Enum):
     positive = "pos"
@@ -37,11 +49,8 @@ class PredClass(enum.Enum):
 
 
 class Prediction(object):
-    # this class looks a bit java like due to trying to support typed
-    # attributes. From python 3.6 onwards, this can be done with a
-    # typing.NamedTuple or dataclass. However, we need to also support
-    # python 3.5, which does not yet have typed attributes. Hence the
-    # properties.
+    # the attributes are read-only properties, so that a prediction can
+    # not be changed after it is made.
     def __init__(self, prediction, most_likely_prob, pos_prob, neg_prob):
         self._prediction = prediction
         self._most_likely_prob = most_likely_prob
@@ -58,7 +67,7 @@ class Prediction(object):
 
     @property
     def pos_prob(self) -> float:
-        return self.pos_prob
+        return self._pos_prob
 
     @property
     def neg_prob(self) -> float:
@@ -78,11 +87,85 @@ class Prediction(object):
         return cls(pred_class, likely, pos_prob, neg_prob)
 
 
+class PredictionBatch(object):
+    """
+    Predictions of many samples, stored as one array per column.
+
+    Indexing and iterating give Prediction objects, but those are only
+    created on access; output.format_rows writes a batch without them.
+    Slicing gives a PredictionBatch.
+
+    :param prediction: predicted class values ("pos", "neg" or "unknown").
+    :param most_likely_prob: probabilities of the most likely classes.
+    :param pos_prob: probabilities of the positive class.
+    :param neg_prob: probabilities of the negative class.
+    """
+    __slots__ = ("prediction", "most_likely_prob", "pos_prob", "neg_prob")
+
+    def __init__(self, prediction: np.ndarray, most_likely_prob: np.ndarray,
+                 pos_prob: np.ndarray, neg_prob: np.ndarray):
+        self.prediction = prediction
+        self.most_likely_prob = most_likely_prob
+        self.pos_prob = pos_prob
+        self.neg_prob = neg_prob
+
+    def __len__(self) -> int:
+        return len(self.prediction)
+
+    def __getitem__(self, index: Union[int, slice]
+                    ) -> Union[Prediction, "PredictionBatch"]:
+        if isinstance(index, slice):
+            return PredictionBatch(self.prediction[index],
+                                   self.most_likely_prob[index],
+                                   self.pos_prob[index],
+                                   self.neg_prob[index])
+        return Prediction(PredClass(self.prediction[index]),
+                          self.most_likely_prob[index],
+                          self.pos_prob[index], self.neg_prob[index])
+
+    def __iter__(self) -> Iterator[Prediction]:
+        for index in range(len(self)):
+            yield self[index]
+
+    @classmethod
+    def from_model_proba(cls, model, proba: np.ndarray,
+                         unknown_threshold: float) -> 'PredictionBatch':
+        """
+        Predictions of the rows of predict_proba, as
+        Prediction.from_model_proba would make them one by one.
+        """
+        classes = np.asarray(model.classes_)
+        pos_index = np.flatnonzero(classes == "pos")[0]
+        neg_index = np.flatnonzero(classes == "neg")[0]
+        # like max and np.where, the first of equally likely classes wins
+        likely_index = proba.argmax(axis=1)
+        likely = proba[np.arange(len(proba)), likely_index]
+        prediction = np.where(likely < unknown_threshold,
+                              PredClass.unknown.value,
+                              classes[likely_index].astype(str))
+        return cls(prediction, likely, proba[:, pos_index],
+                   proba[:, neg_index])
+
+
 def train_svm_model(positive_bams: List[Path], negative_bams: List[Path],
-                    chunksize: int = 100, contig: str = "chrM",
+                    chunksize: Union[int, Sequence[int]] = 100,
+                    contig: str = "chrM",
                     cross_validations: int = 3, verbosity: int = 1,
                     cores: int = 1,
-                    plot_out: Optional[Path] = None) -> GridSearchCV:
+                    plot_out: Optional[Path] = None,
+                    cache: Optional[FeatureCache] = None,
+                    max_tasks_per_child: Optional[int] = None,
+                    precompute_kernel: bool = True,
+                    search: str = "exhaustive", n_candidates: int = 100,
+                    time_budget: Optional[float] = None,
+                    warm_start: Optional[Dict[str, Any]] = None,
+                    dataset: Optional[Path] = None,
+                    dataset_dtype: Optional[str] = None,
+                    backend: str = "svc", out_of_core: bool = False,
+                    n_components: int = 50, batch_size: int = 1000,
+                    checkpoint: Optional[Path] = None, resume: bool = False,
+                    features: Optional[np.ndarray] = None
+                    ) -> "PipelineSearch":
     """
     Run SVM training on a list of positive BAM files
     (i.e. _with_ contamination) and a list of negative BAM files
@@ -96,24 +179,86 @@ def train_svm_model(positive_bams: List[Path], negative_bams: List[Path],
 
     1. A scaling step using StandardScaler
     2. A dimensional reduction step using PCA.
-    3. A classification step using an SVM.
+    3. A classification step using an SVM; an exact RBF SVM, or a
+       linear SVM with or without an approximate kernel map for large
+       numbers of samples. See make_pipeline.
+
+    Hyperparameters are tuned using a grid search with cross validations,
+    in which the scaler and PCA are fitted only once per fold for all SVM
+    parameters (see search.PipelineSearch). Candidates are ranked on
+    accuracy; only the best pipeline is calibrated to give probabilities.
+    When multiple chunksizes are given, every bam file is read only once
+    into a base-resolution profile, and the grid search is repeated for
+    the features of every chunksize. The model with the best score wins.
 
-    Hyperparameters are tuned using a grid search with cross validations.
+    The chunksize and contig of the returned model are stored in its
+    ``chunksize_`` and ``contig_`` attributes.
 
     Optionally saves a plot of the top two PCA components with the training
     samples.
 
     :param positive_bams: List of BAM files with contaminations
     :param negative_bams: List of BAM files without contaminations.
-    :param chunksize: The size in bases for each chunk (bin)
+    :param chunksize: The size in bases for each chunk (bin), or a sequence
+           of candidate sizes.
     :param contig: The name of the contig.
     :param cross_validations: The amount of cross validations
-    :param verbosity: Verbosity parameter of sklearn. Increase to see more
+    :param verbosity: Verbosity of the grid search. Increase to see more
            messages.
     :param cores: Amount of cores to use for both metric collection and
            training.
     :param plot_out: Optional path for PCA plot.
-    :returns: GridSearchCV object containing tuned pipeline.
+    :param cache: Optional feature cache for metric collection.
+    :param max_tasks_per_child: Optional number of BAM files after which
+           a metric collection worker is replaced by a fresh process.
+    :param precompute_kernel: Fit the SVMs of the grid search on
+           precomputed kernels, from one distance matrix per fold and PCA
+           projection for all gammas. The final model uses a normal RBF
+           kernel.
+    :param search: Search strategy; exhaustive, random or halving. See
+           search.PipelineSearch.
+    :param n_candidates: Number of candidates of a random search.
+    :param time_budget: Optional time in seconds after which the search
+           stops, and the best candidate found so far is used. With
+           multiple chunksizes, every chunksize gets an equal share.
+    :param warm_start: Optional best parameters of a previous model. Only
+           a neighborhood of these parameters is searched, see
+           make_warm_start_grid.
+    :param dataset: Optional path of a dataset directory with the
+           features of all bam files. If it exists, features are only
+           calculated for bam files that are new or changed since, see
+           dataset.update_dataset. The dataset is updated first, and
+           training reads the features from a memory map of it. Can only
+           be used with a single chunksize.
+    :param dataset_dtype: Optional dtype of the features of the dataset;
+           float32 or float64. Default = float64 for a new dataset, and
+           the dtype of an existing one.
+    :param backend: SVM of the pipeline; svc, linear, nystroem or
+           fourier. See make_pipeline.
+    :param out_of_core: Write features to a temporary feature store on
+           disk instead of keeping them in memory, and fit the scaler and
+           an incremental PCA with n_components on batches of batch_size
+           samples. Only the parameters of the SVM are searched, see
+           incremental.incremental_search. Can only be used with a single
+           chunksize. With a dataset, the memory map of the dataset is
+           used instead of a feature store.
+    :param n_components: Number of PCA components of out-of-core
+           training.
+    :param batch_size: Number of samples in memory at a time during
+           out-of-core training.
+    :param checkpoint: Optional path of a checkpoint file, to which the
+           features of every bam file are appended as soon as they are
+           extracted, see checkpoint.make_checkpointed_array_set. Can only
+           be used with a single chunksize, without a dataset and without
+           out-of-core training.
+    :param resume: Skip bam files that are already in the checkpoint.
+    :param features: Optional features of positive_bams followed by
+           negative_bams, for example gathered from shard files (see
+           shards.gather_shards). Features are then not extracted, and
+           chunksize and contig must be the ones of the features. Can only
+           be used with a single chunksize, without a dataset, checkpoint
+           or out-of-core training.
+    :returns: PipelineSearch object containing tuned pipeline.
     """
     if len(positive_bams) < 1:
         raise ValueError("The list of positive BAM files may not be empty.")
@@ -124,60 +269,316 @@ def train_svm_model(positive_bams: List[Path], negative_bams: List[Path],
     if not set(positive_bams).isdisjoint(set(negative_bams)):
         raise ValueError("An overlap exists between the lists of positive "
                          "and negative bam files.")
+    chunksizes = [chunksize] if isinstance(chunksize, int) else chunksize
+    if len(chunksizes) < 1:
+        raise ValueError("At least one chunksize must be given.")
+    if dataset is not None and len(chunksizes) > 1:
+        raise ValueError("A dataset can only be used with a single "
+                         "chunksize.")
+    if time_budget is not None and time_budget <= 0:
+        raise ValueError("Time budget must be positive.")
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend {0}".format(backend))
+    if out_of_core and len(chunksizes) > 1:
+        raise ValueError("Out-of-core training can only be used with a "
+                         "single chunksize.")
+    if dataset_dtype is not None and dataset_dtype not in DATASET_DTYPES:
+        raise ValueError("Unknown dataset dtype {0}".format(dataset_dtype))
+    if resume and checkpoint is None:
+        raise ValueError("A checkpoint must be given to resume.")
+    if checkpoint is not None and (len(chunksizes) > 1 or out_of_core or
+                                   dataset is not None):
+        raise ValueError("A checkpoint can only be used with a single "
+                         "chunksize, without a dataset and without "
+                         "out-of-core training.")
+    if features is not None:
+        if (len(chunksizes) > 1 or out_of_core or dataset is not None or
+                checkpoint is not None):
+            raise ValueError("Features can only be given with a single "
+                             "chunksize, without a dataset, checkpoint or "
+                             "out-of-core training.")
+        if len(features) != len(positive_bams) + len(negative_bams):
+            raise ValueError("Features must be given for every BAM file.")
     labels = ["pos"]*len(positive_bams) + ["neg"]*len(negative_bams)
-    arr_X, arr_Y = make_array_set(positive_bams+negative_bams, labels,
-                                  chunksize, contig, cores)
-    estimators = [
+    search_options = dict(
+        precompute_kernel=precompute_kernel, search=search,
+        n_candidates=n_candidates, warm_start=warm_start, backend=backend,
+        out_of_core=out_of_core, n_components=n_components,
+        batch_size=batch_size,
+        time_budget=(None if time_budget is None else
+                     time_budget / len(chunksizes))
+    )
+
+    # directory of the feature store of out-of-core training
+    store_dir = None
+    if len(chunksizes) == 1:
+        scaler = None
+        if dataset is not None:
+            previous = None
+            if dataset.exists():
+                echo("Loading dataset {0}".format(dataset))
+                previous = TrainingDataset.load(dataset)
+            training_set = update_dataset(
+                previous, positive_bams+negative_bams, labels, chunksizes[0],
+                contig, cores, cache=cache,
+                max_tasks_per_child=max_tasks_per_child)
+            if training_set.path is None or (
+                    dataset_dtype is not None and
+                    training_set.arr_X.dtype != dataset_dtype):
+                training_set.save(dataset, dataset_dtype)
+                training_set = TrainingDataset.load(dataset)
+            arr_X, arr_Y = training_set.arr_X, training_set.arr_Y
+        elif out_of_core:
+            from sklearn.preprocessing import StandardScaler
+            store_dir = tempfile.TemporaryDirectory(prefix="rna_cd_")
+            scaler = StandardScaler()
+            arr_X = write_feature_store(
+                positive_bams+negative_bams,
+                Path(store_dir.name) / "features.npy", chunksizes[0],
+                contig, cores, cache=cache,
+                max_tasks_per_child=max_tasks_per_child,
+                batch_size=batch_size, scaler=scaler)
+            arr_Y = np.array(labels)
+        elif features is not None:
+            arr_X, arr_Y = features, np.array(labels)
+        elif checkpoint is not None:
+            arr_X, arr_Y = make_checkpointed_array_set(
+                positive_bams+negative_bams, labels, checkpoint, resume,
+                chunksizes[0], contig, cores, cache=cache,
+                max_tasks_per_child=max_tasks_per_child)
+        else:
+            arr_X, arr_Y = make_array_set(
+                positive_bams+negative_bams, labels, chunksizes[0], contig,
+                cores, cache=cache, max_tasks_per_child=max_tasks_per_child)
+        searcher = grid_search(arr_X, arr_Y, cross_validations, verbosity,
+                               cores, scaler=scaler, **search_options)
+        best_chunksize = chunksizes[0]
+    else:
+        profiles = make_profile_set(positive_bams+negative_bams, contig,
+                                    cores, cache=cache,
+                                    max_tasks_per_child=max_tasks_per_child)
+        arr_Y = np.array(labels)
+        searcher = None
+        for candidate in chunksizes:
+            echo("Deriving features for chunksize {0}".format(candidate))
+            candidate_X = np.array([profile_to_features(p, candidate)
+                                    for p in profiles])
+            candidate_searcher = grid_search(candidate_X, arr_Y,
+                                             cross_validations, verbosity,
+                                             cores, **search_options)
+            if (searcher is None or
+                    candidate_searcher.best_score_ > searcher.best_score_):
+                searcher = candidate_searcher
+                best_chunksize = candidate
+                arr_X = candidate_X
+        echo("Best chunksize: {0}".format(best_chunksize))
+
+    searcher.chunksize_ = best_chunksize
+    searcher.contig_ = contig
+
+    if plot_out is not None:
+        echo("Plotting training samples onto top 2 PCA components.")
+        plot_pca(searcher, arr_X, arr_Y, plot_out, batch_size)
+    if store_dir is not None:
+        store_dir.cleanup()
+
+    echo("Finished training.")
+    return searcher
+
+
+# classifiers of the pipeline; see make_pipeline.
+BACKENDS = ("svc", "linear", "nystroem", "fourier")
+
+# size of the approximate kernel maps of the nystroem and fourier backends.
+_KERNEL_MAP_COMPONENTS = 300
+
+
+def make_pipeline(backend: str = "svc") -> "Pipeline":
+    """
+    The unfitted scaling, PCA and SVM pipeline.
+
+    The SVM step depends on the backend:
+
+    * ``svc``: an exact SVM with an RBF kernel. Training time grows
+      quadratically to cubically with the number of samples.
+    * ``linear``: a linear SVM, fitted with stochastic gradient descent.
+    * ``nystroem``: a Nystroem approximation of the RBF kernel, followed
+      by a linear SVM.
+    * ``fourier``: random Fourier features approximating the RBF kernel,
+      followed by a linear SVM.
+
+    Training time of the last three grows linearly with the number of
+    samples.
+    """
+    from sklearn.decomposition import PCA
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    if backend == "svc":
+        from sklearn.svm import SVC
+        svm = SVC()
+    elif backend == "linear":
+        from sklearn.linear_model import SGDClassifier
+        svm = SGDClassifier(loss="hinge", random_state=0)
+    elif backend in BACKENDS:
+        from sklearn.svm import LinearSVC
+        if backend == "nystroem":
+            from sklearn.kernel_approximation import Nystroem
+            kernel_map = Nystroem(n_components=_KERNEL_MAP_COMPONENTS,
+                                  random_state=0)
+        else:
+            from sklearn.kernel_approximation import RBFSampler
+            kernel_map = RBFSampler(n_components=_KERNEL_MAP_COMPONENTS,
+                                    random_state=0)
+        # the primal problem, as there are many more samples than
+        # components of the kernel map.
+        svm = Pipeline([("kernel_map", kernel_map),
+                        ("linear", LinearSVC(dual=False))])
+    else:
+        raise ValueError("Unknown backend {0}".format(backend))
+
+    return Pipeline([
         ("scale", StandardScaler()),
         ("reduce_dim", PCA()),
-        ("svm", SVC())
-    ]
-    echo("Setting up processing pipeline for SVM model")
+        ("svm", svm)
+    ])
 
+
+def make_param_grid(arr_X: np.ndarray, cross_validations: int = 3,
+                    backend: str = "svc") -> Dict[str, List[Any]]:
+    """Hyperparameter grid of the pipeline for a feature set"""
     # components MUST fall between 0 ... min(n_samples, n_features)
     # cross-validation additionally reduces amount of samples
     n_samples = int(arr_X.shape[0] * (1 - (1/cross_validations)))
     max_components = min(n_samples, arr_X.shape[1])
     components_params = list(range(2, max_components))
-    param_grid = {
+    gammas = [0.1, 0.01, 0.001, 0.0001, 1, 10, 100, 1000]
+    grid = {
         "reduce_dim__n_components": components_params,
         "reduce_dim__whiten": [False, True],
-        "svm__gamma": [0.1, 0.01, 0.001, 0.0001,
-                       1, 10, 100, 1000],
-        "svm__shrinking": [True, False],
-        "svm__probability": [True]
-    }
-    pipeline = Pipeline(estimators)
-    searcher = GridSearchCV(pipeline, cv=cross_validations,
-                            param_grid=param_grid,
-                            scoring="accuracy", verbose=verbosity,
-                            pre_dispatch=1, n_jobs=cores)
-    echo("Starting grid search for SVC model with {0} "
-         "cross validations".format(cross_validations))
-    searcher.fit(arr_X, arr_Y)
+    }  # type: Dict[str, List[Any]]
+    if backend == "svc":
+        grid["svm__gamma"] = gammas
+        grid["svm__shrinking"] = [True, False]
+    elif backend == "linear":
+        grid["svm__alpha"] = [0.1, 0.01, 0.001, 0.0001, 0.00001]
+    elif backend in BACKENDS:
+        grid["svm__kernel_map__gamma"] = gammas
+        grid["svm__linear__C"] = [0.01, 0.1, 1, 10]
+    else:
+        raise ValueError("Unknown backend {0}".format(backend))
+    return grid
+
+
+def make_warm_start_grid(param_grid: Dict[str, List[Any]],
+                         best_params: Dict[str, Any],
+                         components_radius: int = 5
+                         ) -> Dict[str, List[Any]]:
+    """
+    Narrow a parameter grid to the neighborhood of the best parameters of a
+    previous model.
+
+    Numbers of PCA components are kept within ``components_radius`` of the
+    previous number, and gammas and regularization parameters (alpha and
+    C) within one step of the previous value in the sorted grid, which are
+    the adjacent decades. Whitening is kept
+    free, as it comes at no cost in the search, and the previous values of
+    the other parameters are used. Parameters that the previous model did
+    not have keep all their values.
+
+    :param param_grid: The full grid, see make_param_grid.
+    :param best_params: ``best_params_`` of the previous model.
+    :param components_radius: Maximum distance to the previous number of
+           PCA components.
+    :returns: The narrowed grid.
+    """
+    grid = dict(param_grid)
+    for key, values in param_grid.items():
+        if key not in best_params or key == "reduce_dim__whiten":
+            continue
+        best = best_params[key]
+        if key == "reduce_dim__n_components":
+            # the previous number may not be possible with fewer samples
+            grid[key] = ([n for n in values
+                          if abs(n - best) <= components_radius] or
+                         [min(values, key=lambda n: abs(n - best))])
+        elif key.rsplit("__", 1)[-1] in ("gamma", "alpha", "C"):
+            decades = sorted(values)
+            if best in decades:
+                index = decades.index(best)
+                grid[key] = decades[max(index - 1, 0):index + 2]
+            else:
+                grid[key] = [best / 10, best, best * 10]
+        else:
+            grid[key] = [best]
+    return grid
+
+
+def grid_search(arr_X: np.ndarray, arr_Y: np.ndarray,
+                cross_validations: int = 3, verbosity: int = 1,
+                cores: int = 1, precompute_kernel: bool = True,
+                search: str = "exhaustive", n_candidates: int = 100,
+                time_budget: Optional[float] = None,
+                warm_start: Optional[Dict[str, Any]] = None,
+                backend: str = "svc", out_of_core: bool = False,
+                n_components: int = 50, batch_size: int = 1000,
+                scaler: Optional["StandardScaler"] = None
+                ) -> "PipelineSearch":
+    """
+    Tune the scaling, PCA and SVM pipeline on a feature set with a search
+    over the parameter grid. See train_svm_model.
+
+    :param scaler: Optional scaler of out-of-core training that is already
+           fitted on arr_X, see incremental.incremental_search.
+
+    :returns: fitted PipelineSearch object.
+    """
+    from .search import PipelineSearch
+
+    echo("Setting up processing pipeline for SVM model")
+    param_grid = make_param_grid(arr_X, cross_validations, backend)
+    if warm_start is not None:
+        param_grid = make_warm_start_grid(param_grid, warm_start)
+        echo("Warm start from parameters: {0}".format(warm_start))
+    search_options = dict(cv=cross_validations, scoring="accuracy",
+                          verbose=verbosity, n_jobs=cores,
+                          precompute_kernel=precompute_kernel,
+                          calibrate=True, search=search,
+                          n_candidates=n_candidates, time_budget=time_budget)
+    echo("Starting {0} search for {1} model with {2} "
+         "cross validations".format(search, backend, cross_validations))
+    if out_of_core:
+        final_estimator = make_pipeline(backend).named_steps["svm"]
+        searcher = incremental_search(arr_X, arr_Y, param_grid,
+                                      final_estimator, n_components,
+                                      batch_size, scaler, **search_options)
+    else:
+        searcher = PipelineSearch(make_pipeline(backend), param_grid,
+                                  **search_options).fit(arr_X, arr_Y)
     echo("Finished gid search with best score: {0}.".format(
         searcher.best_score_)
     )
     echo("Best parameters: {0}".format(searcher.best_params_))
-
-    if plot_out is not None:
-        echo("Plotting training samples onto top 2 PCA components.")
-        plot_pca(searcher, arr_X, arr_Y, plot_out)
-
-    echo("Finished training.")
     return searcher
 
 
-def plot_pca(searcher: GridSearchCV, arr_X: np.ndarray, arr_Y: np.ndarray,
-             img_out: Path) -> None:
-    """Plot PCA with training samples of pipeline."""
+def plot_pca(searcher: "PipelineSearch", arr_X: np.ndarray,
+             arr_Y: np.ndarray, img_out: Path,
+             batch_size: int = 1000) -> None:
+    """
+    Plot PCA with training samples of pipeline.
 
-    pos_X = arr_X[arr_Y == "pos"]
-    neg_X = arr_X[arr_Y == "neg"]
+    :param batch_size: number of samples that are transformed at a time,
+           so that a memory map of features is not read into memory as a
+           whole.
+    """
+    import matplotlib.pyplot as plt
 
     best_pca = searcher.best_estimator_.named_steps['reduce_dim']
-    pos_X_transformed = best_pca.transform(pos_X)
-    neg_X_transformed = best_pca.transform(neg_X)
+    pos_X_transformed = transform_batches(
+        best_pca, arr_X, batch_size, np.flatnonzero(arr_Y == "pos"))
+    neg_X_transformed = transform_batches(
+        best_pca, arr_X, batch_size, np.flatnonzero(arr_Y == "neg"))
 
     fig = plt.figure(figsize=(6, 11))
     ax = fig.add_subplot(111)
@@ -194,22 +595,79 @@ def plot_pca(searcher: GridSearchCV, arr_X: np.ndarray, arr_Y: np.ndarray,
 def predict_labels_and_prob(model, bam_files: List[Path],
                             chunksize: int = 100, contig: str = "chrM",
                             cores: int = 1,
-                            unknown_threshold: float = 0.75) -> List[Prediction]:  # noqa
+                            unknown_threshold: float = 0.75,
+                            cache: Optional[FeatureCache] = None,
+                            max_tasks_per_child: Optional[int] = None
+                            ) -> PredictionBatch:
     """
     Predict labels and probabilities for a list of bam files.
 
     :param unknown_threshold: The probability threshold below which samples
            are considered to be 'unknown'. Must be between 0.5 and 1.0
+    :param cache: Optional feature cache for metric collection.
+    :param max_tasks_per_child: Optional number of BAM files after which
+           a metric collection worker is replaced by a fresh process.
 
-    :returns: list of Prediction classes
+    :returns: PredictionBatch with the predictions in the order of
+              bam_files.
+    """
+    if not 0.5 < unknown_threshold < 1.0:
+        raise ValueError("unknown_threshold must be between 0.5 and 1.0")
+
+    bam_arr, _ = make_array_set(bam_files, [], chunksize, contig, cores,
+                                cache=cache,
+                                max_tasks_per_child=max_tasks_per_child)
+    return PredictionBatch.from_model_proba(
+        model, model.predict_proba(bam_arr), unknown_threshold)
+
+
+def iter_predictions(model, bam_files: List[Path],
+                     chunksize: int = 100, contig: str = "chrM",
+                     cores: int = 1,
+                     unknown_threshold: float = 0.75,
+                     cache: Optional[FeatureCache] = None,
+                     max_tasks_per_child: Optional[int] = None
+                     ) -> Iterator[Tuple[int, Prediction]]:
+    """
+    Predict labels and probabilities for a list of bam files, yielding
+    each prediction as soon as the features of its bam file are ready.
+    See predict_labels_and_prob for the parameters.
+
+    :returns: iterator of (index in bam_files, Prediction) tuples, in
+              order of completion.
+    """
+    if not 0.5 < unknown_threshold < 1.0:
+        raise ValueError("unknown_threshold must be between 0.5 and 1.0")
+
+    for index, arr in iter_features(bam_files, chunksize, contig, cores,
+                                    cache, max_tasks_per_child):
+        prob = model.predict_proba(arr.reshape(1, -1))[0]
+        yield index, Prediction.from_model_proba(model, prob,
+                                                 unknown_threshold)
+
+
+def iter_prediction_batches(model, bam_files: List[Path], batch_size: int,
+                            chunksize: int = 100, contig: str = "chrM",
+                            cores: int = 1,
+                            unknown_threshold: float = 0.75,
+                            cache: Optional[FeatureCache] = None,
+                            max_tasks_per_child: Optional[int] = None
+                            ) -> Iterator[Tuple[int, PredictionBatch]]:
+    """
+    Predict labels and probabilities for a list of bam files in batches of
+    batch_size files, so that only the features of a few batches are in
+    memory at a time. The features of the next batch are extracted while
+    the caller handles the predictions of the current one. See
+    predict_labels_and_prob for the other parameters.
+
+    :returns: iterator of (index in bam_files of the first file of the
+              batch, PredictionBatch) tuples, in the order of bam_files.
     """
     if not 0.5 < unknown_threshold < 1.0:
         raise ValueError("unknown_threshold must be between 0.5 and 1.0")
 
-    bam_arr, _ = make_array_set(bam_files, [], chunksize, contig, cores)
-    prob = model.predict_proba(bam_arr)
-    predictions = []
-    for sample in prob:
-        predictions.append(Prediction.from_model_proba(model, sample,
-                                                       unknown_threshold))
-    return predictions
+    for start, arr in iter_feature_batches(bam_files, batch_size, chunksize,
+                                           contig, cores, cache,
+                                           max_tasks_per_child):
+        yield start, PredictionBatch.from_model_proba(
+            model, model.predict_proba(arr), unknown_threshold)
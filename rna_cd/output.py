@@ -0,0 +1,118 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+output.py
+~~~~~~~~~
+
+Write classifications to tab-delimited output files.
+"""
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Set, TextIO
+
+if TYPE_CHECKING:
+    # models imports numpy, which the light-weight commands do not need.
+    from .models import Prediction, PredictionBatch
+
+HEADER = ('filename\tpredicted_class\tpredicted_class_probability\t'
+          'positive class probability\tnegative class probability\n')
+
+
+def format_row(name: str, pred: "Prediction") -> str:
+    """Format a prediction as a line of the output file"""
+    fmt = "{fname}\t{pred_cl}\t{pred_prob}\t{pos_prob}\t{neg_prob}\n"
+    return fmt.format(fname=name,
+                      pred_cl=pred.prediction.value,
+                      pred_prob=pred.most_likely_prob,
+                      pos_prob=pred.pos_prob,
+                      neg_prob=pred.neg_prob)
+
+
+def format_rows(names: List[str], batch: "PredictionBatch") -> str:
+    """Format a batch of predictions as lines of the output file"""
+    # converting every column at once is much faster than going through
+    # the numpy scalars of every row; floats are formatted the same.
+    columns = [names, batch.prediction.tolist()] + [
+        list(map(str, column.tolist())) for column in
+        (batch.most_likely_prob, batch.pos_prob, batch.neg_prob)]
+    return "".join(["\t".join(row) + "\n" for row in zip(*columns)])
+
+
+def classified_names(path: Path) -> Set[str]:
+    """Names of the files that are already present in an output file."""
+    if not path.exists():
+        return set()
+    with path.open("r") as handle:
+        lines = handle.readlines()
+    # a row without trailing newline was cut off by a crash, and is ignored.
+    return {line.split("\t", 1)[0] for line in lines[1:]
+            if line.endswith("\n")}
+
+
+def open_for_append(path: Path) -> TextIO:
+    """
+    Open an output file for appending rows. A header is written to new
+    or empty files, and an incomplete last row is removed.
+    """
+    if path.exists():
+        with path.open("r") as handle:
+            content = handle.read()
+        if content and not content.endswith("\n"):
+            with path.open("w") as handle:
+                handle.write(content[:content.rfind("\n") + 1])
+    handle = path.open("a")
+    if handle.tell() == 0:
+        handle.write(HEADER)
+        handle.flush()
+    return handle
+
+
+def write_row(handle: TextIO, name: str, pred: "Prediction") -> None:
+    """Write a row and flush it to disk straight away"""
+    handle.write(format_row(name, pred))
+    handle.flush()
+
+
+def write_rows(handle: TextIO, names: List[str],
+               batch: "PredictionBatch") -> None:
+    """Write a batch of rows and flush them to disk straight away"""
+    handle.write(format_rows(names, batch))
+    handle.flush()
+
+
+def reorder_output(path: Path, names: List[str]) -> None:
+    """
+    Reorder the rows of an output file to the order of names. Rows with
+    names that are not in names are placed at the end.
+    """
+    with path.open("r") as handle:
+        lines = handle.readlines()
+    rows = {}
+    for line in lines[1:]:
+        rows.setdefault(line.split("\t", 1)[0], []).append(line)
+    ordered = []
+    for name in names:
+        # files with the same name keep their relative order
+        if rows.get(name):
+            ordered.append(rows[name].pop(0))
+    for remaining in rows.values():
+        ordered += remaining
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w") as handle:
+        handle.write(HEADER)
+        handle.writelines(ordered)
+    os.replace(str(tmp_path), str(path))
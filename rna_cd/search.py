@@ -0,0 +1,596 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+search.py
+~~~~~~~~~
+
+Hyperparameter search for pipelines, which reuses the output of the
+transforming steps for all parameters of the final step.
+
+GridSearchCV fits the whole pipeline for every candidate. For the
+scale, PCA and SVM pipeline, most candidates only differ in SVM
+parameters, so the scaler and PCA are fitted many times on the same data
+with the same parameters. Moreover, the first k components of a PCA are
+the same for every number of components k, so a single decomposition per
+fold is enough for all values of ``n_components`` and ``whiten``.
+
+Likewise, the RBF kernel ``exp(-gamma * D)`` of an SVM only depends on
+gamma through a factor of the squared distance matrix D, so D is computed
+once per transformed fold and reused for every gamma.
+"""
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.stats import rankdata
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.decomposition import PCA
+from sklearn.metrics import get_scorer
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.model_selection import ParameterGrid, ParameterSampler, check_cv
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+from sklearn.utils import check_random_state, resample
+
+from .incremental import fit_transformers, transform_batches
+from .utils import echo
+
+SEARCH_STRATEGIES = ("exhaustive", "random", "halving")
+
+# PCA parameters that are derived from a single decomposition.
+_SLICED_PCA_PARAMS = ("n_components", "whiten")
+
+
+def _split_params(params: Dict[str, Any], final_step: str
+                  ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Split pipeline parameters in transformer and final step parameters"""
+    prefix = final_step + "__"
+    transformer = {k: v for k, v in params.items()
+                   if not k.startswith(prefix)}
+    final = {k[len(prefix):]: v for k, v in params.items()
+             if k.startswith(prefix)}
+    return transformer, final
+
+
+def _rbf_gamma(estimator: Any, params: Dict[str, Any]) -> Optional[float]:
+    """
+    The gamma of an SVC with an RBF kernel and a numeric gamma, or None
+    if the estimator with params is not such an SVC.
+    """
+    if not isinstance(estimator, SVC):
+        return None
+    merged = dict(estimator.get_params(deep=False), **params)
+    if merged["kernel"] != "rbf" or isinstance(merged["gamma"], str):
+        return None
+    return float(merged["gamma"])
+
+
+def _score_final(final_estimator: Any, final_params: List[Dict[str, Any]],
+                 scoring: str, X_train: np.ndarray, Y_train: np.ndarray,
+                 X_test: np.ndarray, Y_test: np.ndarray,
+                 precompute_kernel: bool = False) -> List[float]:
+    """
+    Score the final estimator with each of final_params on a fold.
+
+    With precompute_kernel, SVCs with an RBF kernel are fitted on a
+    precomputed kernel, from squared distances that are computed once for
+    all gammas.
+    """
+    scorer = get_scorer(scoring)
+    distances = None  # type: Optional[Tuple[np.ndarray, np.ndarray]]
+    # the kernels of the last gamma; candidates are in grid order, so
+    # candidates with the same gamma follow each other.
+    kernels = None  # type: Optional[Tuple[float, np.ndarray, np.ndarray]]
+    scores = []
+    for params in final_params:
+        estimator = clone(final_estimator).set_params(**params)
+        gamma = _rbf_gamma(final_estimator, params)
+        if not precompute_kernel or gamma is None:
+            estimator.fit(X_train, Y_train)
+            scores.append(scorer(estimator, X_test, Y_test))
+            continue
+        if distances is None:
+            distances = (euclidean_distances(X_train, squared=True),
+                         euclidean_distances(X_test, X_train, squared=True))
+        if kernels is None or kernels[0] != gamma:
+            # the same calculation as sklearn.metrics.pairwise.rbf_kernel
+            kernels = (gamma, np.exp(-gamma * distances[0]),
+                       np.exp(-gamma * distances[1]))
+        _, K_train, K_test = kernels
+        estimator.set_params(kernel="precomputed")
+        estimator.fit(K_train, Y_train)
+        scores.append(scorer(estimator, K_test, Y_test))
+    return scores
+
+
+def _score_group(transformers: Pipeline, final_estimator: Any,
+                 final_params: List[Dict[str, Any]], scoring: str,
+                 arr_X: np.ndarray, arr_Y: np.ndarray,
+                 train: np.ndarray, test: np.ndarray,
+                 precompute_kernel: bool = False) -> List[float]:
+    """
+    Fit the transformers once on a training fold, and score the final
+    estimator with each of final_params on the transformed test fold.
+    """
+    X_train = transformers.fit_transform(arr_X[train], arr_Y[train])
+    X_test = transformers.transform(arr_X[test])
+    return _score_final(final_estimator, final_params, scoring,
+                        X_train, arr_Y[train], X_test, arr_Y[test],
+                        precompute_kernel)
+
+
+def decompose_fold(transformers: Pipeline, n_components: int,
+                   arr_X: np.ndarray, arr_Y: np.ndarray,
+                   train: np.ndarray, test: np.ndarray
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fit transformers that end with a PCA on a training fold, with a full
+    SVD of n_components components.
+
+    :returns: projections of the training and test fold on the
+              components, and the explained variance of the components.
+    """
+    transformers = clone(transformers)
+    transformers.steps[-1][1].set_params(n_components=n_components,
+                                         whiten=False, svd_solver="full")
+    X_train = transformers.fit_transform(arr_X[train], arr_Y[train])
+    X_test = transformers.transform(arr_X[test])
+    return X_train, X_test, transformers.steps[-1][1].explained_variance_
+
+
+def slice_components(arr_X: np.ndarray, explained_variance: np.ndarray,
+                     n_components: int, whiten: bool) -> np.ndarray:
+    """
+    Projection on the first n_components components, as a PCA with
+    n_components and whiten would return it.
+    """
+    sliced = arr_X[:, :n_components]
+    if whiten:
+        sliced = sliced / np.sqrt(explained_variance[:n_components])
+    return sliced
+
+
+class SharedFeatures(object):
+    """
+    Features that are shared by all clones of a RowTransformers, instead
+    of being copied by sklearn.base.clone.
+
+    :param arr_X: the features of all samples.
+    :param scaler: optional scaler that is fitted on all samples.
+    """
+    def __init__(self, arr_X: np.ndarray, scaler: Any = None):
+        self.arr_X = arr_X
+        self.scaler = scaler
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "SharedFeatures":
+        return self
+
+
+class RowTransformers(BaseEstimator, TransformerMixin):
+    """
+    Scaler and incremental PCA of the out-of-core search, see
+    incremental.incremental_search.
+
+    The samples of fit and transform are indices of rows of the shared
+    features, of shape (n_samples, 1), so that a search can split them in
+    folds without copying features. The transformers of a fold are fitted
+    in batches on the rows of its training samples only. When fitted on
+    all rows, the scaler of the shared features is used if it has one.
+
+    :param features: the shared features.
+    :param n_components: number of PCA components. Limited to the number
+           of rows and features.
+    :param batch_size: number of rows in memory at a time.
+    """
+    def __init__(self, features: Optional[SharedFeatures] = None,
+                 n_components: int = 50, batch_size: int = 1000):
+        self.features = features
+        self.n_components = n_components
+        self.batch_size = batch_size
+
+    def fit(self, X: np.ndarray, y: Any = None) -> "RowTransformers":
+        arr_X = self.features.arr_X
+        rows = np.asarray(X, dtype=int).ravel()
+        n_components = min(self.n_components, len(rows), arr_X.shape[1])
+        scaler = None
+        if len(np.unique(rows)) == len(arr_X):
+            scaler = self.features.scaler
+        self.transformers_ = fit_transformers(
+            arr_X, n_components, max(self.batch_size, n_components),
+            scaler, rows)
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        rows = np.asarray(X, dtype=int).ravel()
+        return transform_batches(self.transformers_, self.features.arr_X,
+                                 self.batch_size, rows)
+
+
+class PipelineSearch(object):
+    """
+    Hyperparameter search over a parameter grid of a pipeline, with cross
+    validation. The transforming steps are fitted once per fold for every
+    combination of their parameters; all candidates that differ only in
+    parameters of the final step share the transformed folds.
+
+    When the last transforming step is a PCA and all values of its
+    n_components are integers, the PCA is fitted once per fold with the
+    largest number of components. Smaller numbers of components, with or
+    without whitening, are sliced from that decomposition. Projections
+    may differ from a separately fitted PCA in floating point rounding and
+    in the sign of components, neither of which affects an RBF SVM.
+
+    Three search strategies are available:
+
+    * ``exhaustive``: every candidate of the grid, as GridSearchCV.
+    * ``random``: a random sample of n_candidates candidates of the grid,
+      as RandomizedSearchCV.
+    * ``halving``: successive halving. All candidates are scored on a
+      small stratified subset of the samples, and the best 1/factor of
+      them continue to the next round with factor times more samples,
+      until the last round uses all samples. In rounds with fewer samples
+      than PCA components, the candidate is scored with as many
+      components as possible.
+
+    With a time budget, no new fits are started once the budget is spent,
+    and the best candidate of which all folds were scored wins. At least
+    one candidate is always scored.
+
+    Otherwise, candidates, folds and scores are the same as those of
+    GridSearchCV, as are the fitted attributes best_params_, best_score_,
+    best_index_, best_estimator_, cv_results_ (parameters and test scores
+    only) and n_splits_. Candidates that were not scored have a mean test
+    score of NaN and rank last.
+
+    :param pipeline: unfitted pipeline.
+    :param param_grid: grid of pipeline parameters, as for GridSearchCV.
+    :param cv: number of folds, or a cross validation splitter.
+    :param scoring: name of a sklearn scorer.
+    :param verbose: print progress messages if larger than 0.
+    :param n_jobs: number of parallel jobs.
+    :param precompute_kernel: when the final step is an SVC with an RBF
+           kernel, fit it on precomputed kernels that share one distance
+           matrix per transformed fold for all gammas. Scores may differ
+           from those of the RBF SVC by floating point rounding.
+    :param calibrate: calibrate the probabilities of the best pipeline
+           with Platt (sigmoid) scaling on the decision function, using
+           the same cross validation as the search. predict_proba then
+           returns calibrated probabilities, and candidates of the search
+           do not need to compute probabilities themselves.
+    :param search: search strategy; exhaustive, random or halving.
+    :param n_candidates: number of candidates of a random search.
+    :param factor: reduction of the candidates, and growth of the
+           samples, per round of a halving search.
+    :param time_budget: optional time in seconds after which no new
+           fits are started.
+    :param random_state: seed or random state for random and halving
+           searches.
+    """
+    def __init__(self, pipeline: Pipeline,
+                 param_grid: Dict[str, Sequence[Any]], cv: Any = 3,
+                 scoring: str = "accuracy", verbose: int = 0,
+                 n_jobs: int = 1, precompute_kernel: bool = False,
+                 calibrate: bool = False, search: str = "exhaustive",
+                 n_candidates: int = 100, factor: int = 3,
+                 time_budget: Optional[float] = None,
+                 random_state: Any = None):
+        if search not in SEARCH_STRATEGIES:
+            raise ValueError("Unknown search strategy {0}".format(search))
+        if n_candidates < 1:
+            raise ValueError("Number of candidates must be at least 1.")
+        if factor < 2:
+            raise ValueError("Halving factor must be at least 2.")
+        if time_budget is not None and time_budget <= 0:
+            raise ValueError("Time budget must be positive.")
+        self.pipeline = pipeline
+        self.param_grid = param_grid
+        self.cv = cv
+        self.scoring = scoring
+        self.verbose = verbose
+        self.n_jobs = n_jobs
+        self.precompute_kernel = precompute_kernel
+        self.calibrate = calibrate
+        self.search = search
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.time_budget = time_budget
+        self.random_state = random_state
+
+    def _sliced_step(self, candidates: List[Dict[str, Any]]
+                     ) -> Optional[str]:
+        """Name of the PCA step to slice, if it can be sliced"""
+        if len(self.pipeline.steps) < 2:
+            return None
+        name, step = self.pipeline.steps[-2]
+        if not isinstance(step, PCA):
+            return None
+        key = name + "__n_components"
+        n_components = [params.get(key, step.n_components)
+                        for params in candidates]
+        if not all(isinstance(n, (int, np.integer)) and
+                   not isinstance(n, bool) for n in n_components):
+            return None
+        return name
+
+    def _candidates(self) -> List[Dict[str, Any]]:
+        grid = ParameterGrid(self.param_grid)
+        if self.search != "random":
+            return list(grid)
+        return list(ParameterSampler(self.param_grid,
+                                     min(self.n_candidates, len(grid)),
+                                     random_state=self.random_state))
+
+    def fit(self, arr_X: np.ndarray, arr_Y: np.ndarray) -> 'PipelineSearch':
+        self._deadline = (None if self.time_budget is None else
+                          time.monotonic() + self.time_budget)
+        self.stopped_early_ = False
+        candidates = self._candidates()
+        cv = check_cv(self.cv, arr_Y, classifier=True)
+        if self.search == "halving":
+            candidates, scores = self._halving(candidates, arr_X, arr_Y, cv)
+        else:
+            folds = list(cv.split(arr_X, arr_Y))
+            scores = self._evaluate(candidates, arr_X, arr_Y, folds)
+        if self.stopped_early_:
+            echo("Time budget spent; {0} of {1} candidates were scored in "
+                 "the last round.".format(
+                     int(np.sum(~np.isnan(scores).any(axis=1))),
+                     len(candidates)))
+        self._set_results(candidates, scores)
+
+        best = clone(self.pipeline).set_params(**self.best_params_)
+        if self.calibrate:
+            if self.verbose > 0:
+                echo("Calibrating probabilities of the best pipeline")
+            # with ensemble=False, a single pipeline is fitted on all data,
+            # and one sigmoid on the decision function of the folds.
+            self.calibrated_ = CalibratedClassifierCV(
+                best, method="sigmoid", cv=cv, n_jobs=self.n_jobs,
+                ensemble=False).fit(arr_X, arr_Y)
+            best = self.calibrated_.calibrated_classifiers_[0].estimator
+        else:
+            self.calibrated_ = None
+            best.fit(arr_X, arr_Y)
+        self.best_estimator_ = best
+        return self
+
+    def _halving(self, candidates: List[Dict[str, Any]],
+                 arr_X: np.ndarray, arr_Y: np.ndarray, cv: Any
+                 ) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """
+        Successive halving rounds. Returns the candidates and scores of
+        the last round.
+        """
+        n_samples = len(arr_Y)
+        # every fold of the smallest round needs a few samples per class
+        min_samples = 2 * cv.get_n_splits() * len(np.unique(arr_Y))
+        n_rounds = 1
+        while (n_samples // self.factor ** n_rounds >= min_samples and
+               self.factor ** n_rounds < len(candidates)):
+            n_rounds += 1
+        rng = check_random_state(self.random_state)
+        sliced_step = self._sliced_step(candidates)
+        self.n_resources_ = []  # type: List[int]
+        self.n_candidates_ = []  # type: List[int]
+        for round_index in range(n_rounds):
+            n_round = n_samples // self.factor ** (n_rounds - round_index - 1)
+            if n_round < n_samples:
+                subset = resample(np.arange(n_samples), replace=False,
+                                  n_samples=n_round, stratify=arr_Y,
+                                  random_state=rng)
+            else:
+                subset = np.arange(n_samples)
+            X_round, Y_round = arr_X[subset], arr_Y[subset]
+            folds = list(cv.split(X_round, Y_round))
+            self.n_resources_.append(n_round)
+            self.n_candidates_.append(len(candidates))
+
+            # the number of PCA components is limited by the samples of a
+            # round; larger numbers are scored with the largest possible.
+            round_params = candidates
+            if sliced_step is not None:
+                n_key = sliced_step + "__n_components"
+                default = self.pipeline.named_steps[sliced_step].n_components
+                max_components = min(min(len(train) for train, _ in folds),
+                                     arr_X.shape[1])
+                round_params = [
+                    dict(params, **{n_key: min(params.get(n_key, default),
+                                               max_components)})
+                    for params in candidates
+                ]
+            # candidates that became equal are scored once.
+            unique = {}  # type: Dict[Tuple, int]
+            for params in round_params:
+                unique.setdefault(tuple(sorted(params.items())), len(unique))
+            if self.verbose > 0:
+                echo("Halving round {0} of {1}: {2} candidates on {3} "
+                     "samples".format(round_index + 1, n_rounds,
+                                      len(candidates), n_round))
+            unique_scores = self._evaluate(
+                [dict(key) for key in unique], X_round, Y_round, folds)
+            scores = unique_scores[[unique[tuple(sorted(params.items()))]
+                                    for params in round_params]]
+            if round_index == n_rounds - 1 or self.stopped_early_:
+                return candidates, scores
+
+            n_keep = -(-len(candidates) // self.factor)
+            # stable sort, so the first of equally scoring candidates wins
+            best = sorted(range(len(candidates)),
+                          key=lambda i: -scores[i].mean())[:n_keep]
+            candidates = [candidates[i] for i in sorted(best)]
+        return candidates, scores
+
+    def _evaluate(self, candidates: List[Dict[str, Any]],
+                  arr_X: np.ndarray, arr_Y: np.ndarray,
+                  folds: List[Tuple[np.ndarray, np.ndarray]]
+                  ) -> np.ndarray:
+        """
+        Score candidates on folds. Returns an array of candidates by
+        folds, with NaN for folds that were not scored within the time
+        budget.
+        """
+        final_step = self.pipeline.steps[-1][0]
+        sliced_step = self._sliced_step(candidates)
+        sliced_keys = ([] if sliced_step is None else
+                       [sliced_step + "__" + p for p in _SLICED_PCA_PARAMS])
+
+        # candidates with the same transformer parameters, in order.
+        groups = {}  # type: Dict[Tuple, List[Tuple[int, Dict[str, Any]]]]
+        for index, params in enumerate(candidates):
+            transformer, final = _split_params(params, final_step)
+            key = tuple(sorted((k, v) for k, v in transformer.items()
+                               if k not in sliced_keys))
+            groups.setdefault(key, []).append((index, final))
+
+        if self.verbose > 0:
+            echo("Fitting {0} folds for each of {1} candidates, totalling "
+                 "{2} fits, with {3} transformer fits per fold".format(
+                     len(folds), len(candidates),
+                     len(folds) * len(candidates), len(groups)))
+
+        if sliced_step is None:
+            tasks = self._group_tasks(groups, folds, arr_X, arr_Y)
+        else:
+            tasks = self._sliced_tasks(groups, folds, sliced_step,
+                                       candidates, arr_X, arr_Y)
+        # candidate indices and fold of every task, in order of the tasks.
+        # Filled while the tasks are dispatched, so that the transformed
+        # folds only exist while they are waiting for a worker.
+        task_members = []  # type: List[Tuple[List[int], int]]
+        results = Parallel(n_jobs=self.n_jobs)(
+            self._dispatch(tasks, task_members, len(folds)))
+
+        scores = np.full((len(candidates), len(folds)), np.nan)
+        for (indices, fold_index), fold_scores in zip(task_members, results):
+            scores[indices, fold_index] = fold_scores
+        return scores
+
+    def _dispatch(self, tasks: Iterator[Tuple[List[int], int, Any]],
+                  task_members: List[Tuple[List[int], int]],
+                  n_folds: int) -> Iterator:
+        """
+        Yield tasks until the time budget is spent. The first n_folds
+        tasks always complete a candidate, and are always yielded.
+        """
+        for n, (indices, fold_index, task) in enumerate(tasks):
+            if (n >= n_folds and self._deadline is not None and
+                    time.monotonic() > self._deadline):
+                self.stopped_early_ = True
+                return
+            task_members.append((indices, fold_index))
+            yield task
+
+    def _group_tasks(self, groups: Dict[Tuple, List[Tuple[int, Any]]],
+                     folds: List[Tuple[np.ndarray, np.ndarray]],
+                     arr_X: np.ndarray, arr_Y: np.ndarray
+                     ) -> Iterator[Tuple[List[int], int, Any]]:
+        """Tasks that fit the transformers of a group on a fold"""
+        transformers = Pipeline(self.pipeline.steps[:-1])
+        final_estimator = self.pipeline.steps[-1][1]
+        for key, members in groups.items():
+            group_transformers = clone(transformers).set_params(**dict(key))
+            for fold_index, (train, test) in enumerate(folds):
+                yield [i for i, _ in members], fold_index, delayed(
+                    _score_group)(
+                    group_transformers, final_estimator,
+                    [final for _, final in members], self.scoring,
+                    arr_X, arr_Y, train, test, self.precompute_kernel)
+
+    def _sliced_tasks(self, groups: Dict[Tuple, List[Tuple[int, Any]]],
+                      folds: List[Tuple[np.ndarray, np.ndarray]],
+                      sliced_step: str, candidates: List[Dict[str, Any]],
+                      arr_X: np.ndarray, arr_Y: np.ndarray
+                      ) -> Iterator[Tuple[List[int], int, Any]]:
+        """
+        Tasks that score the final estimator on the folds of a group,
+        sliced from one decomposition per fold for every number of
+        components and whitening. All folds of a slice follow each
+        other, so that candidates are completed one after the other.
+        """
+        transformers = Pipeline(self.pipeline.steps[:-1])
+        final_estimator = self.pipeline.steps[-1][1]
+        pca = self.pipeline.named_steps[sliced_step]
+        n_key, whiten_key = [sliced_step + "__" + p
+                             for p in _SLICED_PCA_PARAMS]
+        for key, members in groups.items():
+            group_transformers = clone(transformers).set_params(**dict(key))
+            # members with the same number of components and whitening.
+            slices = {}  # type: Dict[Tuple[int, bool], List[Tuple]]
+            for index, final in members:
+                params = candidates[index]
+                slice_key = (int(params.get(n_key, pca.n_components)),
+                             bool(params.get(whiten_key, pca.whiten)))
+                slices.setdefault(slice_key, []).append((index, final))
+            max_components = max(n for n, _ in slices)
+            decompositions = [
+                decompose_fold(group_transformers, max_components, arr_X,
+                               arr_Y, train, test)
+                for train, test in folds
+            ]
+            for (n_components, whiten), sliced in slices.items():
+                for fold_index, (train, test) in enumerate(folds):
+                    X_train, X_test, variance = decompositions[fold_index]
+                    yield [i for i, _ in sliced], fold_index, delayed(
+                        _score_final)(
+                        final_estimator, [final for _, final in sliced],
+                        self.scoring,
+                        slice_components(X_train, variance, n_components,
+                                         whiten),
+                        arr_Y[train],
+                        slice_components(X_test, variance, n_components,
+                                         whiten),
+                        arr_Y[test], self.precompute_kernel)
+
+    def _set_results(self, candidates: List[Dict[str, Any]],
+                     scores: np.ndarray) -> None:
+        mean_scores = scores.mean(axis=1)
+        # like GridSearchCV, candidates without scores rank last.
+        ranks = rankdata(np.where(np.isnan(mean_scores), np.inf,
+                                  -mean_scores),
+                         method="min").astype(np.int32)
+        self.cv_results_ = {
+            "params": candidates,
+            "mean_test_score": mean_scores,
+            "std_test_score": scores.std(axis=1),
+            "rank_test_score": ranks
+        }
+        for fold_index in range(scores.shape[1]):
+            key = "split{0}_test_score".format(fold_index)
+            self.cv_results_[key] = scores[:, fold_index]
+        self.n_splits_ = scores.shape[1]
+        # like GridSearchCV, the first of equally scoring candidates wins.
+        self.best_index_ = int(ranks.argmin())
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = float(mean_scores[self.best_index_])
+
+    @property
+    def classes_(self) -> np.ndarray:
+        return self.best_estimator_.classes_
+
+    def predict(self, arr_X: np.ndarray) -> np.ndarray:
+        return self.best_estimator_.predict(arr_X)
+
+    def predict_proba(self, arr_X: np.ndarray) -> np.ndarray:
+        """
+        Probabilities of the classes in classes_, calibrated if the search
+        was made with calibrate=True.
+        """
+        if getattr(self, "calibrated_", None) is not None:
+            return self.calibrated_.predict_proba(arr_X)
+        return self.best_estimator_.predict_proba(arr_X)
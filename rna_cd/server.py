@@ -0,0 +1,247 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+server.py
+~~~~~~~~~
+
+Long-running classification server, which keeps models and a pool of
+feature extraction workers loaded between requests.
+
+The server speaks HTTP, over localhost TCP or over a Unix socket:
+
+* ``GET /health`` returns a JSON object with the state of the server.
+* ``POST /classify`` takes a JSON object with the keys ``path`` (absolute
+  path to a BAM file), and optionally ``model`` (name of the model; may be
+  omitted when only one model is loaded) and ``unknown_threshold``.
+  It returns the row that rna_cd-classify would write for the BAM file.
+"""
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .bam_process import process_bam
+from .cache import FeatureCache
+from .models import Prediction
+from .output import format_row
+from .utils import echo
+
+
+class QueueFullError(Exception):
+    """Raised when the maximum number of pending requests is reached."""
+
+
+class ClassificationService(object):
+    """
+    Classifies BAM files with preloaded models, extracting features in a
+    warm worker pool.
+
+    :param models: mapping of model name to a (model, chunksize) tuple.
+    :param contig: name of the contig to collect features for.
+    :param cores: number of feature extraction workers.
+    :param max_queue: maximum number of requests that are being processed
+           or waiting for a worker. Further requests are refused.
+    :param cache: optional feature cache.
+    :param max_tasks_per_child: optional number of BAM files after which
+           a worker is replaced by a fresh process.
+    """
+    def __init__(self, models: Dict[str, Any], contig: str = "chrM",
+                 cores: int = 1, max_queue: int = 64,
+                 cache: Optional[FeatureCache] = None,
+                 max_tasks_per_child: Optional[int] = None):
+        if len(models) < 1:
+            raise ValueError("At least one model must be loaded.")
+        if cores < 1:
+            raise ValueError("Number of cores must be at least 1.")
+        if max_queue < 1:
+            raise ValueError("Maximum queue size must be at least 1.")
+        self.models = models
+        self.contig = contig
+        self.cores = cores
+        self.max_queue = max_queue
+        self.cache = cache
+        self.pool = Pool(cores, maxtasksperchild=max_tasks_per_child)
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+
+    def classify(self, path: Path, model_name: Optional[str] = None,
+                 unknown_threshold: float = 0.75) -> str:
+        """
+        Classify a BAM file.
+
+        :raises QueueFullError: if max_queue requests are already pending.
+        :returns: output row for the BAM file, see output.format_row
+        """
+        if not 0.5 < unknown_threshold < 1.0:
+            raise ValueError("unknown_threshold must be between 0.5 and 1.0")
+        if model_name is None:
+            if len(self.models) > 1:
+                raise ValueError("A model name must be given when multiple "
+                                 "models are loaded.")
+            model_name = next(iter(self.models))
+        if model_name not in self.models:
+            raise ValueError("Unknown model {0}".format(model_name))
+        model, chunksize = self.models[model_name]
+        if not path.is_absolute():
+            raise ValueError("Path must be absolute.")
+        if not path.exists():
+            raise ValueError("{0} does not exist".format(path))
+
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Maximum of {0} pending requests "
+                                 "reached.".format(self.max_queue))
+        try:
+            with self._lock:
+                self.pending += 1
+            features = self.pool.apply_async(
+                process_bam, (path,),
+                dict(chunksize=chunksize, contig=self.contig,
+                     cache=self.cache)
+            ).get()
+            prob = model.predict_proba(features.reshape(1, -1))[0]
+            pred = Prediction.from_model_proba(model, prob, unknown_threshold)
+            with self._lock:
+                self.served += 1
+            return format_row(path.name, pred)
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            pending, served = self.pending, self.served
+        return {
+            "status": "ok",
+            "models": {name: {"chunksize": chunksize}
+                       for name, (_, chunksize) in self.models.items()},
+            "contig": self.contig,
+            "cores": self.cores,
+            "pending": pending,
+            # requests that are waiting for a free worker
+            "queued": max(pending - self.cores, 0),
+            "max_queue": self.max_queue,
+            "served": served
+        }
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+
+class ClassificationRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler for a server with a ClassificationService"""
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "Not found"})
+            return
+        self._send_json(200, self.server.service.health())
+
+    def do_POST(self):
+        if self.path != "/classify":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            row = self.server.service.classify(
+                Path(request["path"]), request.get("model"),
+                float(request.get("unknown_threshold", 0.75))
+            )
+        except QueueFullError as e:
+            self._send_json(503, {"error": str(e)})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": "{0}: {1}".format(
+                type(e).__name__, e)})
+        else:
+            self._send(200, "text/tab-separated-values", row)
+
+    def _send_json(self, status: int, obj: Dict[str, Any]) -> None:
+        self._send(status, "application/json", json.dumps(obj))
+
+    def _send(self, status: int, content_type: str, body: str) -> None:
+        encoded = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def address_string(self) -> str:
+        # clients of a Unix socket have no address
+        if isinstance(self.client_address, tuple):
+            return str(self.client_address[0])
+        return "unix-socket"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        echo("{0} {1}".format(self.address_string(), format % args))
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service: ClassificationService,
+                host: str = "127.0.0.1", port: int = 0,
+                socket_path: Optional[Path] = None
+                ) -> socketserver.BaseServer:
+    """
+    Make a threading HTTP server for a service, listening on a Unix socket
+    if socket_path is given, or on host and port otherwise.
+    """
+    if socket_path is not None:
+        if socket_path.exists():
+            raise ValueError("{0} already exists".format(socket_path))
+        server = ThreadingUnixHTTPServer(str(socket_path),
+                                         ClassificationRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port),
+                                     ClassificationRequestHandler)
+    server.service = service
+    return server
+
+
+def serve(service: ClassificationService, host: str = "127.0.0.1",
+          port: int = 0, socket_path: Optional[Path] = None) -> None:
+    """Serve requests until interrupted, then shut down cleanly."""
+    server = make_server(service, host, port, socket_path)
+    if socket_path is not None:
+        echo("Listening on {0}".format(socket_path))
+    else:
+        echo("Listening on http://{0}:{1}".format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        echo("Shutting down.")
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path is not None and socket_path.exists():
+            socket_path.unlink()
@@ -0,0 +1,224 @@
+# Copyright (C) 2018-2019  Leiden University Medical Center
+#
+# This file is part of rna_cd
+#
+# rna_cd is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+shards.py
+~~~~~~~~~
+
+Feature extraction split in shards, so that it can be distributed over the
+nodes of a cluster.
+
+Every shard is a contiguous part of a list of BAM files. The features of a
+shard are stored in a shard file. Shard files of all shards of the same
+list are gathered again into the features of the whole list, in the order
+of the list.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .bam_process import make_array_set
+from .cache import FeatureCache
+
+# bump this whenever the layout of shard files changes.
+_SHARD_VERSION = 1
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parse a shard given as i/n, in which shards are numbered 1 to n.
+
+    :returns: tuple of i and n.
+    """
+    index, sep, n_shards = value.partition("/")
+    try:
+        shard = (int(index), int(n_shards))
+    except ValueError:
+        raise ValueError("Shard must be given as i/n, not {0}".format(value))
+    if not sep or not 1 <= shard[0] <= shard[1]:
+        raise ValueError("Shard must be given as i/n with 1 <= i <= n, "
+                         "not {0}".format(value))
+    return shard
+
+
+def shard_slice(n_files: int, shard: int, n_shards: int) -> slice:
+    """
+    Part of a list of n_files files that belongs to a shard. The sizes of
+    the shards differ by at most one file.
+    """
+    return slice((shard - 1) * n_files // n_shards,
+                 shard * n_files // n_shards)
+
+
+def list_digest(bam_files: List[Path]) -> str:
+    """
+    Digest of a list of BAM files, which is the same for all shards of the
+    list.
+
+    Paths are digested as given, so that nodes that run in different
+    working directories get the same digest for a list of relative paths.
+    """
+    hasher = hashlib.sha1()
+    for path in bam_files:
+        hasher.update(str(path).encode("utf-8") + b"\n")
+    return hasher.hexdigest()
+
+
+class FeatureShard(object):
+    """
+    Features of the BAM files of a shard of a list of BAM files.
+
+    :param arr_X: features, of shape (n_files_in_shard, n_features).
+    :param names: paths of the BAM files, as given.
+    :param shard: number of the shard, from 1 to n_shards.
+    :param n_shards: number of shards of the list.
+    :param digest: digest of the whole list, see list_digest.
+    :param chunksize: chunksize of the features.
+    :param contig: contig of the features.
+    """
+    def __init__(self, arr_X: np.ndarray, names: List[str], shard: int,
+                 n_shards: int, digest: str, chunksize: int, contig: str):
+        if len(arr_X) != len(names):
+            raise ValueError("A shard must have features for every file.")
+        self.arr_X = arr_X
+        self.names = list(names)
+        self.shard = shard
+        self.n_shards = n_shards
+        self.digest = digest
+        self.chunksize = chunksize
+        self.contig = contig
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def save(self, path: Path) -> None:
+        """Save the shard to a compressed numpy file."""
+        # write to a temporary file and rename it, so that a job that is
+        # killed never leaves a truncated shard behind.
+        directory = path.parent if str(path.parent) else Path(".")
+        fd, tmp_name = tempfile.mkstemp(dir=str(directory), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                np.savez_compressed(
+                    handle, arr_X=self.arr_X,
+                    names=np.array(self.names, dtype=str),
+                    shard=np.array(self.shard),
+                    n_shards=np.array(self.n_shards),
+                    digest=np.array(self.digest),
+                    chunksize=np.array(self.chunksize),
+                    contig=np.array(self.contig),
+                    version=np.array(_SHARD_VERSION))
+            os.replace(tmp_name, str(path))
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> "FeatureShard":
+        """
+        Load a shard stored with save.
+
+        :raises ValueError: if the file is not a shard of this version.
+        """
+        try:
+            npz = np.load(str(path), allow_pickle=False)
+        except (OSError, ValueError, EOFError):
+            raise ValueError("{0} is not a shard file.".format(path))
+        with npz:
+            if "version" not in npz or (int(npz["version"]) !=
+                                        _SHARD_VERSION):
+                raise ValueError("Shard {0} has an unsupported "
+                                 "version.".format(path))
+            return cls(npz["arr_X"], npz["names"].tolist(),
+                       int(npz["shard"]), int(npz["n_shards"]),
+                       str(npz["digest"]), int(npz["chunksize"]),
+                       str(npz["contig"]))
+
+
+def extract_shard(bam_files: List[Path], shard: int, n_shards: int,
+                  chunksize: int = 100, contig: str = "chrM",
+                  cores: int = 1, cache: Optional[FeatureCache] = None,
+                  max_tasks_per_child: Optional[int] = None
+                  ) -> FeatureShard:
+    """
+    Extract the features of a shard of a list of bam files.
+
+    :param bam_files: the whole list of bam files, in the same order for
+           all shards.
+    :param shard: number of the shard, from 1 to n_shards.
+    :param cores: number of cores to use for processing, see
+           make_array_set
+    :param cache: optional feature cache, see make_array_set
+    :param max_tasks_per_child: see make_array_set
+    """
+    if not 1 <= shard <= n_shards:
+        raise ValueError("Shard must be between 1 and the number of "
+                         "shards.")
+    shard_files = bam_files[shard_slice(len(bam_files), shard, n_shards)]
+    arr_X, _ = make_array_set(shard_files, [], chunksize, contig, cores,
+                              cache=cache,
+                              max_tasks_per_child=max_tasks_per_child)
+    if not shard_files:
+        # more shards than files; the features of the other shards set the
+        # number of features.
+        arr_X = arr_X.reshape(0, 0)
+    return FeatureShard(arr_X, [str(path) for path in shard_files], shard,
+                        n_shards, list_digest(bam_files), chunksize, contig)
+
+
+def gather_shards(paths: List[Path]
+                  ) -> Tuple[np.ndarray, List[str], int, str]:
+    """
+    Gather shard files of all shards of a list of bam files.
+
+    All shards must be of the same list, and have the same chunksize and
+    contig. Every shard must be given exactly once.
+
+    :param paths: paths of the shard files, in any order.
+    :returns: tuple of the features and the paths of the bam files in the
+              order of the list, and the chunksize and contig.
+    """
+    if not paths:
+        raise ValueError("At least one shard file must be given.")
+    shards = [FeatureShard.load(path) for path in paths]
+    first = shards[0]
+    for path, shard in zip(paths, shards):
+        if (shard.chunksize, shard.contig) != (first.chunksize,
+                                               first.contig):
+            raise ValueError(
+                "Shard {0} has chunksize {1} and contig {2}, but shard {3} "
+                "has chunksize {4} and contig {5}.".format(
+                    path, shard.chunksize, shard.contig, paths[0],
+                    first.chunksize, first.contig))
+        if (shard.n_shards, shard.digest) != (first.n_shards, first.digest):
+            raise ValueError("Shard {0} is not a shard of the same list of "
+                             "BAM files as shard {1}.".format(path, paths[0]))
+    numbers = sorted(shard.shard for shard in shards)
+    if numbers != list(range(1, first.n_shards + 1)):
+        missing = sorted(set(range(1, first.n_shards + 1)) - set(numbers))
+        raise ValueError("Every shard of 1 to {0} must be given once; "
+                         "missing: {1}, given: {2}.".format(
+                             first.n_shards, missing, numbers))
+    shards.sort(key=lambda shard: shard.shard)
+    names = [name for shard in shards for name in shard.names]
+    if not names:
+        raise ValueError("The shards do not contain any BAM files.")
+    arr_X = np.concatenate([shard.arr_X for shard in shards if len(shard)])
+    return arr_X, names, first.chunksize, first.contig
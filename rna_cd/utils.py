@@ -15,16 +15,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import datetime
+import re
 from pathlib import Path
-from typing import List, Any
-import joblib
+from typing import List, Any, BinaryIO, Dict, Optional, Tuple
 import click
 
 import io
 import base64
 import json
+import mmap
+import pickle
+import struct
 
-import pkg_resources
+
+MODEL_MAGIC = b"RNACDMDL"
+_BINARY_FORMAT_VERSION = 1
+_BINARY_ALIGNMENT = 64
 
 
 def echo(msg: str):
@@ -40,45 +46,185 @@ def load_list_file(path: Path) -> List[Path]:
 
 
 def dir_to_bam_list(path: Path) -> List[Path]:
-    """Load a directory containing bam or cram files"""
+    """Load a directory containing bam, cram or profile files"""
     return [x for x in path.iterdir() if x.name.endswith(".bam")
-            or x.name.endswith(".cram")]
+            or x.name.endswith(".cram")
+            or x.name.endswith(".profile.npz")]
 
 
+# importlib.metadata is imported in the functions, as it is relatively slow
+# to import and only needed when models are stored or loaded.
 def get_rna_cd_version():
-    return pkg_resources.get_distribution("rna_cd").version
+    import importlib.metadata
+    return importlib.metadata.version("rna_cd")
 
 
 def get_sklearn_version():
-    return pkg_resources.get_distribution("scikit-learn").version
-
-
-def save_sklearn_object_to_disk(obj: Any, path: Path):
-    """Save an object with some metadata to disk as serialized JSON"""
-    b = io.BytesIO()
+    import importlib.metadata
+    return importlib.metadata.version("scikit-learn")
+
+
+def parse_version(version: str) -> Tuple[int, ...]:
+    """
+    Parse the numeric release part of a version string, e.g. "0.20.3" or
+    "1.2rc1", into a tuple that can be compared. Trailing zeros are
+    dropped, so that "0.20" and "0.20.0" are equal.
+    """
+    match = re.match(r"\d+(\.\d+)*", version.strip())
+    if match is None:
+        raise ValueError("Invalid version: {0}".format(version))
+    release = [int(x) for x in match.group(0).split(".")]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    return tuple(release)
+
+
+def _metadata(obj: Any) -> Dict[str, Any]:
     d = {
         "rna_cd_version": get_rna_cd_version(),
         "sklearn_version": get_sklearn_version(),
         "datetime_stored": str(datetime.datetime.utcnow())
     }
-    joblib.dump(obj, b, compress=True)
-    dumped = b.getvalue()
-    base64_encoded = base64.b64encode(dumped)
-    d['obj'] = base64_encoded.decode('utf-8')
-    with path.open("w") as handle:
-        json.dump(d, handle)
+    # feature extraction parameters of models trained by rna_cd
+    for attr in ("chunksize", "contig"):
+        if hasattr(obj, attr + "_"):
+            d[attr] = getattr(obj, attr + "_")
+    return d
 
 
-def load_sklearn_object_from_disk(path: Path) -> Any:
-    """Load a JSON-serialized object from disk"""
-    with path.open("r") as handle:
-        d = json.load(handle)
-    if pkg_resources.parse_version(
-            d.get("sklearn_version", "0.0.0")
-    ) < pkg_resources.parse_version("0.20.0"):
+def _check_sklearn_version(metadata: Dict[str, Any]) -> None:
+    if parse_version(
+            metadata.get("sklearn_version", "0.0.0")
+    ) < parse_version("0.20.0"):
         raise ValueError("We do not support loading objects with sklearn "
                          "versions below 0.20.0")
-    blob = base64.b64decode(d.get("obj", ""))
-    file_like_obj = io.BytesIO(blob)
-    loaded = joblib.load(file_like_obj)
-    return loaded
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _BINARY_ALIGNMENT) * _BINARY_ALIGNMENT
+
+
+def save_sklearn_object_to_disk(obj: Any, path: Path, binary: bool = False,
+                                metadata: Optional[Dict[str, Any]] = None):
+    """
+    Save an object with some metadata to disk.
+
+    By default the object is stored as serialized JSON. With binary=True,
+    the binary format is used, which loads faster and with less memory:
+
+    * the magic bytes ``RNACDMDL``
+    * the length of the header as unsigned 32 bit little endian integer
+    * the header: JSON with the metadata and the sections below
+    * a pickle (protocol 5) of the object, without the data of its arrays
+    * the data of the arrays, uncompressed
+
+    Sections start at multiples of 64 bytes after the header, so that arrays
+    can be used directly from a memory map of the file.
+
+    :param metadata: optional metadata that overrides the default metadata.
+    """
+    d = _metadata(obj)
+    d.update(metadata or {})
+    if not binary:
+        # joblib is slow to import, and only needed for the JSON format.
+        import joblib
+        b = io.BytesIO()
+        joblib.dump(obj, b, compress=True)
+        dumped = b.getvalue()
+        base64_encoded = base64.b64encode(dumped)
+        d['obj'] = base64_encoded.decode('utf-8')
+        with path.open("w") as handle:
+            json.dump(d, handle)
+        return
+
+    buffers = []  # type: List[pickle.PickleBuffer]
+    pickled = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    sections = [memoryview(pickled)] + [b.raw() for b in buffers]
+    offsets = []
+    offset = 0
+    for section in sections:
+        offsets.append([offset, section.nbytes])
+        offset = _align(offset + section.nbytes)
+    d["format_version"] = _BINARY_FORMAT_VERSION
+    d["sections"] = offsets
+    header = json.dumps(d).encode("utf-8")
+    data_start = _align(len(MODEL_MAGIC) + 4 + len(header))
+    with path.open("wb") as handle:
+        handle.write(MODEL_MAGIC)
+        handle.write(struct.pack("<I", len(header)))
+        handle.write(header)
+        for (offset, _), section in zip(offsets, sections):
+            handle.write(b"\0" * (data_start + offset - handle.tell()))
+            handle.write(section)
+
+
+def is_binary_model(path: Path) -> bool:
+    with path.open("rb") as handle:
+        return handle.read(len(MODEL_MAGIC)) == MODEL_MAGIC
+
+
+def _read_binary_header(handle: BinaryIO) -> Tuple[Dict[str, Any], int]:
+    """Read the header of a binary model; returns header and data start"""
+    if handle.read(len(MODEL_MAGIC)) != MODEL_MAGIC:
+        raise ValueError("Not a binary rna_cd model")
+    header_length, = struct.unpack("<I", handle.read(4))
+    header = json.loads(handle.read(header_length).decode("utf-8"))
+    if header.get("format_version") != _BINARY_FORMAT_VERSION:
+        raise ValueError("Unsupported binary model format version {0}".format(
+            header.get("format_version")))
+    return header, _align(len(MODEL_MAGIC) + 4 + header_length)
+
+
+def load_model_metadata(path: Path) -> Dict[str, Any]:
+    """
+    Load the metadata of a model saved with save_sklearn_object_to_disk,
+    without loading the model itself (for binary models).
+    """
+    if is_binary_model(path):
+        with path.open("rb") as handle:
+            header, _ = _read_binary_header(handle)
+        header.pop("sections")
+        return header
+    with path.open("r") as handle:
+        d = json.load(handle)
+    d.pop("obj", None)
+    return d
+
+
+def load_sklearn_object_from_disk(path: Path) -> Any:
+    """
+    Load an object saved with save_sklearn_object_to_disk, in either
+    JSON or binary format.
+
+    Arrays of binary models are backed by a copy-on-write memory map of
+    the file, so that they are only read from disk when they are used.
+    """
+    if not is_binary_model(path):
+        with path.open("r") as handle:
+            d = json.load(handle)
+        _check_sklearn_version(d)
+        import joblib
+        blob = base64.b64decode(d.get("obj", ""))
+        file_like_obj = io.BytesIO(blob)
+        loaded = joblib.load(file_like_obj)
+        return loaded
+
+    with path.open("rb") as handle:
+        header, data_start = _read_binary_header(handle)
+        _check_sklearn_version(header)
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mapped)
+    sections = [view[data_start + offset:data_start + offset + length]
+                for offset, length in header["sections"]]
+    return pickle.loads(sections[0], buffers=sections[1:])
+
+
+def migrate_model(src: Path, dest: Path) -> None:
+    """
+    Convert a model in JSON format to the binary format, keeping its
+    metadata.
+    """
+    metadata = load_model_metadata(src)
+    metadata["migrated_from"] = src.name
+    save_sklearn_object_to_disk(load_sklearn_object_from_disk(src), dest,
+                                binary=True, metadata=metadata)
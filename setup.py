@@ -13,11 +13,11 @@ setup(
     url="https://github.com/LUMC/rna_cd",
     license="AGPLv3+",
     packages=find_packages(),
-    python_requires=">=3.5",
+    python_requires=">=3.8",
     zip_safe=False,
     install_requires=[
         "click",
-        "scikit-learn",
+        "scikit-learn>=1.2",
         "pysam",
         "matplotlib",
         "joblib"
@@ -25,16 +25,22 @@ setup(
     entry_points={
         "console_scripts": [
             "rna_cd-train = rna_cd.cli:train_cli",
-            "rna_cd-classify = rna_cd.cli:classify_cli"
+            "rna_cd-classify = rna_cd.cli:classify_cli",
+            "rna_cd-profile = rna_cd.cli:profile_cli",
+            "rna_cd-extract = rna_cd.cli:extract_cli",
+            "rna_cd-serve = rna_cd.cli:serve_cli",
+            "rna_cd-client = rna_cd.client:client_cli",
+            "rna_cd-migrate-model = rna_cd.cli:migrate_model_cli"
         ]
     },
     classifiers=[
         "License :: OSI Approved :: GNU Affero General Public License v3 or "
         "later (AGPLv3+)",
         "Programming Language :: Python :: 3 :: Only",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
-        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Topic :: Scientific/Engineering :: Bio-Informatics"
     ]
 )
@@ -20,6 +20,11 @@ from typing import List, Tuple
 import pytest
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from unittest import mock
+
+import numpy as np
+
+from rna_cd.models import train_svm_model
 
 
 @pytest.fixture(scope="session")
@@ -48,3 +53,13 @@ def temp_path() -> Path:
     path = Path(tempf.name)
     yield path
     path.unlink()  # removes it at teardown stage
+
+
+@pytest.fixture(scope="session")
+def trained_model():
+    """Model trained on random data with 51 features (chunksize 1000)"""
+    labels = np.array(["pos"]*10 + ["neg"]*10)
+    with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_array.return_value = (np.random.rand(20, 51), labels)
+        return train_svm_model([Path("a.bam")], [Path("b.bam")],
+                               chunksize=1000)
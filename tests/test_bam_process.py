@@ -16,11 +16,20 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
 from pysam import AlignmentFile
+import numpy as np
 import pytest
 
 from rna_cd.bam_process import (chop_contig, coverage, softclip_bases,
-                                process_bam, make_array_set)
+                                process_bam, make_array_set, extract_profile,
+                                profile_to_features, save_profile,
+                                load_profile, write_profiles, imap_files,
+                                iter_features, imap_batches,
+                                iter_feature_batches, feature_count)
 
 
 chop_contig_data = [
@@ -42,6 +51,9 @@ fail_contig_data = [
 make_array_set_cores = list(range(1, 10))
 
 
+region_query_chunksizes = [333, 1000, 16571]
+
+
 @pytest.mark.parametrize("args, expected", chop_contig_data)
 def test_chop_contig(args, expected):
     assert list(chop_contig(*args)) == expected
@@ -77,6 +89,28 @@ def test_process_bam_contents(micro_bam):
     assert 0.56 < returned[2] < 0.57  # it's a float
 
 
+def region_query_features(path, chunksize, contig="chrM"):
+    """Feature vector calculated with separate queries for every region"""
+    reader = AlignmentFile(str(path))
+    size = reader.lengths[reader.references.index(contig)]
+    full_array = []
+    tot_reads = 0
+    for region in chop_contig(size, chunksize):
+        start, end = region
+        n_reads = reader.count(contig=contig, start=start, stop=end)
+        tot_reads += n_reads
+        full_array += [n_reads, coverage(reader, contig, region),
+                       softclip_bases(reader, contig, region)]
+    return np.array(full_array) / tot_reads
+
+
+@pytest.mark.parametrize("chunksize", region_query_chunksizes)
+def test_process_bam_equals_region_queries(chunksize, micro_bam, micro_bam2):
+    for bam in (micro_bam, micro_bam2):
+        expected = region_query_features(bam, chunksize)
+        assert np.array_equal(process_bam(bam, chunksize), expected)
+
+
 @pytest.mark.parametrize("cores", make_array_set_cores)
 def test_make_array_set(cores, micro_bam):
     path_set = [micro_bam]*10
@@ -86,6 +120,154 @@ def test_make_array_set(cores, micro_bam):
     assert data_array.shape == (10, 51)
 
 
+def test_profile_features(micro_bam):
+    profile = extract_profile(micro_bam)
+    assert profile.shape == (5, 16572)
+    for chunksize in (7, 100, 1000, 16571):
+        assert np.array_equal(profile_to_features(profile, chunksize),
+                              process_bam(micro_bam, chunksize))
+
+
+@pytest.mark.parametrize("cores", [2, 3, 16])
+def test_extract_profile_cores(cores, micro_bam):
+    assert np.array_equal(extract_profile(micro_bam, cores=cores),
+                          extract_profile(micro_bam))
+
+
+def test_make_array_set_single_file(micro_bam):
+    single_core, _ = make_array_set([micro_bam], ["pos"], chunksize=1000)
+    multi_core, _ = make_array_set([micro_bam], ["pos"], chunksize=1000,
+                                   cores=4)
+    assert single_core.shape == (1, 51)
+    assert np.array_equal(single_core, multi_core)
+
+
+def test_profile_roundtrip(micro_bam, temp_path):
+    profile = extract_profile(micro_bam)
+    save_profile(profile, temp_path, "chrM")
+    assert np.array_equal(load_profile(temp_path, "chrM"), profile)
+    with pytest.raises(ValueError):
+        load_profile(temp_path, "MT")
+
+
+def test_process_bam_profile_file(micro_bam, micro_bam2):
+    with TemporaryDirectory() as tmp:
+        profiles = write_profiles([micro_bam, micro_bam2], Path(tmp),
+                                  cores=2)
+        assert [x.name for x in profiles] == ["micro.bam.profile.npz",
+                                              "micro2.bam.profile.npz"]
+        from_profiles, _ = make_array_set(profiles, [], chunksize=1000)
+    from_bams, _ = make_array_set([micro_bam, micro_bam2], [],
+                                  chunksize=1000)
+    assert np.array_equal(from_profiles, from_bams)
+
+
+def test_write_profiles_duplicate_names(micro_bam):
+    with pytest.raises(ValueError):
+        write_profiles([micro_bam, micro_bam], Path("."))
+
+
+def square(path):
+    return int(path.name) ** 2
+
+
+@pytest.mark.parametrize("cores", [1, 3])
+def test_imap_files(cores):
+    files = [Path(str(x)) for x in range(20)]
+    results = list(imap_files(square, files, cores=cores,
+                              max_tasks_per_child=2, dispatch_chunksize=3))
+    assert sorted(results) == [(x, x ** 2) for x in range(20)]
+
+
+def test_imap_files_early_stop():
+    files = [Path(str(x)) for x in range(100)]
+    results = imap_files(square, files, cores=2, dispatch_chunksize=1)
+    index, value = next(results)
+    assert value == index ** 2
+    results.close()  # terminates the pool
+
+
+def test_imap_files_errors():
+    with pytest.raises(ValueError):
+        next(imap_files(square, [Path("1")], cores=0))
+    with pytest.raises(ValueError):
+        next(imap_files(square, [Path("1")], max_tasks_per_child=0))
+
+
+@pytest.mark.parametrize("cores", [1, 3])
+def test_imap_batches(cores):
+    files = [Path(str(x)) for x in range(20)]
+    results = list(imap_batches(square, files, 6, cores=cores,
+                                max_tasks_per_child=2))
+    assert [start for start, _ in results] == [0, 6, 12, 18]
+    assert [len(batch) for _, batch in results] == [6, 6, 6, 2]
+    assert sum((batch for _, batch in results), []) == [
+        x ** 2 for x in range(20)]
+
+
+def test_imap_batches_early_stop():
+    files = [Path(str(x)) for x in range(100)]
+    results = imap_batches(square, files, 10, cores=2)
+    assert next(results) == (0, [x ** 2 for x in range(10)])
+    results.close()  # terminates the pool
+
+
+def test_imap_batches_errors():
+    with pytest.raises(ValueError):
+        next(imap_batches(square, [Path("1")], 1, cores=0))
+    with pytest.raises(ValueError):
+        next(imap_batches(square, [Path("1")], 0))
+
+
+def test_iter_feature_batches(micro_bam, micro_bam2):
+    results = list(iter_feature_batches([micro_bam, micro_bam2, micro_bam],
+                                        2, chunksize=1000, cores=2))
+    assert [start for start, _ in results] == [0, 2]
+    assert [arr.shape[0] for _, arr in results] == [2, 1]
+    assert np.array_equal(results[0][1][1], process_bam(micro_bam2, 1000))
+    assert np.array_equal(results[0][1][0], results[1][1][0])
+
+
+def test_iter_features(micro_bam, micro_bam2):
+    results = dict(iter_features([micro_bam, micro_bam2, micro_bam],
+                                 chunksize=1000, cores=2,
+                                 max_tasks_per_child=1))
+    assert sorted(results.keys()) == [0, 1, 2]
+    assert np.array_equal(results[0], results[2])
+    assert np.array_equal(results[1], process_bam(micro_bam2, 1000))
+
+
+@pytest.mark.parametrize("chunksize", [7, 100, 1000, 16571])
+def test_feature_count(chunksize, micro_bam):
+    expected = process_bam(micro_bam, chunksize).shape[0]
+    assert feature_count(micro_bam, chunksize) == expected
+    with TemporaryDirectory() as tmp:
+        profile, = write_profiles([micro_bam], Path(tmp))
+        assert feature_count(profile, chunksize) == expected
+
+
+def test_make_array_set_shared(micro_bam, micro_bam2):
+    bams = [micro_bam, micro_bam2, micro_bam]
+    expected, _ = make_array_set(bams, [], chunksize=1000)
+    with mock.patch("rna_cd.bam_process.iter_features") as mocked_features:
+        shared, _ = make_array_set(bams, [], chunksize=1000, cores=2,
+                                   max_tasks_per_child=1)
+    # the workers write to the shared array instead of returning features
+    assert not mocked_features.called
+    assert np.array_equal(shared, expected)
+    view = shared[1:]
+    del shared
+    assert np.array_equal(view, expected[1:])
+
+
+def test_make_array_set_shared_feature_count(micro_bam, micro_bam2):
+    with mock.patch("rna_cd.bam_process.feature_count", return_value=3):
+        with pytest.raises(ValueError) as excinfo:
+            make_array_set([micro_bam, micro_bam2], [], chunksize=1000,
+                           cores=2)
+    assert "features instead of 3" in str(excinfo.value)
+
+
 def test_make_array_set_error(micro_bam):
     with pytest.raises(ValueError) as excinfo:
         make_array_set([micro_bam], ["pos"], cores=0)
@@ -0,0 +1,167 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rna_cd.bam_process import process_bam, make_profile_set
+from rna_cd.cache import FeatureCache, file_digest
+
+
+@pytest.fixture
+def cache_dir() -> Path:
+    with TemporaryDirectory() as tmp:
+        yield Path(tmp)
+
+
+@pytest.fixture
+def bam_copy(micro_bam, cache_dir) -> Path:
+    """A copy of micro.bam (with index) that can be modified"""
+    bam_dir = cache_dir / "bams"
+    bam_dir.mkdir()
+    copy = bam_dir / micro_bam.name
+    shutil.copy(str(micro_bam), str(copy))
+    shutil.copy(str(micro_bam) + ".bai", str(copy) + ".bai")
+    return copy
+
+
+def test_cache_roundtrip(cache_dir, micro_bam):
+    cache = FeatureCache(cache_dir / "cache")
+    arr = np.arange(10, dtype=float)
+    assert cache.get(micro_bam, chunksize=100, contig="chrM") is None
+    cache.put(micro_bam, arr, chunksize=100, contig="chrM")
+    assert np.array_equal(cache.get(micro_bam, chunksize=100,
+                                    contig="chrM"), arr)
+    # other extraction parameters are other entries
+    assert cache.get(micro_bam, chunksize=1000, contig="chrM") is None
+    assert cache.get(micro_bam, chunksize=100, contig="MT") is None
+
+
+def test_cache_symlink_dedup(cache_dir, bam_copy):
+    cache = FeatureCache(cache_dir / "cache")
+    link = cache_dir / "link.bam"
+    os.symlink(str(bam_copy), str(link))
+    assert cache.key(link, chunksize=100) == cache.key(bam_copy,
+                                                       chunksize=100)
+    cache.put(link, np.ones(3), chunksize=100)
+    assert cache.get(bam_copy, chunksize=100) is not None
+    assert len(list(cache.directory.iterdir())) == 1
+
+
+def test_cache_key_changes_with_index(cache_dir, bam_copy):
+    cache = FeatureCache(cache_dir / "cache")
+    before = cache.key(bam_copy, chunksize=100)
+    digest = file_digest(bam_copy)
+    with open(str(bam_copy) + ".bai", "ab") as handle:
+        handle.write(b"\0")
+    assert file_digest(bam_copy) != digest
+    assert cache.key(bam_copy, chunksize=100) != before
+
+
+def test_cache_eviction(cache_dir, micro_bam, micro_bam2):
+    arr = np.zeros(1000)
+    entry_size = len(arr.tobytes()) + 128  # data + npy header
+    cache = FeatureCache(cache_dir / "cache", max_size=entry_size)
+    cache.put(micro_bam, arr, chunksize=100)
+    cache.put(micro_bam2, arr, chunksize=100)
+    assert cache.get(micro_bam, chunksize=100) is None
+    assert cache.get(micro_bam2, chunksize=100) is not None
+    assert cache.size() <= entry_size
+
+
+def test_cache_eviction_lru(cache_dir, micro_bam, micro_bam2):
+    cache = FeatureCache(cache_dir / "cache")
+    cache.put(micro_bam, np.zeros(10), chunksize=100)
+    cache.put(micro_bam2, np.zeros(10), chunksize=100)
+    first = cache.entry_path(cache.key(micro_bam, chunksize=100))
+    os.utime(str(first), (0, 0))
+    # reading an entry marks it as most recently used
+    cache.get(micro_bam, chunksize=100)
+    cache.evict(cache.size() - 1)
+    assert cache.get(micro_bam, chunksize=100) is not None
+    assert cache.get(micro_bam2, chunksize=100) is None
+
+
+def test_cache_size_running_total(cache_dir, micro_bam, micro_bam2,
+                                  bam_copy):
+    arr = np.zeros(1000)
+    entry_size = len(arr.tobytes()) + 128  # data + npy header
+    cache = FeatureCache(cache_dir / "cache", max_size=2 * entry_size)
+    with mock.patch.object(cache, "size", wraps=cache.size) as mocked_size, \
+            mock.patch.object(cache, "evict",
+                              wraps=cache.evict) as mocked_evict:
+        cache.put(micro_bam, arr, chunksize=100)
+        # replacing an entry does not change the total
+        cache.put(micro_bam, arr, chunksize=100)
+        cache.put(micro_bam2, arr, chunksize=100)
+        # the directory is counted once, and only scanned to evict
+        assert mocked_size.call_count == 1
+        assert mocked_evict.call_count == 0
+        cache.put(bam_copy, arr, chunksize=100)
+        assert mocked_evict.call_count == 1
+    assert cache.size() <= 2 * entry_size
+    assert cache.get(bam_copy, chunksize=100) is not None
+
+
+def test_cache_size_recount(cache_dir, micro_bam):
+    cache = FeatureCache(cache_dir / "cache", max_size=1 << 30)
+    with mock.patch("rna_cd.cache._RECOUNT_PUTS", 2), \
+            mock.patch.object(cache, "size", return_value=0) as mocked_size:
+        for _ in range(5):
+            cache.put(micro_bam, np.zeros(10), chunksize=100)
+    # on the first store, and every second store
+    assert mocked_size.call_count == 3
+
+
+def test_cache_invalid_size(cache_dir):
+    with pytest.raises(ValueError):
+        FeatureCache(cache_dir, max_size=0)
+
+
+def test_process_bam_uses_cache(cache_dir, micro_bam):
+    cache = FeatureCache(cache_dir / "cache")
+    first = process_bam(micro_bam, 1000, cache=cache)
+    with mock.patch("rna_cd.bam_process._profile_reads") as mocked:
+        second = process_bam(micro_bam, 1000, cache=cache)
+    assert mocked.call_count == 0
+    assert np.array_equal(first, second)
+
+
+def test_process_bam_digests_once(cache_dir, micro_bam):
+    cache = FeatureCache(cache_dir / "cache")
+    with mock.patch("rna_cd.cache.file_digest",
+                    wraps=file_digest) as mocked_digest:
+        process_bam(micro_bam, 1000, cache=cache)
+    # the same key is used to look up and to store the features
+    assert mocked_digest.call_count == 1
+    assert cache.get(micro_bam, chunksize=1000, contig="chrM") is not None
+
+
+def test_make_profile_set_uses_cache(cache_dir, micro_bam, micro_bam2):
+    cache = FeatureCache(cache_dir / "cache")
+    first = make_profile_set([micro_bam, micro_bam2], cores=2, cache=cache)
+    with mock.patch("rna_cd.bam_process.extract_profile") as mocked:
+        second = make_profile_set([micro_bam, micro_bam2], cache=cache)
+    assert mocked.call_count == 0
+    assert all(np.array_equal(x, y) for x, y in zip(first, second))
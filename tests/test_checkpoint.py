@@ -0,0 +1,125 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rna_cd.bam_process import iter_features, make_array_set
+from rna_cd.checkpoint import make_checkpointed_array_set, read_checkpoint
+from rna_cd.models import train_svm_model
+
+
+def interrupted_after(n_files):
+    """iter_features replacement that fails after n_files files"""
+    def interrupted(*args, **kwargs):
+        for count, result in enumerate(iter_features(*args, **kwargs)):
+            if count == n_files:
+                raise RuntimeError("worker died")
+            yield result
+    return interrupted
+
+
+def test_checkpoint(micro_bam, micro_bam2, temp_path):
+    bams = [micro_bam, micro_bam2, micro_bam]
+    labels = ["pos", "neg", "pos"]
+    arr_X, arr_Y = make_checkpointed_array_set(bams, labels, temp_path,
+                                               chunksize=1000)
+    expected_X, _ = make_array_set(bams, [], 1000)
+    np.testing.assert_array_equal(arr_X, expected_X)
+    np.testing.assert_array_equal(arr_Y, labels)
+    header, records, end = read_checkpoint(temp_path)
+    assert header["chunksize"] == 1000
+    assert sorted(record.index for record in records) == [0, 1, 2]
+    assert end == temp_path.stat().st_size
+
+
+def test_checkpoint_resume(micro_bam, micro_bam2, temp_path):
+    bams = [micro_bam, micro_bam2]
+    labels = ["pos", "neg"]
+    with mock.patch("rna_cd.checkpoint.iter_features",
+                    interrupted_after(1)):
+        with pytest.raises(RuntimeError):
+            make_checkpointed_array_set(bams, labels, temp_path,
+                                        chunksize=1000)
+    assert len(read_checkpoint(temp_path)[1]) == 1
+    with mock.patch("rna_cd.checkpoint.iter_features",
+                    wraps=iter_features) as mocked_features:
+        arr_X, _ = make_checkpointed_array_set(bams, labels, temp_path,
+                                               resume=True, chunksize=1000)
+    # only the file that was not done is processed
+    assert len(mocked_features.call_args[0][0]) == 1
+    np.testing.assert_array_equal(arr_X, make_array_set(bams, [], 1000)[0])
+
+
+def test_checkpoint_incomplete_record(micro_bam, micro_bam2, temp_path):
+    bams = [micro_bam, micro_bam2]
+    expected_X, _ = make_checkpointed_array_set(bams, ["pos", "neg"],
+                                                temp_path, chunksize=1000)
+    size = temp_path.stat().st_size
+    # a crash while the last record was written
+    os.truncate(str(temp_path), size - 10)
+    assert len(read_checkpoint(temp_path)[1]) == 1
+    arr_X, _ = make_checkpointed_array_set(bams, ["pos", "neg"], temp_path,
+                                           resume=True, chunksize=1000)
+    np.testing.assert_array_equal(arr_X, expected_X)
+    assert temp_path.stat().st_size == size
+
+
+def test_checkpoint_without_resume_starts_again(micro_bam, micro_bam2,
+                                                temp_path):
+    make_checkpointed_array_set([micro_bam], ["pos"], temp_path,
+                                chunksize=1000)
+    make_checkpointed_array_set([micro_bam2], ["neg"], temp_path,
+                                chunksize=1000)
+    records = read_checkpoint(temp_path)[1]
+    assert [record.label for record in records] == ["neg"]
+
+
+@pytest.mark.parametrize(["order", "labels", "chunksize"], [
+    ([1, 0], ["pos", "neg"], 1000),  # other order
+    ([0, 1], ["neg", "neg"], 1000),  # other label
+    ([0, 1], ["pos", "neg"], 100),  # other chunksize
+])
+def test_checkpoint_mismatch(micro_bam, micro_bam2, temp_path, order, labels,
+                             chunksize):
+    bams = [micro_bam, micro_bam2]
+    make_checkpointed_array_set(bams, ["pos", "neg"], temp_path,
+                                chunksize=1000)
+    with pytest.raises(ValueError):
+        make_checkpointed_array_set([bams[i] for i in order], labels,
+                                    temp_path, resume=True,
+                                    chunksize=chunksize)
+
+
+def test_checkpoint_not_a_checkpoint(micro_bam, temp_path):
+    temp_path.write_bytes(b"something else")
+    with pytest.raises(ValueError):
+        make_checkpointed_array_set([micro_bam], ["pos"], temp_path,
+                                    resume=True, chunksize=1000)
+
+
+def test_train_model_checkpoint_errors(dataset, temp_path):
+    positives, negatives = dataset
+    with pytest.raises(ValueError):
+        train_svm_model(positives, negatives, resume=True)
+    with pytest.raises(ValueError):
+        train_svm_model(positives, negatives, chunksize=[100, 1000],
+                        checkpoint=temp_path)
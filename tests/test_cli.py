@@ -19,15 +19,25 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from click.testing import CliRunner
 from click import BadParameter
 from collections import namedtuple
+import json
 from pathlib import Path
+import subprocess
+import sys
 from unittest import mock
 from tempfile import NamedTemporaryFile
 
 import pytest
 import numpy as np
 
+from rna_cd.cache import FeatureCache
+from rna_cd.output import HEADER
+from rna_cd.shards import FeatureShard, list_digest
+from rna_cd.utils import (save_sklearn_object_to_disk, is_binary_model,
+                          load_model_metadata, load_sklearn_object_from_disk)
 from rna_cd.cli import (directory_callback, list_callback, path_callback,
-                        train_cli, classify_cli)
+                        train_cli, classify_cli, profile_cli,
+                        migrate_model_cli, model_chunksize,
+                        model_option_callback, extract_cli)
 
 MockParam = namedtuple("MockParam", ["name"])
 MockCtx = namedtuple("MockCtx", ["params"])
@@ -105,13 +115,19 @@ train_cli_errors_data = [
     (["-o", "some_random_path"],
      ValueError("Must set either --positives-dir or --positives-list")),
     (["-o", "some_random_path", "-pl", str(_listf)],
-     ValueError("Must set either --negatives-dir or --negatives-list"))
+     ValueError("Must set either --negatives-dir or --negatives-list")),
+    (["-o", "some_random_path", "-pl", str(_listf), "-nl", str(_listf),
+      "--feature-cache-size", "10"],
+     ValueError("--feature-cache-size requires --feature-cache"))
 ]
 
 
 classify_cli_errors_data = [
     (["-m", str(_listf), "-o", "someething"],
-     ValueError("Must set either --directory or --list-items"))
+     ValueError("Must set either --directory or --list-items")),
+    (["-m", str(_listf), "-o", "someething", "-l", str(_listf),
+      "--keep-order"],
+     ValueError("--keep-order requires --stream, --resume or --batch-size"))
 ]
 
 classify_tool_errors_data = [
@@ -121,6 +137,18 @@ classify_tool_errors_data = [
 ]
 
 
+ModelWithChunksize = namedtuple("ModelWithChunksize", ["chunksize_"])
+
+model_chunksize_data = [
+    ([object(), None], 100),
+    ([object(), 500], 500),
+    ([ModelWithChunksize(200), None], 200),
+    ([ModelWithChunksize(200), 200], 200),
+    ([ModelWithChunksize(200), 500],
+     ValueError("Model was trained with chunksize 200, not 500"))
+]
+
+
 @pytest.fixture
 def make_dataset_lists(dataset):
     positives, negatives = dataset
@@ -142,6 +170,22 @@ def make_dataset_lists(dataset):
     neg_list_f.unlink()
 
 
+@pytest.fixture
+def model_path(trained_model):
+    path = Path(NamedTemporaryFile(delete=False).name)
+    save_sklearn_object_to_disk(trained_model, path)
+    yield path
+    path.unlink()
+
+
+def write_list(paths) -> Path:
+    list_f = Path(NamedTemporaryFile(delete=False, suffix=".list").name)
+    with list_f.open("w") as handle:
+        for path in paths:
+            handle.write(str(path) + "\n")
+    return list_f
+
+
 @pytest.fixture
 def labels():
     # fake labels for mock array set
@@ -173,6 +217,16 @@ def test_path_callback(value, expected):
     assert path_callback(None, None, value) == expected
 
 
+@pytest.mark.parametrize("args, expected", model_chunksize_data)
+def test_model_chunksize(args, expected):
+    if isinstance(expected, Exception):
+        with pytest.raises(type(expected)) as excinfo:
+            model_chunksize(*args)
+        assert str(excinfo.value) == str(expected)
+    else:
+        assert model_chunksize(*args) == expected
+
+
 @pytest.mark.parametrize("args, expected", train_cli_errors_data)
 def test_train_cli_errors(args, expected):
     runner = CliRunner()
@@ -211,3 +265,256 @@ def test_train_cli(make_dataset_lists, temp_path, labels):
     assert mocked_array.call_count == 1
     assert result.exit_code == 0
     assert "Finished training." in result.output
+    with temp_path.open("r") as handle:
+        assert json.load(handle)["chunksize"] == 1000
+
+
+def test_train_cli_binary(make_dataset_lists, temp_path, labels):
+    pos_list, neg_list = make_dataset_lists
+    runner = CliRunner()
+    args = ["-pl", str(pos_list), "-nl", str(neg_list), "-o", str(temp_path),
+            "--chunksize", 1000, "--model-format", "binary"]
+    with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_array.return_value = (np.random.rand(20, 500), labels)
+        result = runner.invoke(train_cli, args)
+    assert result.exit_code == 0
+    assert is_binary_model(temp_path)
+    assert load_model_metadata(temp_path)["chunksize"] == 1000
+
+
+def test_train_cli_search(make_dataset_lists, temp_path, labels):
+    pos_list, neg_list = make_dataset_lists
+    runner = CliRunner()
+    args = ["-pl", str(pos_list), "-nl", str(neg_list), "-o", str(temp_path),
+            "--chunksize", 1000, "--search", "random", "--n-candidates", 5,
+            "--time-budget", 60]
+    with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_array.return_value = (np.random.rand(20, 500), labels)
+        result = runner.invoke(train_cli, args)
+    assert result.exit_code == 0
+    assert "Starting random search" in result.output
+
+
+def test_train_cli_warm_start(make_dataset_lists, model_path, temp_path,
+                              labels):
+    pos_list, neg_list = make_dataset_lists
+    runner = CliRunner()
+    args = ["-pl", str(pos_list), "-nl", str(neg_list), "-o", str(temp_path),
+            "--chunksize", 1000, "--warm-start", str(model_path)]
+    with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_array.return_value = (np.random.rand(20, 500), labels)
+        result = runner.invoke(train_cli, args)
+    assert result.exit_code == 0
+    assert "Warm start from parameters" in result.output
+    model = load_sklearn_object_from_disk(temp_path)
+    # two gammas at most on either side, and both whitening values
+    assert len(model.cv_results_["params"]) <= 11 * 3 * 2
+
+
+def test_train_cli_resume(make_dataset_lists, temp_path, labels):
+    pos_list, neg_list = make_dataset_lists
+    checkpoint = temp_path.with_name(temp_path.name + ".checkpoint")
+    runner = CliRunner()
+    args = ["-pl", str(pos_list), "-nl", str(neg_list), "-o", str(temp_path),
+            "--chunksize", 1000, "--checkpoint", str(checkpoint), "--resume"]
+    with mock.patch("rna_cd.models.make_checkpointed_array_set") as mocked:
+        mocked.return_value = (np.random.rand(20, 500), np.array(labels))
+        result = runner.invoke(train_cli, args)
+    assert result.exit_code == 0
+    assert mocked.call_args[0][2:4] == (checkpoint, True)
+
+
+def test_migrate_model_cli(model_path, temp_path, micro_bam):
+    runner = CliRunner()
+    result = runner.invoke(migrate_model_cli, [str(model_path),
+                                               str(temp_path)])
+    assert result.exit_code == 0
+    assert is_binary_model(temp_path)
+    out = Path(NamedTemporaryFile(delete=False).name)
+    list_f = write_list([micro_bam])
+    result = runner.invoke(classify_cli, ["-m", str(temp_path), "-l",
+                                          str(list_f), "-o", str(out)])
+    list_f.unlink()
+    assert result.exit_code == 0
+    assert read_output(out)[0][0] == "micro.bam"
+    out.unlink()
+
+
+def test_train_cli_feature_cache(make_dataset_lists, temp_path, labels):
+    pos_list, neg_list = make_dataset_lists
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        args = ["-pl", str(pos_list), "-nl", str(neg_list),
+                "-o", str(temp_path), "--chunksize", 1000,
+                "--feature-cache", "cache", "--feature-cache-size", 5]
+        with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+            mocked_array.return_value = (np.random.rand(20, 500), labels)
+            result = runner.invoke(train_cli, args)
+        assert Path("cache").is_dir()
+    assert result.exit_code == 0
+    cache = mocked_array.call_args[1]["cache"]
+    assert isinstance(cache, FeatureCache)
+    assert cache.max_size == 5 * 1024 * 1024
+
+
+def test_profile_cli(make_dataset_lists):
+    pos_list, _ = make_dataset_lists
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        result = runner.invoke(profile_cli, ["-l", str(pos_list),
+                                             "-o", "profiles"])
+        assert result.exit_code == 0
+        assert Path("profiles/micro.bam.profile.npz").exists()
+
+
+def read_output(path):
+    with path.open("r") as handle:
+        lines = handle.readlines()
+    assert lines[0] == HEADER
+    return [line.split("\t") for line in lines[1:]]
+
+
+def test_classify_cli(model_path, make_dataset_lists, temp_path):
+    pos_list, _ = make_dataset_lists
+    runner = CliRunner()
+    result = runner.invoke(classify_cli, ["-m", str(model_path), "-l",
+                                          str(pos_list), "-o", str(temp_path)])
+    assert result.exit_code == 0
+    rows = read_output(temp_path)
+    assert len(rows) == 1
+    assert rows[0][0] == "micro.bam"
+    assert rows[0][1] in ("pos", "neg", "unknown")
+    assert float(rows[0][3]) + float(rows[0][4]) == pytest.approx(1)
+
+
+def test_classify_cli_stream(model_path, micro_bam, micro_bam2, temp_path):
+    bams = [micro_bam2, micro_bam, micro_bam2]
+    list_f = write_list(bams)
+    runner = CliRunner()
+    args = ["-m", str(model_path), "-l", str(list_f), "-o", str(temp_path),
+            "--stream", "--keep-order", "-j", "2"]
+    result = runner.invoke(classify_cli, args)
+    list_f.unlink()
+    assert result.exit_code == 0
+    rows = read_output(temp_path)
+    assert [row[0] for row in rows] == [x.name for x in bams]
+
+
+def test_classify_cli_resume(model_path, micro_bam, micro_bam2, temp_path):
+    with temp_path.open("w") as handle:
+        handle.write(HEADER)
+        handle.write("micro.bam\tneg\t0.9\t0.1\t0.9\n")
+        handle.write("micro2.bam\tpos\t0.8")  # cut off by a crash
+    list_f = write_list([micro_bam2, micro_bam])
+    runner = CliRunner()
+    args = ["-m", str(model_path), "-l", str(list_f), "-o", str(temp_path),
+            "--resume", "--keep-order"]
+    result = runner.invoke(classify_cli, args)
+    list_f.unlink()
+    assert result.exit_code == 0
+    rows = read_output(temp_path)
+    assert [row[0] for row in rows] == ["micro2.bam", "micro.bam"]
+    # the existing classification is kept
+    assert rows[1] == ["micro.bam", "neg", "0.9", "0.1", "0.9\n"]
+
+
+def test_classify_cli_batch_size(model_path, micro_bam, micro_bam2,
+                                 temp_path):
+    bams = [micro_bam2, micro_bam, micro_bam2]
+    list_f = write_list(bams)
+    runner = CliRunner()
+    args = ["-m", str(model_path), "-l", str(list_f), "-o", str(temp_path),
+            "--batch-size", "2", "-j", "2"]
+    result = runner.invoke(classify_cli, args)
+    assert result.exit_code == 0
+    batched = read_output(temp_path)
+    # rows are in input order, and the same as without batches
+    assert [row[0] for row in batched] == [x.name for x in bams]
+    result = runner.invoke(classify_cli, args[:6])
+    list_f.unlink()
+    assert result.exit_code == 0
+    unbatched = read_output(temp_path)
+    assert [row[:2] for row in unbatched] == [row[:2] for row in batched]
+    # probabilities of other batch sizes may differ in the last digits
+    np.testing.assert_allclose([[float(x) for x in row[2:]]
+                                for row in unbatched],
+                               [[float(x) for x in row[2:]]
+                                for row in batched])
+
+
+def test_extract_and_classify_shards(model_path, micro_bam, micro_bam2,
+                                     temp_path):
+    bams = [micro_bam2, micro_bam, micro_bam2]
+    list_f = write_list(bams)
+    runner = CliRunner()
+    shards = [Path(NamedTemporaryFile(delete=False).name) for _ in range(2)]
+    for index, shard in enumerate(shards, 1):
+        result = runner.invoke(extract_cli, [
+            "-l", str(list_f), "--chunksize", 1000, "-o", str(shard),
+            "--shard", "{0}/2".format(index)])
+        assert result.exit_code == 0
+    args = ["-m", str(model_path), "-o", str(temp_path)]
+    result = runner.invoke(classify_cli, args + sum(
+        (["--shards", str(shard)] for shard in shards), []))
+    assert result.exit_code == 0
+    from_shards = read_output(temp_path)
+    result = runner.invoke(classify_cli, args + ["-l", str(list_f)])
+    assert result.exit_code == 0
+    assert read_output(temp_path) == from_shards
+    # shards are only complete together
+    result = runner.invoke(classify_cli, args + ["--shards", str(shards[0])])
+    assert isinstance(result.exception, ValueError)
+    list_f.unlink()
+    for shard in shards:
+        shard.unlink()
+
+
+def test_extract_cli_bad_shard(micro_bam, temp_path):
+    list_f = write_list([micro_bam])
+    runner = CliRunner()
+    result = runner.invoke(extract_cli, ["-l", str(list_f), "-o",
+                                         str(temp_path), "--shard", "3/2"])
+    list_f.unlink()
+    assert result.exit_code == 2
+
+
+def test_train_cli_shards(temp_path):
+    rng = np.random.RandomState(0)
+    runner = CliRunner()
+    args = ["-o", str(temp_path)]
+    shards = []
+    for option, label in (("-ps", "pos"), ("-ns", "neg")):
+        names = ["{0}{1}.bam".format(label, i) for i in range(10)]
+        shard = Path(NamedTemporaryFile(delete=False).name)
+        FeatureShard(rng.rand(10, 50), names, 1, 1,
+                     list_digest([Path(n) for n in names]), 1000,
+                     "chrM").save(shard)
+        args += [option, str(shard)]
+        shards.append(shard)
+    result = runner.invoke(train_cli, args)
+    assert result.exit_code == 0
+    model = load_sklearn_object_from_disk(temp_path)
+    # the chunksize of the shards, not the default
+    assert model.chunksize_ == 1000
+    result = runner.invoke(train_cli, args[:4])
+    assert isinstance(result.exception, ValueError)
+    for shard in shards:
+        shard.unlink()
+
+
+def test_model_option_callback():
+    assert model_option_callback(None, None, ["a=" + str(_listf),
+                                              str(_listf)]) == {
+        "a": _listf, "test_list": _listf}
+    with pytest.raises(BadParameter):
+        model_option_callback(None, None, ["a=does_not_exist"])
+    with pytest.raises(BadParameter):
+        model_option_callback(None, None, [str(_listf), str(_listf)])
+
+
+def test_cli_import_is_light():
+    code = ("import sys, rna_cd.cli; "
+            "print(' '.join(m for m in ('numpy', 'pysam', 'joblib', "
+            "'sklearn', 'matplotlib') if m in sys.modules))")
+    out = subprocess.check_output([sys.executable, "-c", code])
+    assert out.decode().strip() == ""
@@ -0,0 +1,231 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rna_cd.bam_process import make_array_set
+from rna_cd.dataset import (TrainingDataset, file_identity, is_memory_map,
+                            update_dataset)
+from rna_cd.models import train_svm_model
+
+
+@pytest.fixture
+def bam_dir(micro_bam, micro_bam2) -> Path:
+    """Copies of the test bam files (with index) that can be modified"""
+    with TemporaryDirectory() as tmp:
+        for bam in (micro_bam, micro_bam2):
+            shutil.copy(str(bam), tmp)
+            shutil.copy(str(bam) + ".bai", tmp)
+        yield Path(tmp)
+
+
+def test_dataset_roundtrip(bam_dir):
+    bams = [bam_dir / "micro.bam", bam_dir / "micro2.bam"]
+    dataset = update_dataset(None, bams, ["pos", "neg"], 1000)
+    expected_X, _ = make_array_set(bams, [], 1000)
+    np.testing.assert_array_equal(dataset.arr_X, expected_X)
+    dataset.save(bam_dir / "dataset")
+    loaded = TrainingDataset.load(bam_dir / "dataset")
+    assert is_memory_map(loaded.arr_X)
+    np.testing.assert_array_equal(loaded.arr_X, dataset.arr_X)
+    np.testing.assert_array_equal(loaded.arr_Y, ["pos", "neg"])
+    assert loaded.paths == [os.path.realpath(str(bam)) for bam in bams]
+    assert loaded.versions == dataset.versions
+    assert loaded.chunksize == 1000
+    assert loaded.contig == "chrM"
+
+
+def test_dataset_reuses_features(bam_dir):
+    micro, micro2 = bam_dir / "micro.bam", bam_dir / "micro2.bam"
+    dataset = update_dataset(None, [micro], ["pos"], 1000)
+    with mock.patch("rna_cd.dataset.make_array_set",
+                    wraps=make_array_set) as mocked_array:
+        result = update_dataset(dataset, [micro2, micro], ["neg", "neg"],
+                                1000)
+    # only the new file is processed
+    assert mocked_array.call_args[0][0] == [micro2]
+    np.testing.assert_array_equal(result.arr_X[1], dataset.arr_X[0])
+    np.testing.assert_array_equal(result.arr_Y, ["neg", "neg"])
+
+
+def test_dataset_changed_and_removed_files(bam_dir):
+    micro, micro2 = bam_dir / "micro.bam", bam_dir / "micro2.bam"
+    dataset = update_dataset(None, [micro, micro2], ["pos", "neg"], 1000)
+    stat = micro.stat()
+    os.utime(str(micro), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with mock.patch("rna_cd.dataset.make_array_set",
+                    wraps=make_array_set) as mocked_array:
+        result = update_dataset(dataset, [micro], ["pos"], 1000)
+    assert mocked_array.call_args[0][0] == [micro]
+    assert len(result) == 1
+    assert result.versions == [file_identity(micro)[1]]
+
+
+def test_dataset_other_chunksize(bam_dir):
+    micro = bam_dir / "micro.bam"
+    dataset = update_dataset(None, [micro], ["pos"], 1000)
+    result = update_dataset(dataset, [micro], ["pos"], 500)
+    assert result.arr_X.shape[1] > dataset.arr_X.shape[1]
+
+
+def test_dataset_symlink_once(bam_dir):
+    micro = bam_dir / "micro.bam"
+    link = bam_dir / "link.bam"
+    link.symlink_to(micro)
+    with pytest.raises(ValueError):
+        update_dataset(None, [micro, link], ["pos", "neg"], 1000)
+
+
+def make_dataset(n_files, n_features=5, dtype=np.float64):
+    return TrainingDataset(
+        np.arange(n_files * n_features, dtype=dtype).reshape(n_files, -1),
+        np.array(["pos", "neg"] * (n_files // 2)),
+        ["/{0}.bam".format(i) for i in range(n_files)],
+        ["0:0:{0}".format(i) for i in range(n_files)], 1000, "chrM")
+
+
+def test_dataset_float32(bam_dir):
+    make_dataset(4).save(bam_dir / "dataset", "float32")
+    loaded = TrainingDataset.load(bam_dir / "dataset")
+    assert loaded.arr_X.dtype == np.float32
+    np.testing.assert_array_equal(loaded.arr_X, make_dataset(4).arr_X)
+    with pytest.raises(ValueError):
+        make_dataset(4).save(bam_dir / "other", "int64")
+
+
+def test_dataset_slicing():
+    dataset = make_dataset(6)
+    view = dataset[2:4]
+    assert view.paths == ["/2.bam", "/3.bam"]
+    assert np.shares_memory(view.arr_X, dataset.arr_X)
+    selection = dataset[[5, 0]]
+    assert selection.versions == ["0:0:5", "0:0:0"]
+    np.testing.assert_array_equal(selection.arr_Y, ["neg", "pos"])
+    np.testing.assert_array_equal(selection.arr_X[1], dataset.arr_X[0])
+
+
+def test_dataset_append(bam_dir):
+    path = bam_dir / "dataset"
+    make_dataset(6)[:4].save(path, "float32")
+    loaded = TrainingDataset.load(path)
+    # rows of an interrupted append are overwritten
+    with (path / "features.bin").open("ab") as handle:
+        handle.write(b"\0" * 7)
+    rest = make_dataset(6)[4:]
+    loaded.append(rest.arr_X, rest.arr_Y, rest.paths, rest.versions)
+    assert len(loaded) == 6 and is_memory_map(loaded.arr_X)
+    reloaded = TrainingDataset.load(path)
+    np.testing.assert_array_equal(reloaded.arr_X, make_dataset(6).arr_X)
+    assert reloaded.paths == make_dataset(6).paths
+    with pytest.raises(ValueError):
+        loaded.append(np.zeros((1, 3)), ["pos"], ["/x.bam"], ["0:0:0"])
+    with pytest.raises(ValueError):
+        rest.append(rest.arr_X, rest.arr_Y, rest.paths, rest.versions)
+
+
+def test_dataset_update_on_disk(bam_dir):
+    micro, micro2 = bam_dir / "micro.bam", bam_dir / "micro2.bam"
+    path = bam_dir / "dataset"
+    update_dataset(None, [micro], ["pos"], 1000).save(path)
+    with mock.patch("rna_cd.dataset.make_array_set",
+                    wraps=make_array_set) as mocked_array:
+        result = update_dataset(TrainingDataset.load(path), [micro, micro2],
+                                ["neg", "neg"], 1000)
+    assert mocked_array.call_args[0][0] == [micro2]
+    # the new file is appended on disk, and the features stay mapped
+    assert result.path == path and is_memory_map(result.arr_X)
+    loaded = TrainingDataset.load(path)
+    assert len(loaded) == 2
+    np.testing.assert_array_equal(loaded.arr_Y, ["neg", "neg"])
+    expected_X = np.array(loaded.arr_X)
+    # another order is rewritten on disk, and stays mapped
+    with mock.patch("rna_cd.dataset._WRITE_BATCH_SIZE", 1):
+        result = update_dataset(loaded, [micro2, micro], ["neg", "pos"],
+                                1000)
+    assert result.path == path and is_memory_map(result.arr_X)
+    np.testing.assert_array_equal(result.arr_X, expected_X[::-1])
+    assert list(result.arr_Y) == ["neg", "pos"]
+    reloaded = TrainingDataset.load(path)
+    np.testing.assert_array_equal(reloaded.arr_X, expected_X[::-1])
+    assert list(reloaded.arr_Y) == ["neg", "pos"]
+    # labels of this run replace the stored labels of the files
+    result = update_dataset(reloaded, [micro2], ["pos"], 1000)
+    assert is_memory_map(result.arr_X) and list(result.arr_Y) == ["pos"]
+    result = update_dataset(result, [micro2, micro], ["pos", "pos"], 1000)
+    assert result.path == path and list(result.arr_Y) == ["pos", "pos"]
+    assert list(TrainingDataset.load(path).arr_Y) == ["pos", "pos"]
+
+
+def test_dataset_load_errors(temp_path, bam_dir):
+    with pytest.raises(ValueError):
+        TrainingDataset.load(temp_path)
+    make_dataset(2).save(bam_dir / "dataset")
+    with (bam_dir / "dataset" / "meta.json").open("w") as handle:
+        handle.write('{"version": 1}')
+    with pytest.raises(ValueError):
+        TrainingDataset.load(bam_dir / "dataset")
+
+
+def test_train_model_dataset(bam_dir):
+    micro, micro2 = bam_dir / "micro.bam", bam_dir / "micro2.bam"
+    dataset_path = bam_dir / "dataset"
+    features = np.random.rand(20, 51)
+    labels = ["pos"] * 10 + ["neg"] * 10
+    with mock.patch("rna_cd.models.update_dataset") as mocked:
+        mocked.return_value = TrainingDataset(
+            features, np.array(labels), [str(i) for i in range(20)],
+            ["0:0:0"] * 20, 1000, "chrM")
+        train_svm_model([micro], [micro2], chunksize=1000,
+                        dataset=dataset_path)
+    assert mocked.call_args[0][0] is None
+    with mock.patch("rna_cd.models.update_dataset",
+                    wraps=update_dataset) as mocked, \
+            mock.patch("rna_cd.models.grid_search"):
+        train_svm_model([micro], [micro2], chunksize=1000,
+                        dataset=dataset_path)
+    # the second run starts from the saved dataset, to which the files
+    # are appended, and which is then reduced to the files of this run
+    assert len(mocked.call_args[0][0]) == 22
+    assert len(TrainingDataset.load(dataset_path)) == 2
+
+
+def test_train_model_dataset_memory_map(bam_dir):
+    micro, micro2 = bam_dir / "micro.bam", bam_dir / "micro2.bam"
+    dataset_path = bam_dir / "dataset"
+    make_dataset(2).save(dataset_path)
+    with mock.patch("rna_cd.models.update_dataset") as mocked, \
+            mock.patch("rna_cd.models.grid_search") as mocked_search:
+        mocked.return_value = TrainingDataset.load(dataset_path)
+        train_svm_model([micro], [micro2], chunksize=1000,
+                        dataset=dataset_path)
+    # the search reads the features from the dataset on disk
+    assert is_memory_map(mocked_search.call_args[0][0])
+
+
+def test_train_model_dataset_chunksizes(dataset, temp_path):
+    positives, negatives = dataset
+    with pytest.raises(ValueError):
+        train_svm_model(positives, negatives, chunksize=[100, 1000],
+                        dataset=temp_path)
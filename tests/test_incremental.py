@@ -0,0 +1,203 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pickle
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import numpy as np
+import pytest
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+from rna_cd.dataset import TrainingDataset
+from rna_cd.incremental import (fit_transformers, incremental_search,
+                                iter_batches, transform_batches,
+                                write_feature_store)
+from rna_cd.models import (make_param_grid, make_pipeline,
+                           predict_labels_and_prob, train_svm_model)
+
+
+@pytest.fixture
+def features():
+    rng = np.random.RandomState(0)
+    arr_X = rng.rand(60, 40)
+    arr_Y = np.array(["pos", "neg"] * 30)
+    arr_X[arr_Y == "pos", :5] += 0.5
+    return arr_X, arr_Y
+
+
+def completed_out_of_order(arr_X):
+    """iter_features replacement that yields the rows of arr_X in reverse"""
+    def iter_features(bam_files, *args):
+        for index in reversed(range(len(bam_files))):
+            yield index, arr_X[index]
+    return iter_features
+
+
+def test_iter_batches():
+    arr = np.arange(25)
+    assert [len(b) for b in iter_batches(arr, 10)] == [10, 10, 5]
+    # a last batch that is too small is merged with the one before
+    assert [len(b) for b in iter_batches(arr, 10, 6)] == [10, 15]
+
+
+def test_iter_batches_memory_map(features):
+    arr_X, _ = features
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp) / "features.bin"
+        arr_X.tofile(str(path))
+        arr_map = np.memmap(str(path), dtype=arr_X.dtype, mode="r",
+                            shape=arr_X.shape)
+        batches = list(iter_batches(arr_map, 25))
+        del arr_map
+    assert not any(isinstance(batch, np.memmap) for batch in batches)
+    np.testing.assert_array_equal(np.concatenate(batches), arr_X)
+
+
+def test_write_feature_store(features):
+    arr_X, _ = features
+    bams = [Path("{0}.bam".format(i)) for i in range(len(arr_X))]
+    scaler = StandardScaler()
+    with TemporaryDirectory() as tmp, \
+            mock.patch("rna_cd.incremental.iter_features",
+                       completed_out_of_order(arr_X)):
+        store = write_feature_store(bams, Path(tmp) / "features.npy",
+                                    batch_size=7, scaler=scaler)
+        np.testing.assert_array_equal(store, arr_X)
+        del store
+    expected = StandardScaler().fit(arr_X)
+    np.testing.assert_allclose(scaler.mean_, expected.mean_)
+    np.testing.assert_allclose(scaler.scale_, expected.scale_)
+
+
+def test_fit_transformers(features):
+    arr_X, _ = features
+    # a single batch is the same as a PCA
+    transformers = fit_transformers(arr_X, 10, batch_size=60)
+    expected = PCA(10).fit(StandardScaler().fit_transform(arr_X))
+    np.testing.assert_allclose(
+        transformers.named_steps["reduce_dim"].explained_variance_,
+        expected.explained_variance_)
+    batched = fit_transformers(arr_X, 10, batch_size=15)
+    assert transform_batches(batched, arr_X, 8).shape == (60, 10)
+
+
+def test_fit_transformers_error(features):
+    arr_X, _ = features
+    with pytest.raises(ValueError):
+        fit_transformers(arr_X, 10, batch_size=5)
+
+
+def test_incremental_search(features):
+    arr_X, arr_Y = features
+    grid = make_param_grid(arr_X)
+    searcher = incremental_search(
+        arr_X, arr_Y, grid, make_pipeline().named_steps["svm"],
+        n_components=10, batch_size=20, cv=3, calibrate=True)
+    # only the svm is searched
+    assert len(searcher.cv_results_["params"]) == 16
+    assert sorted(searcher.best_estimator_.named_steps.keys()) == sorted(
+        ["scale", "reduce_dim", "svm"])
+    proba = searcher.predict_proba(arr_X)
+    assert proba.shape == (60, 2)
+    assert np.mean(searcher.predict(arr_X) == arr_Y) > 0.8
+
+
+def test_incremental_search_folds(features):
+    arr_X, arr_Y = features
+    grid = make_param_grid(arr_X)
+    with mock.patch("rna_cd.search.fit_transformers",
+                    wraps=fit_transformers) as mocked_fit:
+        searcher = incremental_search(
+            arr_X, arr_Y, grid, make_pipeline().named_steps["svm"],
+            n_components=10, batch_size=20, cv=3)
+    fitted_rows = [sorted(call[0][4]) for call in mocked_fit.call_args_list]
+    # the transformers of every fold are fitted on its training rows only,
+    # and once more on all rows for the best pipeline
+    assert len(fitted_rows) == 4
+    assert all(len(rows) == 40 for rows in fitted_rows[:3])
+    assert fitted_rows[3] == list(range(60))
+    test_rows = [set(range(60)) - set(rows) for rows in fitted_rows[:3]]
+    assert set().union(*test_rows) == set(range(60))
+    # the search does not keep the features
+    assert b"SharedFeatures" not in pickle.dumps(searcher)
+    assert searcher.predict(arr_X).shape == (60,)
+
+
+def test_incremental_search_halving(features):
+    arr_X, arr_Y = features
+    searcher = incremental_search(
+        arr_X, arr_Y, make_param_grid(arr_X),
+        make_pipeline().named_steps["svm"], n_components=30, batch_size=30,
+        cv=3, search="halving", factor=2, calibrate=True)
+    # early rounds have fewer training rows than components
+    assert searcher.n_resources_[0] < 30
+    assert searcher.predict_proba(arr_X).shape == (60, 2)
+    assert b"SharedFeatures" not in pickle.dumps(searcher)
+
+
+def test_incremental_search_batch_size(features):
+    arr_X, arr_Y = features
+    with pytest.raises(ValueError):
+        incremental_search(arr_X, arr_Y, make_param_grid(arr_X),
+                           make_pipeline().named_steps["svm"],
+                           n_components=10, batch_size=5)
+
+
+def test_train_model_out_of_core(features):
+    arr_X, arr_Y = features
+    positives = [Path("pos{0}.bam".format(i)) for i in range(30)]
+    negatives = [Path("neg{0}.bam".format(i)) for i in range(30)]
+    # the order of the labels of train_svm_model
+    arr_X = np.concatenate([arr_X[arr_Y == "pos"], arr_X[arr_Y == "neg"]])
+    with mock.patch("rna_cd.incremental.iter_features",
+                    completed_out_of_order(arr_X)):
+        searcher = train_svm_model(positives, negatives, chunksize=1000,
+                                   out_of_core=True, n_components=10,
+                                   batch_size=20)
+    with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_array.return_value = (arr_X, [])
+        predictions = predict_labels_and_prob(searcher, positives,
+                                              unknown_threshold=0.51)
+    assert len(predictions) == 60
+    assert np.mean([p.prediction.value == "pos"
+                    for p in predictions[:30]]) > 0.8
+
+
+def test_train_model_out_of_core_dataset(features):
+    arr_X, arr_Y = features
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp) / "dataset"
+        TrainingDataset(arr_X, arr_Y, [str(i) for i in range(60)],
+                        ["0:0:0"] * 60, 1000, "chrM").save(path)
+        with mock.patch("rna_cd.models.update_dataset") as mocked:
+            mocked.return_value = TrainingDataset.load(path)
+            searcher = train_svm_model(
+                [Path("pos.bam")], [Path("neg.bam")], chunksize=1000,
+                dataset=path, out_of_core=True, n_components=10,
+                batch_size=20)
+    assert np.mean(searcher.predict(arr_X) == arr_Y) > 0.8
+
+
+def test_train_model_out_of_core_chunksizes(dataset):
+    positives, negatives = dataset
+    with pytest.raises(ValueError):
+        train_svm_model(positives, negatives, chunksize=[100, 1000],
+                        out_of_core=True)
@@ -16,13 +16,18 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+from pathlib import Path
+
 import pytest
 import magic
 
 from unittest import mock
 import numpy as np
+from sklearn.decomposition import PCA
 
 import rna_cd.models
+from rna_cd.utils import (load_sklearn_object_from_disk,
+                          save_sklearn_object_to_disk)
 
 
 predict_error_data = [-0.5, 0, 1.0, 50]
@@ -47,6 +52,63 @@ def test_train_model(dataset, labels):
     assert sorted(steps) == sorted(["scale", "reduce_dim", "svm"])
 
 
+@pytest.mark.parametrize("backend", ["linear", "nystroem", "fourier"])
+def test_train_model_backends(dataset, temp_path, backend):
+    positives, negatives = dataset
+    # a weak signal in the first features
+    arr_X = np.random.rand(30, 50)
+    arr_X[:15, :5] += 0.5
+    labels = np.array(["pos"]*15 + ["neg"]*15)
+    with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_array.return_value = (arr_X, labels)
+        result = rna_cd.models.train_svm_model(positives, negatives,
+                                               chunksize=1000,
+                                               backend=backend)
+    assert sorted(result.best_estimator_.named_steps.keys()) == sorted(
+        ["scale", "reduce_dim", "svm"])
+    save_sklearn_object_to_disk(result, temp_path, binary=True)
+    loaded = load_sklearn_object_from_disk(temp_path)
+    with mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_array.return_value = (arr_X, [])
+        predictions = rna_cd.models.predict_labels_and_prob(
+            loaded, positives, chunksize=1000, unknown_threshold=0.51)
+    assert len(predictions) == 30
+    for prediction in predictions:
+        assert prediction.pos_prob + prediction.neg_prob == pytest.approx(1)
+
+
+def test_train_model_backend_error(dataset):
+    positives, negatives = dataset
+    with pytest.raises(ValueError):
+        rna_cd.models.train_svm_model(positives, negatives, backend="knn")
+
+
+def test_make_param_grid_backends():
+    arr_X = np.random.rand(30, 500)
+    for backend in rna_cd.models.BACKENDS:
+        pipeline = rna_cd.models.make_pipeline(backend)
+        grid = rna_cd.models.make_param_grid(arr_X, backend=backend)
+        # every parameter of the grid exists in the pipeline
+        pipeline.set_params(**{k: v[0] for k, v in grid.items()})
+
+
+def test_train_model_chunksizes():
+    positives = [Path("pos{0}.bam".format(i)) for i in range(10)]
+    negatives = [Path("neg{0}.bam".format(i)) for i in range(10)]
+    # 20 random profiles of a contig of 1000 bases
+    profiles = [np.random.randint(1, 100, size=(5, 1001))
+                for _ in range(20)]
+    with mock.patch("rna_cd.models.make_profile_set") as mocked_profiles, \
+            mock.patch("rna_cd.models.make_array_set") as mocked_array:
+        mocked_profiles.return_value = profiles
+        result = rna_cd.models.train_svm_model(positives, negatives,
+                                               chunksize=[250, 500])
+    assert mocked_profiles.call_count == 1
+    assert mocked_array.call_count == 0
+    assert result.chunksize_ in (250, 500)
+    assert result.contig_ == "chrM"
+
+
 def test_train_model_error():
     with pytest.raises(ValueError) as excinfo:
         rna_cd.models.train_svm_model([], [])
@@ -82,6 +144,76 @@ def test_train_model_image(dataset, temp_path, labels):
     assert mimetype == "image/png"
 
 
+def test_plot_pca_batches(temp_path, labels):
+    arr_X = np.random.rand(20, 50)
+    pca = PCA(2).fit(arr_X)
+    searcher = mock.Mock()
+    searcher.best_estimator_.named_steps = {"reduce_dim": pca}
+    with mock.patch("rna_cd.models.transform_batches",
+                    wraps=rna_cd.models.transform_batches) as mocked:
+        rna_cd.models.plot_pca(searcher, arr_X, labels, temp_path,
+                               batch_size=3)
+    # only the projections of the samples are in memory at once
+    pos_rows, neg_rows = [call[0][3] for call in mocked.call_args_list]
+    assert list(pos_rows) == list(range(10))
+    assert list(neg_rows) == list(range(10, 20))
+    assert magic.from_file(str(temp_path), mime=True) == "image/png"
+
+
+def test_make_warm_start_grid():
+    grid = rna_cd.models.make_param_grid(np.random.rand(30, 500))
+    best_params = {"reduce_dim__n_components": 4, "reduce_dim__whiten": True,
+                   "svm__gamma": 0.01, "svm__shrinking": False,
+                   "svm__probability": True}
+    result = rna_cd.models.make_warm_start_grid(grid, best_params)
+    assert result["reduce_dim__n_components"] == list(range(2, 10))
+    assert result["reduce_dim__whiten"] == [False, True]
+    assert result["svm__gamma"] == [0.001, 0.01, 0.1]
+    assert result["svm__shrinking"] == [False]
+    # parameters of old models that are no longer searched are ignored
+    assert "svm__probability" not in result
+
+
+def test_make_warm_start_grid_limits():
+    grid = rna_cd.models.make_param_grid(np.random.rand(30, 500))
+    best_params = {"reduce_dim__n_components": 100, "svm__gamma": 1000}
+    result = rna_cd.models.make_warm_start_grid(grid, best_params)
+    assert result["reduce_dim__n_components"] == [19]
+    assert result["svm__gamma"] == [100, 1000]
+    assert result["svm__shrinking"] == [True, False]
+
+
+def test_make_warm_start_grid_regularization():
+    grid = rna_cd.models.make_param_grid(np.random.rand(30, 500),
+                                         backend="nystroem")
+    best_params = {"svm__kernel_map__gamma": 0.1,
+                   "svm__linear__C": 0.01}
+    result = rna_cd.models.make_warm_start_grid(grid, best_params)
+    assert result["svm__kernel_map__gamma"] == [0.01, 0.1, 1]
+    assert result["svm__linear__C"] == [0.01, 0.1]
+
+
+@pytest.mark.parametrize("classes", [["neg", "pos"], ["pos", "neg"]])
+def test_prediction_batch(classes):
+    model = mock.Mock(classes_=np.array(classes))
+    rng = np.random.RandomState(0)
+    first = rng.rand(100)
+    proba = np.column_stack([first, 1 - first])
+    proba[0] = [0.5, 0.5]  # a tie
+    batch = rna_cd.models.PredictionBatch.from_model_proba(model, proba,
+                                                           0.75)
+    assert len(batch) == 100
+    for prediction, sample in zip(batch, proba):
+        expected = rna_cd.models.Prediction.from_model_proba(model, sample,
+                                                             0.75)
+        assert prediction.prediction == expected.prediction
+        assert prediction.most_likely_prob == expected.most_likely_prob
+        assert prediction.pos_prob == expected.pos_prob
+        assert prediction.neg_prob == expected.neg_prob
+    assert len(batch[10:20]) == 10
+    assert batch[10:20][0].pos_prob == batch[10].pos_prob
+
+
 @pytest.mark.parametrize("value", predict_error_data)
 def test_predict_classes_errors(value):
     with pytest.raises(ValueError) as excinfo:
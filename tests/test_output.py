@@ -0,0 +1,71 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+from rna_cd.models import Prediction, PredictionBatch, PredClass
+from rna_cd.output import (HEADER, format_row, format_rows, classified_names,
+                           open_for_append, write_row, reorder_output)
+
+
+def make_prediction():
+    return Prediction(PredClass.positive, 0.8, 0.8, 0.2)
+
+
+def test_format_row():
+    assert format_row("a.bam", make_prediction()) == \
+        "a.bam\tpos\t0.8\t0.8\t0.2\n"
+
+
+def test_format_rows():
+    batch = PredictionBatch(np.array(["pos", "unknown"]), np.array([0.8, 0.6]),
+                            np.array([0.8, 0.4]), np.array([0.2, 0.6]))
+    assert format_rows(["a.bam", "b.bam"], batch) == (
+        format_row("a.bam", batch[0]) + format_row("b.bam", batch[1]))
+    assert format_rows(["a.bam", "b.bam"], batch) == (
+        "a.bam\tpos\t0.8\t0.8\t0.2\nb.bam\tunknown\t0.6\t0.4\t0.6\n")
+
+
+def test_classified_names_missing(temp_path):
+    temp_path.unlink()
+    assert classified_names(temp_path) == set()
+    temp_path.touch()  # for teardown
+
+
+def test_open_for_append(temp_path):
+    with open_for_append(temp_path) as handle:
+        write_row(handle, "a.bam", make_prediction())
+    with temp_path.open("a") as handle:
+        handle.write("b.bam\tneg")  # incomplete row
+    assert classified_names(temp_path) == {"a.bam"}
+    with open_for_append(temp_path) as handle:
+        write_row(handle, "c.bam", make_prediction())
+    with temp_path.open("r") as handle:
+        assert handle.read() == (HEADER + format_row("a.bam",
+                                                     make_prediction()) +
+                                 format_row("c.bam", make_prediction()))
+
+
+def test_reorder_output(temp_path):
+    with open_for_append(temp_path) as handle:
+        for name in ("c.bam", "a.bam", "x.bam", "b.bam", "a.bam"):
+            write_row(handle, name, make_prediction())
+    reorder_output(temp_path, ["a.bam", "b.bam", "a.bam", "c.bam"])
+    assert [x.split("\t")[0] for x in
+            temp_path.read_text().splitlines()[1:]] == [
+        "a.bam", "b.bam", "a.bam", "c.bam", "x.bam"]
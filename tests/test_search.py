@@ -0,0 +1,217 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import pytest
+from sklearn.decomposition import PCA
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from rna_cd.search import PipelineSearch, decompose_fold, slice_components
+
+
+class CountingPCA(PCA):
+    fits = 0
+
+    def fit_transform(self, X, y=None):
+        CountingPCA.fits += 1
+        return super().fit_transform(X, y)
+
+    def fit(self, X, y=None):
+        CountingPCA.fits += 1
+        return super().fit(X, y)
+
+
+@pytest.fixture
+def features():
+    rng = np.random.RandomState(0)
+    arr_X = rng.rand(30, 40)
+    arr_Y = np.array(["pos", "neg"] * 15)
+    arr_X[arr_Y == "pos", :5] += 0.5
+    return arr_X, arr_Y
+
+
+@pytest.fixture
+def pipeline():
+    return Pipeline([("scale", StandardScaler()),
+                     ("reduce_dim", PCA()),
+                     ("svm", SVC())])
+
+
+param_grid = {
+    "reduce_dim__n_components": [2, 5, 10],
+    "reduce_dim__whiten": [False, True],
+    "svm__gamma": [0.1, 0.01, 1],
+    "svm__shrinking": [True, False]
+}
+
+
+def test_search_same_as_grid_search(features, pipeline):
+    arr_X, arr_Y = features
+    expected = GridSearchCV(pipeline, param_grid, cv=3,
+                            scoring="accuracy").fit(arr_X, arr_Y)
+    result = PipelineSearch(pipeline, param_grid, cv=3).fit(arr_X, arr_Y)
+    assert result.best_params_ == expected.best_params_
+    assert result.best_score_ == expected.best_score_
+    assert result.best_index_ == expected.best_index_
+    for key in ("mean_test_score", "rank_test_score", "split0_test_score"):
+        np.testing.assert_array_equal(result.cv_results_[key],
+                                      expected.cv_results_[key])
+    np.testing.assert_array_equal(result.predict(arr_X),
+                                  expected.predict(arr_X))
+    np.testing.assert_array_equal(result.classes_, expected.classes_)
+
+
+def test_search_fits_transformers_once(features):
+    arr_X, arr_Y = features
+    pipeline = Pipeline([("scale", StandardScaler()),
+                         ("reduce_dim", CountingPCA()),
+                         ("svm", SVC())])
+    CountingPCA.fits = 0
+    PipelineSearch(pipeline, param_grid, cv=3).fit(arr_X, arr_Y)
+    # one decomposition per fold for all components and whitening,
+    # and the refit
+    assert CountingPCA.fits == 3 + 1
+
+
+def test_search_unsliced_same_as_grid_search(features, pipeline):
+    arr_X, arr_Y = features
+    # fractions of explained variance can not be sliced
+    grid = dict(param_grid, reduce_dim__n_components=[0.5, 0.9])
+    expected = GridSearchCV(pipeline, grid, cv=3,
+                            scoring="accuracy").fit(arr_X, arr_Y)
+    result = PipelineSearch(pipeline, grid, cv=3).fit(arr_X, arr_Y)
+    assert result.best_params_ == expected.best_params_
+    np.testing.assert_array_equal(result.cv_results_["mean_test_score"],
+                                  expected.cv_results_["mean_test_score"])
+
+
+@pytest.mark.parametrize("n_components", [1, 4, 15])
+@pytest.mark.parametrize("whiten", [False, True])
+def test_slice_components(features, n_components, whiten):
+    arr_X, arr_Y = features
+    train, test = np.arange(20), np.arange(20, 30)
+    transformers = Pipeline([("scale", StandardScaler()),
+                             ("reduce_dim", PCA())])
+    X_train, X_test, variance = decompose_fold(transformers, 15, arr_X,
+                                               arr_Y, train, test)
+    expected = Pipeline([
+        ("scale", StandardScaler()),
+        ("reduce_dim", PCA(n_components=n_components, whiten=whiten,
+                           svd_solver="full"))
+    ]).fit(arr_X[train])
+    # components are only defined up to their sign
+    np.testing.assert_allclose(
+        np.abs(slice_components(X_test, variance, n_components, whiten)),
+        np.abs(expected.transform(arr_X[test])), rtol=1e-7, atol=1e-10)
+    np.testing.assert_allclose(
+        np.abs(slice_components(X_train, variance, n_components, whiten)),
+        np.abs(expected.transform(arr_X[train])), rtol=1e-7, atol=1e-10)
+
+
+def test_search_parallel(features, pipeline):
+    arr_X, arr_Y = features
+    single = PipelineSearch(pipeline, param_grid, cv=3).fit(arr_X, arr_Y)
+    parallel = PipelineSearch(pipeline, param_grid, cv=3,
+                              n_jobs=2).fit(arr_X, arr_Y)
+    np.testing.assert_array_equal(single.cv_results_["mean_test_score"],
+                                  parallel.cv_results_["mean_test_score"])
+
+
+def test_search_precomputed_kernel(features, pipeline):
+    arr_X, arr_Y = features
+    grid = dict(param_grid, svm__kernel=["rbf", "linear"])
+    expected = PipelineSearch(pipeline, grid, cv=3).fit(arr_X, arr_Y)
+    result = PipelineSearch(pipeline, grid, cv=3,
+                            precompute_kernel=True).fit(arr_X, arr_Y)
+    np.testing.assert_array_equal(result.cv_results_["mean_test_score"],
+                                  expected.cv_results_["mean_test_score"])
+    assert result.best_params_ == expected.best_params_
+    # the refitted model does not need precomputed kernels
+    assert result.best_estimator_.named_steps["svm"].kernel != "precomputed"
+    np.testing.assert_array_equal(result.predict(arr_X),
+                                  expected.predict(arr_X))
+
+
+def test_search_calibrate(features, pipeline):
+    arr_X, arr_Y = features
+    result = PipelineSearch(pipeline, param_grid, cv=3,
+                            calibrate=True).fit(arr_X, arr_Y)
+    # candidates and the best pipeline do not compute probabilities
+    assert result.best_estimator_.named_steps["svm"].probability is not True
+    proba = result.predict_proba(arr_X)
+    assert proba.shape == (30, 2)
+    np.testing.assert_allclose(proba.sum(axis=1), 1)
+    np.testing.assert_array_equal(result.classes_,
+                                  result.calibrated_.classes_)
+    # the best pipeline is the one that is calibrated
+    np.testing.assert_array_equal(
+        result.calibrated_.calibrated_classifiers_[0].estimator.predict(
+            arr_X), result.predict(arr_X))
+
+
+@pytest.fixture
+def more_features():
+    rng = np.random.RandomState(1)
+    arr_X = rng.rand(90, 40)
+    arr_Y = np.array(["pos", "neg"] * 45)
+    arr_X[arr_Y == "pos", :5] += 0.5
+    return arr_X, arr_Y
+
+
+def test_search_random(features, pipeline):
+    arr_X, arr_Y = features
+    result = PipelineSearch(pipeline, param_grid, cv=3, search="random",
+                            n_candidates=5, random_state=0).fit(arr_X, arr_Y)
+    assert len(result.cv_results_["params"]) == 5
+    assert not np.isnan(result.cv_results_["mean_test_score"]).any()
+    assert result.best_params_ in result.cv_results_["params"]
+
+
+def test_search_halving(more_features, pipeline):
+    arr_X, arr_Y = more_features
+    grid = dict(param_grid, reduce_dim__n_components=[2, 5, 10, 30])
+    result = PipelineSearch(pipeline, grid, cv=3, search="halving",
+                            random_state=0).fit(arr_X, arr_Y)
+    assert result.n_resources_ == [30, 90]
+    assert result.n_candidates_[0] == 48
+    assert result.n_candidates_[1] == 16
+    assert not np.isnan(result.cv_results_["mean_test_score"]).any()
+
+
+def test_search_time_budget(features, pipeline):
+    arr_X, arr_Y = features
+    result = PipelineSearch(pipeline, param_grid, cv=3,
+                            time_budget=1e-9).fit(arr_X, arr_Y)
+    assert result.stopped_early_
+    mean_scores = result.cv_results_["mean_test_score"]
+    assert 1 <= np.sum(~np.isnan(mean_scores)) < len(mean_scores)
+    assert result.best_score_ == np.nanmax(mean_scores)
+    assert result.cv_results_["rank_test_score"][np.isnan(
+        mean_scores)].min() > 1
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(search="grid"), dict(n_candidates=0), dict(factor=1),
+    dict(time_budget=0)
+])
+def test_search_errors(pipeline, kwargs):
+    with pytest.raises(ValueError):
+        PipelineSearch(pipeline, param_grid, **kwargs)
@@ -0,0 +1,120 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from click.testing import CliRunner
+import pytest
+
+from rna_cd.client import client_cli, connect, classify_remote, server_health
+from rna_cd.output import HEADER
+from rna_cd.server import (ClassificationService, QueueFullError,
+                           make_server)
+
+
+@pytest.fixture(scope="module")
+def service(trained_model):
+    service = ClassificationService({"random": (trained_model, 1000)},
+                                    cores=2, max_queue=4)
+    yield service
+    service.close()
+
+
+@pytest.fixture(scope="module")
+def server_url(service):
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://{0}:{1}".format(*server.server_address)
+    server.shutdown()
+    server.server_close()
+
+
+def test_health(server_url):
+    health = server_health(connect(server_url))
+    assert health["status"] == "ok"
+    assert health["models"] == {"random": {"chunksize": 1000}}
+    assert health["pending"] == 0
+
+
+def test_classify(server_url, micro_bam):
+    row = classify_remote(connect(server_url), micro_bam)
+    fields = row.rstrip("\n").split("\t")
+    assert fields[0] == "micro.bam"
+    assert fields[1] in ("pos", "neg", "unknown")
+    assert len(fields) == 5
+
+
+def test_classify_concurrent(server_url, micro_bam, micro_bam2):
+    rows = []
+
+    def classify(bam):
+        rows.append(classify_remote(connect(server_url), bam, "random"))
+
+    threads = [threading.Thread(target=classify, args=(bam,))
+               for bam in (micro_bam, micro_bam2, micro_bam, micro_bam2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(row.split("\t")[0] for row in rows) == [
+        "micro.bam", "micro.bam", "micro2.bam", "micro2.bam"]
+
+
+def test_classify_errors(server_url, micro_bam):
+    with pytest.raises(ValueError) as excinfo:
+        classify_remote(connect(server_url), micro_bam, "other")
+    assert "Unknown model other" in str(excinfo.value)
+    with pytest.raises(ValueError) as excinfo:
+        classify_remote(connect(server_url), micro_bam,
+                        unknown_threshold=2)
+    assert "unknown_threshold" in str(excinfo.value)
+
+
+def test_queue_full(service, micro_bam):
+    for _ in range(service.max_queue):
+        service._slots.acquire()
+    try:
+        with pytest.raises(QueueFullError):
+            service.classify(micro_bam.resolve())
+    finally:
+        for _ in range(service.max_queue):
+            service._slots.release()
+
+
+def test_unix_socket(service, micro_bam):
+    with TemporaryDirectory() as tmp:
+        socket_path = Path(tmp) / "rna_cd.sock"
+        server = make_server(service, socket_path=socket_path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            runner = CliRunner()
+            result = runner.invoke(client_cli, ["-s", str(socket_path),
+                                                "--header", str(micro_bam)])
+        finally:
+            server.shutdown()
+            server.server_close()
+    assert result.exit_code == 0
+    # output is mixed with the log messages of the server in this process
+    lines = result.output.splitlines(keepends=True)
+    assert HEADER in lines
+    assert any(line.startswith("micro.bam\t")
+               for line in lines[lines.index(HEADER):])
@@ -0,0 +1,120 @@
+"""
+Copyright (C) 2018-2019  Leiden University Medical Center
+
+This file is part of rna_cd
+
+rna_cd is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+
+from rna_cd.bam_process import make_array_set
+from rna_cd.shards import (FeatureShard, extract_shard, gather_shards,
+                           list_digest, parse_shard, shard_slice)
+
+
+@pytest.fixture
+def shard_dir():
+    with TemporaryDirectory() as tmp:
+        yield Path(tmp)
+
+
+def save_shards(bam_files, n_shards, directory, chunksize=1000, name="s"):
+    paths = []
+    for shard in range(1, n_shards + 1):
+        path = directory / "{0}{1}.npz".format(name, shard)
+        extract_shard(bam_files, shard, n_shards, chunksize).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize(["value", "expected"], [
+    ("1/1", (1, 1)), ("3/4", (3, 4))])
+def test_parse_shard(value, expected):
+    assert parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ["0/4", "5/4", "1", "a/b", "1/"])
+def test_parse_shard_error(value):
+    with pytest.raises(ValueError):
+        parse_shard(value)
+
+
+def test_shard_slice():
+    files = list(range(10))
+    shards = [files[shard_slice(10, i, 4)] for i in range(1, 5)]
+    assert sum(shards, []) == files
+    assert [len(shard) for shard in shards] == [2, 3, 2, 3]
+
+
+def test_list_digest(monkeypatch, tmp_path):
+    bams = [Path("a.bam"), Path("sub/b.bam")]
+    digest = list_digest(bams)
+    # nodes may run the same list of relative paths from other directories
+    monkeypatch.chdir(str(tmp_path))
+    assert list_digest(bams) == digest
+    assert list_digest(bams[::-1]) != digest
+
+
+def test_gather_shards(micro_bam, micro_bam2, shard_dir):
+    bams = [micro_bam, micro_bam2, micro_bam2]
+    paths = save_shards(bams, 2, shard_dir)
+    # the order of the shard files does not matter
+    arr_X, names, chunksize, contig = gather_shards(paths[::-1])
+    expected_X, _ = make_array_set(bams, [], 1000)
+    np.testing.assert_array_equal(arr_X, expected_X)
+    assert names == [str(bam) for bam in bams]
+    assert (chunksize, contig) == (1000, "chrM")
+
+
+def test_gather_empty_shard(micro_bam, shard_dir):
+    paths = save_shards([micro_bam], 3, shard_dir)
+    assert [len(FeatureShard.load(path)) for path in paths] == [0, 0, 1]
+    arr_X, names, _, _ = gather_shards(paths)
+    assert arr_X.shape[0] == 1
+    assert names == [str(micro_bam)]
+
+
+def test_gather_shards_missing(micro_bam, micro_bam2, shard_dir):
+    paths = save_shards([micro_bam, micro_bam2], 2, shard_dir)
+    with pytest.raises(ValueError) as excinfo:
+        gather_shards(paths[:1])
+    assert "missing: [2]" in str(excinfo.value)
+    with pytest.raises(ValueError):
+        gather_shards(paths + paths[:1])
+
+
+def test_gather_shards_chunksize(micro_bam, micro_bam2, shard_dir):
+    bams = [micro_bam, micro_bam2]
+    first = save_shards(bams, 2, shard_dir, 1000, "a")
+    second = save_shards(bams, 2, shard_dir, 500, "b")
+    with pytest.raises(ValueError) as excinfo:
+        gather_shards([first[0], second[1]])
+    assert "chunksize 500" in str(excinfo.value)
+
+
+def test_gather_shards_other_list(micro_bam, micro_bam2, shard_dir):
+    first = save_shards([micro_bam, micro_bam2], 2, shard_dir, name="a")
+    second = save_shards([micro_bam2, micro_bam], 2, shard_dir, name="b")
+    with pytest.raises(ValueError):
+        gather_shards([first[0], second[1]])
+
+
+def test_load_shard_error(temp_path):
+    temp_path.write_bytes(b"not a shard")
+    with pytest.raises(ValueError):
+        FeatureShard.load(temp_path)
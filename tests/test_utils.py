@@ -20,8 +20,11 @@ from pathlib import Path
 from rna_cd.utils import (load_list_file, dir_to_bam_list,
                           save_sklearn_object_to_disk,
                           load_sklearn_object_from_disk, get_sklearn_version,
-                          get_rna_cd_version)
+                          get_rna_cd_version, is_binary_model,
+                          load_model_metadata, migrate_model,
+                          parse_version)
 import json
+import numpy as np
 import pytest
 
 
@@ -49,6 +52,27 @@ def test_dir_to_bam_list(data_dir):
     assert sorted(loaded) == sorted(exp)
 
 
+@pytest.mark.parametrize("version, expected", [
+    ("0.20.0", (0, 20)),
+    ("0.20", (0, 20)),
+    ("1.2rc1", (1, 2)),
+    ("0.24.2.post1", (0, 24, 2)),
+    ("0", (0,))
+])
+def test_parse_version(version, expected):
+    assert parse_version(version) == expected
+
+
+def test_parse_version_order():
+    assert parse_version("0.19.2") < parse_version("0.20.0")
+    assert parse_version("1.10") > parse_version("1.9.1")
+
+
+def test_parse_version_invalid():
+    with pytest.raises(ValueError):
+        parse_version("dev")
+
+
 def test_save_to_disk(temp_path):
     an_obj = "some_string"
     save_sklearn_object_to_disk(an_obj, temp_path)
@@ -71,3 +95,35 @@ def test_load_invalid(data_dir):
         load_sklearn_object_from_disk(invalid_path)
     assert exp.match("We do not support loading objects with sklearn versions "
                      "below 0.20.0")
+
+
+def test_binary_round_trip(temp_path, trained_model):
+    save_sklearn_object_to_disk(trained_model, temp_path, binary=True)
+    assert is_binary_model(temp_path)
+    metadata = load_model_metadata(temp_path)
+    assert metadata["chunksize"] == 1000
+    assert metadata["sklearn_version"] == get_sklearn_version()
+    loaded = load_sklearn_object_from_disk(temp_path)
+    arr = np.random.rand(3, 51)
+    np.testing.assert_array_equal(loaded.predict_proba(arr),
+                                  trained_model.predict_proba(arr))
+
+
+def test_json_is_not_binary(data_dir):
+    assert not is_binary_model(data_dir / Path("valid_obj.json"))
+
+
+def test_migrate_model(data_dir, temp_path):
+    migrate_model(data_dir / Path("valid_obj.json"), temp_path)
+    assert is_binary_model(temp_path)
+    assert load_sklearn_object_from_disk(temp_path) == "some_string"
+    assert load_model_metadata(temp_path)["migrated_from"] == "valid_obj.json"
+
+
+def test_load_invalid_binary(temp_path):
+    save_sklearn_object_to_disk("some_string", temp_path, binary=True,
+                                metadata={"sklearn_version": "0.19.2"})
+    with pytest.raises(ValueError) as exp:
+        load_sklearn_object_from_disk(temp_path)
+    assert exp.match("We do not support loading objects with sklearn versions "
+                     "below 0.20.0")